@@ -32,6 +32,7 @@ from artifact_reference import (encode_artifact,
                                 decode_artifact_reference)
 from idgen import IdentifierGenerator
 from route_map import RouteMap
+from bloomfilter import BloomFilter
 from timer_event_source import TimerEventSource, Timer
 from proxy_event_source import ProxyEventSource
 from json_router import JsonRouter
@@ -69,5 +70,6 @@ from distbuild_socket import create_socket
 
 from subprocess_eventsrc import (FileReadable, FileWriteable,
                                  SubprocessEventSource)
+from http_event_source import HttpEventSource, HttpResponse
 
 __all__ = locals()
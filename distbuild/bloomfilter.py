@@ -0,0 +1,86 @@
+# distbuild/bloomfilter.py -- compact summary of a set of strings
+#
+# Copyright (C) 2026  Codethink Limited
+# 
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import base64
+import hashlib
+import math
+import zlib
+
+
+class BloomFilter(object):
+
+    '''A probabilistic set of strings.
+
+    Workers use this to tell the controller which artifacts they have in
+    their local artifact cache, without sending the whole list. Testing
+    for membership never gives a false negative, but may give a false
+    positive with a probability of about `error_rate`.
+
+    The filter is sized when it is created, from the number of strings
+    that will be added to it.
+
+    '''
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(1, capacity)
+        bits = -capacity * math.log(error_rate) / (math.log(2) ** 2)
+        self.bits = max(8, int(math.ceil(bits)))
+        self.hashes = max(1, int(round(self.bits / capacity * math.log(2))))
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, item):
+        # Double hashing: two independent hash values are enough to
+        # derive any number of positions.
+        digest = hashlib.sha1(item).hexdigest()
+        h1 = int(digest[:20], 16)
+        h2 = int(digest[20:], 16)
+        for i in xrange(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self._array[pos // 8] |= 1 << (pos % 8)
+
+    def __contains__(self, item):
+        return all(self._array[pos // 8] & (1 << (pos % 8))
+                   for pos in self._positions(item))
+
+    def encode(self):
+        '''Return the filter as a dict that can be sent in a message.'''
+
+        return {
+            'bits': self.bits,
+            'hashes': self.hashes,
+            'data': base64.b64encode(zlib.compress(str(self._array))),
+        }
+
+    @classmethod
+    def decode(cls, encoded):
+        '''Recreate a filter from the result of `encode`.'''
+
+        bloom = cls.__new__(cls)
+        bloom.bits = encoded['bits']
+        bloom.hashes = encoded['hashes']
+        try:
+            bloom._array = bytearray(
+                zlib.decompress(base64.b64decode(encoded['data'])))
+        except (TypeError, zlib.error) as e:
+            raise ValueError('Bad Bloom filter data: %s' % e)
+        if len(bloom._array) != (bloom.bits + 7) // 8:
+            raise ValueError('Bloom filter has %d bytes for %d bits' %
+                             (len(bloom._array), bloom.bits))
+        return bloom
@@ -0,0 +1,51 @@
+# distbuild/bloomfilter_tests.py -- unit tests for BloomFilter
+#
+# Copyright (C) 2026  Codethink Limited
+# 
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+
+import distbuild
+
+
+class BloomFilterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.items = ['%040x.chunk.foo-%d' % (i, i) for i in range(100)]
+        self.bloom = distbuild.BloomFilter(len(self.items))
+        for item in self.items:
+            self.bloom.add(item)
+
+    def test_empty_filter_contains_nothing(self):
+        self.assertFalse('foo' in distbuild.BloomFilter(0))
+
+    def test_contains_added_items(self):
+        for item in self.items:
+            self.assertTrue(item in self.bloom)
+
+    def test_rarely_contains_other_items(self):
+        others = ['%040x.chunk.bar' % i for i in range(1000)]
+        false_positives = len([x for x in others if x in self.bloom])
+        self.assertTrue(false_positives < 50)
+
+    def test_survives_encoding(self):
+        decoded = distbuild.BloomFilter.decode(self.bloom.encode())
+        for item in self.items:
+            self.assertTrue(item in decoded)
+
+    def test_rejects_truncated_data(self):
+        encoded = self.bloom.encode()
+        encoded['bits'] *= 2
+        self.assertRaises(ValueError, distbuild.BloomFilter.decode, encoded)
@@ -162,8 +162,9 @@ class HelperRouter(distbuild.StateMachine):
         logging.debug('HelperRouter: closing: %s', repr(event_source))
         event_source.close()
 
-        # Remove from pending helpers.
-        if event_source in self._pending_helpers:
+        # Remove from pending helpers. There is one entry for each request
+        # that the helper was ready to run.
+        while event_source in self._pending_helpers:
             self._pending_helpers.remove(event_source)
 
         # Re-queue any requests running on the hlper that just quit.
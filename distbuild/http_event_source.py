@@ -0,0 +1,192 @@
+# distbuild/http_event_source.py -- make HTTP requests without blocking
+#
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import collections
+import errno
+import httplib
+import logging
+import os
+import Queue
+import socket
+import threading
+import urlparse
+
+import distbuild
+
+
+class HttpResponse(object):
+
+    def __init__(self, request_id, status, body):
+        self.request_id = request_id
+        self.status = status
+        self.body = body
+
+
+class HttpEventSource(distbuild.EventSource):
+
+    '''Event source for HTTP requests that run in the background.
+
+    Requests are added with `add`, and are carried out by a pool of
+    threads, so that many can be in flight at once and a slow server does
+    not hold up anything else. When a request completes, an HttpResponse
+    event is returned with the same request id.
+
+    Connections are kept open after a request if the server allows it, and
+    reused for the next request to the same host.
+
+    The threads tell the main loop that a response is ready by writing to
+    a pipe, which is the file descriptor this event source watches. Once
+    the event source is closed, requests still running are left to finish
+    but their responses are dropped.
+
+    '''
+
+    def __init__(self, threads=8, timeout=None):
+        self._timeout = timeout
+        self._requests = Queue.Queue()
+        self._responses = collections.deque()
+        self._idle_connections = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self.closed = False
+
+        self._read_fd, self._write_fd = os.pipe()
+        distbuild.set_nonblocking(self._read_fd)
+        distbuild.set_nonblocking(self._write_fd)
+
+        self._threads = []
+        for i in xrange(threads):
+            thread = threading.Thread(target=self._run_requests)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def get_select_params(self):
+        return [self._read_fd], [], [], None
+
+    def get_events(self, r, w, x):
+        if self._read_fd not in r:
+            return []
+        try:
+            os.read(self._read_fd, 4096)
+        except OSError:
+            pass
+        events = []
+        while self._responses:
+            events.append(self._responses.popleft())
+        return events
+
+    def add(self, request_id, method, url, body=None, headers=None):
+        '''Start an HTTP request.'''
+
+        assert method in ('HEAD', 'GET', 'POST')
+        logging.debug('HES: queuing %s %s for %s', method, url, request_id)
+        self._requests.put((request_id, method, url, body, headers))
+
+    def close(self):
+        for thread in self._threads:
+            self._requests.put(None)
+        # Threads only write to the pipe while holding the lock, and not
+        # once the event source is closed.
+        with self._lock:
+            self.closed = True
+            for connections in self._idle_connections.itervalues():
+                for conn in connections:
+                    conn.close()
+            self._idle_connections.clear()
+            os.close(self._read_fd)
+            os.close(self._write_fd)
+
+    def is_finished(self):
+        return self.closed
+
+    def _run_requests(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            request_id = request[0]
+            try:
+                status, body = self._do_request(*request[1:])
+            except (socket.error, httplib.HTTPException), e:
+                status = 418 # teapot
+                body = str(e)
+            except Exception, e:
+                logging.exception('HES: request %s failed', request_id)
+                status = 418
+                body = str(e)
+            with self._lock:
+                if self.closed:
+                    return
+                self._responses.append(
+                    HttpResponse(request_id, status, body))
+                try:
+                    os.write(self._write_fd, 'x')
+                except OSError, e:  # pragma: no cover
+                    # A full pipe will wake the main loop anyway.
+                    if e.errno != errno.EAGAIN:
+                        raise
+
+    def _get_connection(self, netloc):
+        with self._lock:
+            if self._idle_connections[netloc]:
+                return self._idle_connections[netloc].pop(), True
+        return httplib.HTTPConnection(netloc, timeout=self._timeout), False
+
+    def _put_connection(self, netloc, conn):
+        with self._lock:
+            if self.closed:
+                conn.close()
+            else:
+                self._idle_connections[netloc].append(conn)
+
+    def _do_request(self, method, url, body, headers):
+        schema, netloc, path, query, fragment = urlparse.urlsplit(url)
+        assert schema == 'http'
+        if query:
+            path += '?' + query
+
+        conn, reused = self._get_connection(netloc)
+        try:
+            res, data = self._send(conn, method, path, body, headers)
+        except (socket.error, httplib.HTTPException):
+            conn.close()
+            if not reused:
+                raise
+            # The server may have closed an idle connection, so try once
+            # more with a new one.
+            logging.debug('HES: reused connection to %s failed, retrying',
+                          netloc)
+            conn = httplib.HTTPConnection(netloc, timeout=self._timeout)
+            try:
+                res, data = self._send(conn, method, path, body, headers)
+            except (socket.error, httplib.HTTPException):
+                conn.close()
+                raise
+
+        if res.will_close:
+            conn.close()
+        else:
+            self._put_connection(netloc, conn)
+        return res.status, data
+
+    def _send(self, conn, method, path, body, headers):
+        if headers:
+            conn.request(method, path, body, headers)
+        else:
+            conn.request(method, path, body)
+        res = conn.getresponse()
+        return res, res.read()
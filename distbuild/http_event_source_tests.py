@@ -0,0 +1,125 @@
+# distbuild/http_event_source_tests.py -- unit tests
+#
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import BaseHTTPServer
+import logging
+import select
+import socket
+import threading
+import unittest
+
+import distbuild
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = 'got %s' % self.path
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Drop the connection without telling the client, as a server
+        # that times out idle connections would.
+        if self.path == '/hangup':
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpEventSourceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        self.server_thread = threading.Thread(
+            target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.es = distbuild.HttpEventSource(threads=2, timeout=10)
+
+    def tearDown(self):
+        if not self.es.closed:
+            self.es.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def wait_for_responses(self, count):
+        responses = []
+        while len(responses) < count:
+            r, w, x, timeout = self.es.get_select_params()
+            r, w, x = select.select(r, w, x, 10)
+            self.assertTrue(r, 'timed out waiting for a response')
+            responses.extend(self.es.get_events(r, w, x))
+        return responses
+
+    def test_reports_no_events_until_woken(self):
+        self.assertEqual(self.es.get_events([], [], []), [])
+
+    def test_returns_response_with_request_id(self):
+        self.es.add('req1', 'GET', self.url + '/foo')
+        [response] = self.wait_for_responses(1)
+        self.assertEqual(response.request_id, 'req1')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.body, 'got /foo')
+
+    def test_reuses_connection_for_next_request(self):
+        self.es.add('req1', 'GET', self.url + '/foo')
+        self.wait_for_responses(1)
+        self.es.add('req2', 'GET', self.url + '/foo?bar=1')
+        [response] = self.wait_for_responses(1)
+        self.assertEqual(response.body, 'got /foo?bar=1')
+
+    def test_retries_when_reused_connection_was_closed(self):
+        self.es.add('req1', 'GET', self.url + '/hangup')
+        self.wait_for_responses(1)
+        self.es.add('req2', 'GET', self.url + '/after')
+        [response] = self.wait_for_responses(1)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.body, 'got /after')
+
+    def test_reports_connection_failure(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        self.es.add('req1', 'GET', 'http://127.0.0.1:%d/' % port)
+        [response] = self.wait_for_responses(1)
+        self.assertEqual(response.request_id, 'req1')
+        self.assertEqual(response.status, 418)
+
+    def test_reports_unexpected_failure(self):
+        logging.disable(logging.CRITICAL)
+        try:
+            self.es.add('req1', 'GET', 'ftp://127.0.0.1/')
+            [response] = self.wait_for_responses(1)
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(response.status, 418)
+
+    def test_drops_responses_after_close(self):
+        self.es.add('req1', 'GET', self.url + '/foo')
+        self.wait_for_responses(1)
+        self.es.add('req2', 'GET', self.url + '/foo')
+        self.es.close()
+        self.assertTrue(self.es.is_finished())
+        for thread in self.es._threads:
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
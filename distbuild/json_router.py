@@ -31,6 +31,26 @@ class JsonRouter(distbuild.StateMachine):
     sent to the next free helper. The helper's response will retain
     the unique id, so that the response can be routed to the right
     client.
+
+    A helper may be able to run more than one request at once, in which
+    case it sends one helper-ready message for each request it can take.
+
+    Clients can also ask how many jobs this worker can run at once, using
+    a capacity-request message. The reply is built from the dict returned
+    by `get_capacity`. After that, and whenever a job finishes, the client
+    is sent a cache-summary message, containing the encoded BloomFilter
+    returned by `get_cache_summary`, so that the controller can give jobs
+    to workers that already have their dependencies.
+
+    If `pin_artifacts` is given, clients can also keep artifacts in the
+    worker's local cache, for example while they are being uploaded to
+    the shared cache, with a pin-request message naming their cache keys.
+    `pin_artifacts` is called with the cache keys and returns a function
+    that drops the pin. That is called when the client sends pin-release
+    with the same id, or disconnects.
+
+    Messages of a type the router does not know, for example from a newer
+    controller, are answered with an error-response message.
     
     '''
 
@@ -40,9 +60,14 @@ class JsonRouter(distbuild.StateMachine):
     request_counter = distbuild.IdentifierGenerator('JsonRouter')
     route_map = distbuild.RouteMap()
 
-    def __init__(self, conn):
+    def __init__(self, conn, get_capacity=None, get_cache_summary=None,
+                 pin_artifacts=None):
         distbuild.StateMachine.__init__(self, 'idle')
         self.conn = conn
+        self.get_capacity = get_capacity
+        self.get_cache_summary = get_cache_summary
+        self.pin_artifacts = pin_artifacts
+        self.pins = {}
         logging.debug('JsonMachine: connection from %s', conn.getpeername())
 
     def setup(self):
@@ -72,9 +97,25 @@ class JsonRouter(distbuild.StateMachine):
             'exec-output': self.do_exec_output,
             'exec-response': self.do_response,
             'helper-ready': self.do_helper_ready,
+            'capacity-request': self.do_capacity_request,
+            'pin-request': self.do_pin_request,
+            'pin-release': self.do_pin_release,
         }
         handler = handlers.get(event.msg['type'])
-        handler(event_source, event)
+        if handler is None:
+            self.do_unknown(event_source, event)
+        else:
+            handler(event_source, event)
+
+    def do_unknown(self, client, event):
+        logging.warning('JsonRouter: ignoring unknown message type %s',
+                        event.msg['type'])
+        if 'id' not in event.msg:
+            return
+        msg = distbuild.message(
+            'error-response', id=event.msg['id'],
+            reason='unknown message type %s' % event.msg['type'])
+        client.send(msg)
 
     def do_request(self, client, event):
         self._enqueue_request(client, event.msg)
@@ -100,6 +141,49 @@ class JsonRouter(distbuild.StateMachine):
             new['id'] = self.route_map.get_incoming_id(msg['id'])
             client.send(new)
             logging.debug('JsonRouter: sent to client: %s', repr(new))
+            if new['type'] == 'exec-response':
+                self._send_cache_summary(client, new['id'])
+
+    def do_capacity_request(self, client, event):
+        capacity = {
+            'slots': 1,
+            'cpus': 1,
+            'memory': 0,
+            'disk': 0,
+        }
+        if self.get_capacity is not None:
+            capacity.update(self.get_capacity())
+        if self.pin_artifacts is not None:
+            capacity['pins'] = True
+        msg = distbuild.message('capacity-response', id=event.msg['id'],
+                                **capacity)
+        client.send(msg)
+        logging.debug('JsonRouter: sent to client: %s', repr(msg))
+        self._send_cache_summary(client, event.msg['id'])
+
+    def do_pin_request(self, client, event):
+        if self.pin_artifacts is None:
+            self.do_unknown(client, event)
+            return
+        self.do_pin_release(client, event)
+        self.pins[event.msg['id']] = self.pin_artifacts(
+            event.msg['cache_keys'])
+        logging.debug('JsonRouter: pinned %s for %s',
+                      event.msg['cache_keys'], event.msg['id'])
+
+    def do_pin_release(self, client, event):
+        release = self.pins.pop(event.msg['id'], None)
+        if release is not None:
+            release()
+            logging.debug('JsonRouter: released pin %s', event.msg['id'])
+
+    def _send_cache_summary(self, client, request_id):
+        if self.get_cache_summary is None:
+            return
+        msg = distbuild.message('cache-summary', id=request_id,
+                                filter=self.get_cache_summary().encode())
+        client.send(msg)
+        logging.debug('JsonRouter: sent cache summary to client')
 
     def do_helper_ready(self, helper, event):
         self.pending_helpers.append(helper)
@@ -119,8 +203,14 @@ class JsonRouter(distbuild.StateMachine):
         logging.debug('closing: %s', repr(event_source))
         event_source.close()
 
-        # Remove from pending helpers.
-        if event_source in self.pending_helpers:
+        # Drop the pins held for this client.
+        for release in self.pins.values():
+            release()
+        self.pins.clear()
+
+        # Remove from pending helpers. There is one entry for each request
+        # that the helper was ready to run.
+        while event_source in self.pending_helpers:
             self.pending_helpers.remove(event_source)
 
         # Remove from running requests, and put the request back in the
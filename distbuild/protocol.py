@@ -86,6 +86,31 @@ _required_fields = {
     'exec-cancel': [
         'id',
     ],
+    'capacity-request': [
+        'id',
+    ],
+    'capacity-response': [
+        'id',
+        'slots',
+        'cpus',
+        'memory',
+        'disk',
+    ],
+    'cache-summary': [
+        'id',
+        'filter',
+    ],
+    'error-response': [
+        'id',
+        'reason',
+    ],
+    'pin-request': [
+        'id',
+        'cache_keys',
+    ],
+    'pin-release': [
+        'id',
+    ],
     'http-request': [
         'id',
         'url',
@@ -126,7 +151,10 @@ _optional_fields = {
     'build-request': [
         'original_ref',
         'component_names'
-    ]
+    ],
+    'capacity-response': [
+        'pins',
+    ],
 }
 
 
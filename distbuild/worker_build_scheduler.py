@@ -19,6 +19,7 @@ import collections
 import httplib
 import logging
 import socket
+import time
 import urllib
 import urlparse
 
@@ -108,6 +109,7 @@ class Job(object):
         self.who = None  # we don't know who's going to do this yet
 
         self._state = 'queued'
+        self._dependencies = None
 
     def describe_state(self):
         if self.who is not None:
@@ -124,6 +126,17 @@ class Job(object):
     def failed(self):
         return self._state == 'failed'
 
+    def dependencies(self):
+        '''Return the basenames of the artifacts the job depends on.'''
+
+        # Walking the build graph is slow, and the job may be looked at
+        # every time a worker has a free slot.
+        if self._dependencies is None:
+            self._dependencies = [
+                a.basename() for a in self.artifact.walk()
+                if a is not None and a is not self.artifact]
+        return self._dependencies
+
     def set_state(self, state):
         assert state in ['queued', 'running', 'complete', 'failed']
         logging.debug('Setting job state for job %s with id %s to %s',
@@ -207,17 +220,14 @@ class _BuildFinished(object):
 
 class _BuildFailed(object):
 
-    pass
-
-
-class _BuildCancelled(object):
+    def __init__(self, job):
+        self.job = job
 
-    pass
 
-        
 class _Cached(object):
 
-    pass
+    def __init__(self, job):
+        self.job = job
 
 
 class _JobStarted(object):
@@ -387,8 +397,32 @@ class WorkerBuildQueuer(distbuild.StateMachine):
         if job:
             self._give_job(job)
             
+    def _choose_worker(self, job):
+        '''Return the index of the best available worker for 'job'.
+
+        Jobs go to the worker that already has the most of the job's
+        dependencies in its local artifact cache, as those don't need to be
+        downloaded before the job can start.
+
+        Each free job slot on a worker is a separate entry in
+        self._available_workers. Between equally good workers, jobs go to
+        the one with the most free slots, so that a big worker is filled up
+        in step with the others rather than having all its jobs compete with
+        each other for its CPUs while another worker is idle.
+
+        '''
+        dependencies = job.dependencies()
+        free = collections.Counter(w.who for w in self._available_workers)
+        score = dict((who, (who.count_cached(dependencies), free[who]))
+                     for who in free)
+        best = 0
+        for i, worker in enumerate(self._available_workers):
+            if score[worker.who] > score[self._available_workers[best].who]:
+                best = i
+        return best
+
     def _give_job(self, job):
-        worker = self._available_workers.pop(0)
+        worker = self._available_workers.pop(self._choose_worker(job))
         job.who = worker.who
 
         logging.debug(
@@ -398,15 +432,15 @@ class WorkerBuildQueuer(distbuild.StateMachine):
         self.mainloop.queue_event(worker.who, _HaveAJob(job))
 
     def _handle_worker_disconnected(self, event_source, event):
-        self._remove_worker(self, event.who)
+        self._remove_worker(event.who)
 
     def _remove_worker(self, worker):
         logging.debug('WBQ: Removing worker %s from queue', worker.name())
 
-        # There should only be one InitiatorConnection instance per worker in
-        # the _available_workers list. But anything can happen in space! So we
-        # take care to remove all GiveJob messages in the list that came from
-        # the disconnected worker, not the first.
+        # There is one _NeedJob message in the _available_workers list for
+        # each free job slot that the worker has, so we take care to remove
+        # all the messages in the list that came from the disconnected worker,
+        # not just the first.
         self._available_workers = filter(
             lambda worker_msg: worker_msg.who != worker,
             self._available_workers)
@@ -414,19 +448,51 @@ class WorkerBuildQueuer(distbuild.StateMachine):
 
 class WorkerConnection(distbuild.StateMachine):
 
-    '''Communicate with a single worker.'''
+    '''Communicate with a single worker.
+
+    When the connection is made, the worker is asked for its capacity: how
+    many jobs it can run at once, and how many CPUs, bytes of memory and
+    bytes of disk it has. The number of job slots is limited so that each
+    running job has at least the memory and disk given in
+    `job_requirements`. One _NeedJob event is sent for each free slot, and
+    each job is given an equal share of the worker's CPUs as its
+    `--max-jobs` setting. Until the worker answers, and if it never does
+    because it is too old to know about capacity-request, it is given one
+    job at a time.
+
+    The worker also sends a summary of the contents of its local artifact
+    cache, which the WorkerBuildQueuer uses to decide which worker should
+    get a job.
+
+    If the worker can pin artifacts in its local artifact cache, each
+    job's artifacts are pinned when it starts and the pin is released
+    once they are uploaded to the shared artifact cache. The job's slot is
+    then freed as soon as the build succeeds, and the upload carries on in
+    the background while the worker builds something else, which cannot
+    remove the pinned artifacts from the worker's cache. Workers that
+    can't pin artifacts keep the slot until the upload is done. The job is
+    only reported as finished once the upload is done, so nothing that
+    depends on it is started before its artifacts can be fetched.
+
+    A job that is cancelled while its artifacts are being uploaded has no
+    build left to cancel, so the upload is left to finish.
+
+    '''
     
     _request_ids = distbuild.IdentifierGenerator('WorkerConnection')
     _initiator_request_map = collections.defaultdict(set)
 
     def __init__(self, cm, conn, writeable_cache_server, 
-                 worker_cache_server_port, morph_instance):
+                 worker_cache_server_port, morph_instance,
+                 build_history=None, job_requirements=None):
         distbuild.StateMachine.__init__(self, 'idle')
         self._cm = cm
         self._conn = conn
         self._writeable_cache_server = writeable_cache_server
         self._worker_cache_server_port = worker_cache_server_port
         self._morph_instance = morph_instance
+        self._build_history = build_history
+        self._job_requirements = job_requirements or {}
         self._debug_exec_output = False
 
         addr, port = self._conn.getpeername()
@@ -435,12 +501,37 @@ class WorkerConnection(distbuild.StateMachine):
 
         self._jobs = JobQueue(owner=self.name())
 
+        # Until the worker tells us otherwise, assume that it can run one
+        # job at a time.
+        self._slots = 1
+        self._max_jobs_per_slot = None
+        self._busy_slots = set()
+        self._requested_jobs = 0
+        self._uploads = set()
+        self._can_pin = False
+
+        self._cache_summary = None
+
     def name(self):
         return self._worker_name
 
     def __str__(self):
         return self.name()
 
+    def free_slots(self):
+        return self._slots - len(self._busy_slots)
+
+    def count_cached(self, basenames):
+        '''Count how many of the given artifacts the worker has cached.
+
+        This is an estimate, as the worker only sends a Bloom filter of
+        the contents of its cache, which was correct when it was sent.
+
+        '''
+        if self._cache_summary is None:
+            return 0
+        return len([b for b in basenames if b in self._cache_summary])
+
     def setup(self):
         distbuild.crash_point()
 
@@ -452,29 +543,26 @@ class WorkerConnection(distbuild.StateMachine):
         spec = [
             # state, source, event_class, new_state, callback
             ('idle', self._jm, distbuild.JsonEof, None,  self._disconnected),
-            ('idle', self, _HaveAJob, 'building', self._start_build),
-            
-            ('building', distbuild.BuildController,
-                distbuild.BuildCancel, 'building',
+            ('idle', self._jm, distbuild.JsonNewMessage, 'idle',
+                self._handle_json_message),
+            ('idle', self, _HaveAJob, 'idle', self._start_build),
+            ('idle', distbuild.BuildController, distbuild.BuildCancel, 'idle',
                 self._maybe_cancel),
 
-            ('building', self._jm, distbuild.JsonEof, None,
-                self._disconnected),
-            ('building', self._jm, distbuild.JsonNewMessage, 'building',
-                self._handle_json_message),
-            ('building', self, _BuildFailed, 'idle', self._request_job),
-            ('building', self, _BuildCancelled, 'idle', self._request_job),
-            ('building', self, _BuildFinished, 'caching',
-                self._request_caching),
-
-            ('caching', self._jm, distbuild.JsonEof, None, self._disconnected),
-            ('caching', distbuild.HelperRouter, distbuild.HelperResult,
-                'caching', self._maybe_handle_helper_result),
-            ('caching', self, _Cached, 'idle', self._request_job),
-            ('caching', self, _BuildFailed, 'idle', self._request_job),
+            ('idle', self, _BuildFailed, 'idle', self._finish_job),
+            ('idle', self, _BuildFinished, 'idle', self._request_caching),
+
+            ('idle', distbuild.HelperRouter, distbuild.HelperResult, 'idle',
+                self._maybe_handle_helper_result),
+            ('idle', self, _Cached, 'idle', self._finish_job),
         ]
         self.add_transitions(spec)
-        
+
+        msg = distbuild.message('capacity-request',
+                                id=self._request_ids.next())
+        self._jm.send(msg)
+        # Workers that don't understand capacity-request never answer, so
+        # use the one slot assumed above straight away.
         self._request_job(None, None)
 
     def _maybe_cancel(self, event_source, build_cancel):
@@ -503,6 +591,13 @@ class WorkerConnection(distbuild.StateMachine):
                 job.initiators.remove(initiator_id)
 
     def _cancel_job(self, job):
+        if job.id in self._uploads:
+            logging.debug(
+                'WC: Not cancelling job %s, its build is finished and its '
+                'artifacts are being uploaded from %s',
+                job.artifact.basename(), self.name())
+            return
+
         logging.debug(
             'WC: Cancelling job %s, currently building on %s',
             job.artifact.basename(), self.name())
@@ -516,8 +611,10 @@ class WorkerConnection(distbuild.StateMachine):
         # not being started since the cancelled job would still be 'running'.
         # The new build will then fail when the exec-response for the old
         # build finally arrives.
+        #
+        # The job keeps its slot on the worker until the exec-response
+        # arrives, as the worker is still busy until the build is killed.
         job.set_state('failed')
-        self.mainloop.queue_event(self, _BuildCancelled())
 
     def _disconnected(self, event_source, event):
         distbuild.crash_point()
@@ -535,10 +632,10 @@ class WorkerConnection(distbuild.StateMachine):
             logging.warn('Worker %s already has job %s', self.name(),
                          job.id)
 
-        running_jobs = self._jobs.running_jobs()
-        if len(running_jobs) != 0:
-            logging.warn('This worker already has running jobs: %s',
-                         running_jobs)
+        if self.free_slots() <= 0:
+            logging.warn('Worker %s has no free job slots, but was given '
+                         '%s. Running jobs: %s', self.name(), job.id,
+                         self._jobs.running_jobs())
 
     def _start_build(self, event_source, event):
         distbuild.crash_point()
@@ -547,7 +644,10 @@ class WorkerConnection(distbuild.StateMachine):
         self._sanity_check_new_job(job)
 
         self._jobs.add(job)
+        self._busy_slots.add(job.id)
+        self._requested_jobs -= 1
         job.set_state('running')
+        job._started_time = time.time()
 
         logging.debug('WC: starting build: %s for %s' %
                       (job.artifact.name, job.initiators))
@@ -556,8 +656,16 @@ class WorkerConnection(distbuild.StateMachine):
             self._morph_instance,
             'worker-build',
             '--build-log-on-stdout',
-            job.artifact.name,
         ]
+        if self._max_jobs_per_slot is not None:
+            argv.append('--max-jobs=%d' % self._max_jobs_per_slot)
+        argv.append(job.artifact.name)
+
+        if self._can_pin:
+            msg = distbuild.message('pin-request', id=job.id,
+                                    cache_keys=[job.artifact.cache_key])
+            self._jm.send(msg)
+            job._pinned = True
 
         msg = distbuild.message('exec-request',
             id=job.id,
@@ -582,12 +690,27 @@ class WorkerConnection(distbuild.StateMachine):
         logging.debug(
             'WC: from worker %s: %r' % (self._worker_name, event.msg))
 
+        if event.msg['type'] == 'capacity-response':
+            self._handle_capacity_response(event.msg)
+            return
+        if event.msg['type'] == 'cache-summary':
+            self._handle_cache_summary(event.msg)
+            return
+        if event.msg['type'] == 'error-response':
+            logging.warning('WC: worker %s could not handle a request: %s',
+                            self.name(), event.msg['reason'])
+            return
+
         handlers = {
             'exec-output': self._handle_exec_output,
             'exec-response': self._handle_exec_response,
         }
 
-        handler = handlers[event.msg['type']]
+        handler = handlers.get(event.msg['type'])
+        if handler is None:
+            logging.warning('WC: ignoring unknown message type %s from %s',
+                            event.msg['type'], self.name())
+            return
         job = self._jobs.get_job_for_id(event.msg['id'])
 
         if job:
@@ -596,6 +719,31 @@ class WorkerConnection(distbuild.StateMachine):
             logging.warn('Received %s for unknown job %s',
                          event.msg['type'], event.msg['id'])
 
+    def _handle_capacity_response(self, msg):
+        '''Work out how many jobs the worker can run at once.'''
+
+        slots = max(1, msg['slots'])
+        for resource in ('memory', 'disk'):
+            needed = self._job_requirements.get(resource)
+            if needed:
+                slots = max(1, min(slots, msg[resource] // needed))
+        self._max_jobs_per_slot = max(1, msg['cpus'] // slots)
+
+        logging.info('WC: worker %s has %d job slots (reported %s), each '
+                     'with --max-jobs=%d', self.name(), slots, repr(msg),
+                     self._max_jobs_per_slot)
+
+        self._slots = slots
+        self._can_pin = msg.get('pins', False)
+        self._request_job(None, None)
+
+    def _handle_cache_summary(self, msg):
+        try:
+            self._cache_summary = distbuild.BloomFilter.decode(msg['filter'])
+        except (KeyError, TypeError, ValueError) as e:
+            logging.warning('WC: ignoring bad cache summary from %s: %s',
+                            self.name(), e)
+
     def _handle_exec_output(self, msg, job):
         '''Handle output from a job that the worker is or was running.'''
 
@@ -622,15 +770,33 @@ class WorkerConnection(distbuild.StateMachine):
             new_event = WorkerBuildFailed(new, job.artifact.cache_key)
             self.mainloop.queue_event(WorkerConnection, new_event)
             self.mainloop.queue_event(WorkerConnection, _JobFailed(job))
-            self.mainloop.queue_event(self, _BuildFailed())
+            self.mainloop.queue_event(self, _BuildFailed(job))
         else:
             # Build succeeded. We have more work to do: caching the result.
             self.mainloop.queue_event(self, _BuildFinished(job))
             job._exec_response = new
+            job._built_time = time.time()
+
+    def _release_slot(self, job):
+        if job.id in self._busy_slots:
+            self._busy_slots.remove(job.id)
+            self._request_job(None, None)
 
     def _request_job(self, event_source, event):
+        '''Ask the WorkerBuildQueuer for a job for every free slot.'''
         distbuild.crash_point()
-        self.mainloop.queue_event(WorkerConnection, _NeedJob(self))
+        while self._requested_jobs < self.free_slots():
+            self._requested_jobs += 1
+            self.mainloop.queue_event(WorkerConnection, _NeedJob(self))
+
+    def _finish_job(self, event_source, event):
+        '''Forget a job that has failed, or whose results are uploaded.'''
+        job = event.job
+        self._uploads.discard(job.id)
+        self._jobs.remove(job)
+        self._release_slot(job)
+        if getattr(job, '_pinned', False):
+            self._jm.send(distbuild.message('pin-release', id=job.id))
 
     def _request_caching(self, event_source, event):
         # This code should be moved into the morphlib.remoteartifactcache
@@ -643,6 +809,14 @@ class WorkerConnection(distbuild.StateMachine):
         job = event.job
         kind = job.artifact.kind
 
+        # If the artifacts are pinned in the worker's local cache, it can
+        # get on with the next job while the shared cache fetches them.
+        self._uploads.add(job.id)
+        if getattr(job, '_pinned', False):
+            self._release_slot(job)
+        logging.debug('WC: %s has %d uploads in progress', self.name(),
+                      len(self._uploads))
+
         if kind == 'chunk':
             artifact_names = job.artifact.source_artifact_names
 
@@ -694,11 +868,13 @@ class WorkerConnection(distbuild.StateMachine):
         if event.msg['status'] == httplib.OK:
             logging.debug('Shared artifact cache population done')
 
+            self._record_build_times(job)
+
             finished_event = WorkerBuildFinished(
                 job._exec_response, job.artifact.cache_key, job.who.name())
             self.mainloop.queue_event(WorkerConnection, finished_event)
 
-            self.mainloop.queue_event(self, _Cached())
+            self.mainloop.queue_event(self, _Cached(job))
         else:
             logging.error(
                 'Failed to populate artifact cache: %s %s' %
@@ -716,7 +892,32 @@ class WorkerConnection(distbuild.StateMachine):
                 job._exec_response, job.artifact.cache_key)
             self.mainloop.queue_event(WorkerConnection, failed_event)
 
-            self.mainloop.queue_event(self, _BuildFailed())
+            self.mainloop.queue_event(self, _BuildFailed(job))
 
         # Caching is the last step of a job, so we're now done with it.
         self.mainloop.queue_event(WorkerConnection, _JobFinished(job))
+
+    def _record_build_times(self, job):
+        '''Add the durations of a completed job to the build history.
+
+        The worker records the time of each build stage itself; here we
+        record what the controller sees: how long the worker-build command
+        ran for, and how long it took to transfer the results to the shared
+        artifact cache.
+
+        '''
+        if self._build_history is None:
+            return
+
+        now = time.time()
+        durations = {
+            'worker-build': job._built_time - job._started_time,
+            'caching': now - job._built_time,
+        }
+        try:
+            self._build_history.record_many(
+                job.artifact.source_name, durations, worker=self.name(),
+                cache_key=job.artifact.cache_key)
+        except (IOError, OSError) as e:
+            logging.warning('Unable to record build times for %s: %s',
+                            job.artifact.basename(), e)
@@ -0,0 +1,250 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import logging
+import os
+import threading
+import time
+
+
+class ArtifactIndex(object):
+
+    '''In-memory index of the files in the artifact directory.
+
+    For each artifact the index records the information that /list
+    returns: its size, the disk space it uses, and when it was last
+    accessed. Looking up whether artifacts exist, or listing them all,
+    then doesn't need to touch the filesystem. The SHA1 of an artifact
+    is recorded too, if it was given to `add`, and is forgotten with the
+    artifact.
+
+    The server must call `add` when it puts a file into the directory and
+    `remove` when it deletes one. Artifacts never change once they are in
+    the cache, so the index doesn't need to notice files changing. Other
+    programs, such as morph building artifacts on a worker or a cron job
+    cleaning the cache, also add and delete artifacts, which `rescan`
+    notices. It only lists the directory if the directory has changed
+    since it was last listed, so it can be run often in the background
+    with `start_rescanning`.
+
+    If `filename` is given, the index is saved there by `save`, and loaded
+    by `scan`. On startup, `scan` only needs to stat files that have
+    appeared since the index was last saved.
+
+    '''
+
+    def __init__(self, artifact_dir, filename=None):
+        self.artifact_dir = artifact_dir
+        self.filename = filename
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._dir_mtime = None
+
+    def _is_artifact(self, name):
+        return not name.startswith('.')
+
+    def _stat(self, name):
+        stinfo = os.stat(os.path.join(self.artifact_dir, name))
+        return {
+            'atime': stinfo.st_atime,
+            'size': stinfo.st_size,
+            'used': stinfo.st_blocks * 512,
+        }
+
+    def _load(self):
+        if not self.filename or not os.path.exists(self.filename):
+            return {}
+        try:
+            with open(self.filename) as f:
+                return json.load(f)
+        except (IOError, ValueError) as e:
+            logging.warning('Ignoring unreadable artifact index %s: %s',
+                            self.filename, e)
+            return {}
+
+    def _list_dir(self):
+        # The mtime is read first, so that a change made while listing
+        # the directory is noticed by the next rescan.
+        mtime = os.stat(self.artifact_dir).st_mtime
+        names = set(name for name in os.listdir(self.artifact_dir)
+                    if self._is_artifact(name))
+        return mtime, names
+
+    def _update(self, entries, names):
+        for name in set(entries) - names:
+            del entries[name]
+        added = 0
+        for name in names - set(entries):
+            try:
+                entries[name] = self._stat(name)
+                added += 1
+            except OSError:  # pragma: no cover
+                # It was removed while we were scanning.
+                pass
+        return added
+
+    def scan(self):
+        '''Bring the index up to date with the artifact directory.'''
+
+        start = time.time()
+        entries = self._load()
+        mtime, names = self._list_dir()
+        added = self._update(entries, names)
+
+        with self._lock:
+            self._entries = entries
+            self._dirty = True
+            self._dir_mtime = mtime
+        logging.info('Indexed %d artifacts (%d new) in %.1f seconds',
+                     len(entries), added, time.time() - start)
+
+    def rescan(self):
+        '''Notice artifacts added or removed by other programs.
+
+        Nothing is done unless the directory has changed since it was
+        last listed.
+
+        '''
+
+        if os.stat(self.artifact_dir).st_mtime == self._dir_mtime:
+            return
+        mtime, names = self._list_dir()
+        with self._lock:
+            known = dict(self._entries)
+        # Only new artifacts are stat'ed, outside the lock.
+        new_entries = {}
+        for name in names.difference(known):
+            try:
+                new_entries[name] = self._stat(name)
+            except OSError:  # pragma: no cover
+                pass
+        with self._lock:
+            for name in set(known) - names:
+                # Unless the server added it again since the listing.
+                if self._entries.get(name) is known[name]:
+                    del self._entries[name]
+                    self._dirty = True
+            for name, entry in new_entries.iteritems():
+                self._entries.setdefault(name, entry)
+                self._dirty = True
+            self._dir_mtime = mtime
+
+    def add(self, name, sha1=None):
+        '''Add or update the entry for a file in the artifact directory.'''
+
+        entry = self._stat(name)
+        with self._lock:
+            old_entry = self._entries.get(name, {})
+            sha1 = sha1 or old_entry.get('sha1')
+            if sha1:
+                entry['sha1'] = sha1
+            self._entries[name] = entry
+            self._dirty = True
+
+    def remove(self, name):
+        with self._lock:
+            if self._entries.pop(name, None) is not None:
+                self._dirty = True
+
+    def touch(self, name):
+        '''Record that an artifact was used just now.'''
+
+        with self._lock:
+            if name in self._entries:
+                self._entries[name]['atime'] = time.time()
+                self._dirty = True
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._entries
+
+    def find(self, name):
+        '''Check the directory for an artifact the index doesn't have.
+
+        This is for when an artifact is about to be read anyway, so that
+        one added by another program since the last rescan can be used
+        straight away. Returns whether it was found.
+
+        '''
+
+        if not self._is_artifact(name):
+            return False
+        try:
+            self.add(name)
+        except OSError:
+            return False
+        return True
+
+    def checksum(self, name):
+        '''Return the SHA1 of an artifact, or None if it is not known.'''
+
+        with self._lock:
+            return self._entries.get(name, {}).get('sha1')
+
+    def list(self):
+        '''Return a dict of information about every artifact.'''
+
+        with self._lock:
+            return dict((name, {'atime': entry['atime'],
+                                'size': entry['size'],
+                                'used': entry['used']})
+                        for name, entry in self._entries.iteritems())
+
+    def save(self):
+        '''Save the index, if it has changed since it was last saved.'''
+
+        if not self.filename:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps(self._entries)
+            self._dirty = False
+        tmpname = '%s.tmp' % self.filename
+        with open(tmpname, 'w') as f:
+            f.write(data)
+        os.rename(tmpname, self.filename)
+
+    def start_saving(self, interval):  # pragma: no cover
+        '''Save the index every `interval` seconds in a background thread.'''
+
+        def save_periodically():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.save()
+                except (IOError, OSError) as e:
+                    logging.warning('Could not save artifact index: %s', e)
+
+        thread = threading.Thread(target=save_periodically)
+        thread.daemon = True
+        thread.start()
+
+    def start_rescanning(self, interval):  # pragma: no cover
+        '''Rescan every `interval` seconds in a background thread.'''
+
+        def rescan_periodically():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.rescan()
+                except OSError as e:
+                    logging.warning('Could not rescan artifacts: %s', e)
+
+        thread = threading.Thread(target=rescan_periodically)
+        thread.daemon = True
+        thread.start()
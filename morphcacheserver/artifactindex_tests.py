@@ -0,0 +1,186 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from morphcacheserver.artifactindex import ArtifactIndex
+
+
+class ArtifactIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.artifact_dir = os.path.join(self.tempdir, 'artifacts')
+        os.mkdir(self.artifact_dir)
+        self.index_file = os.path.join(self.tempdir, 'index.json')
+        self.write('a.chunk.foo', 'foo')
+        self.write('b.chunk.bar', 'barbar')
+        logging.disable(logging.WARNING)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tempdir)
+
+    def write(self, name, contents):
+        with open(os.path.join(self.artifact_dir, name), 'w') as f:
+            f.write(contents)
+
+    def delete(self, name):
+        os.remove(os.path.join(self.artifact_dir, name))
+
+    def changed_dir(self):
+        # Changes made within the mtime granularity of the filesystem
+        # would not be noticed, so make sure the mtime changes.
+        mtime = os.stat(self.artifact_dir).st_mtime
+        os.utime(self.artifact_dir, (mtime + 10, mtime + 10))
+
+    def new_index(self):
+        index = ArtifactIndex(self.artifact_dir, self.index_file)
+        index.scan()
+        return index
+
+    def test_scan_finds_artifacts(self):
+        index = self.new_index()
+        self.assertEqual(sorted(index.list()),
+                         ['a.chunk.foo', 'b.chunk.bar'])
+        self.assertTrue('a.chunk.foo' in index)
+        self.assertFalse('c.chunk.baz' in index)
+
+    def test_scan_ignores_partial_downloads(self):
+        self.write('.dl.c.chunk.baz', 'ba')
+        index = self.new_index()
+        self.assertFalse('.dl.c.chunk.baz' in index)
+
+    def test_lists_size_and_atime(self):
+        index = self.new_index()
+        entry = index.list()['b.chunk.bar']
+        self.assertEqual(entry['size'], 6)
+        self.assertEqual(sorted(entry), ['atime', 'size', 'used'])
+
+    def test_rescan_notices_added_and_removed_artifacts(self):
+        index = self.new_index()
+        self.write('c.chunk.baz', 'baz')
+        self.delete('a.chunk.foo')
+        self.changed_dir()
+        index.rescan()
+        self.assertEqual(sorted(index.list()),
+                         ['b.chunk.bar', 'c.chunk.baz'])
+
+    def test_rescan_does_nothing_if_directory_unchanged(self):
+        os.utime(self.artifact_dir, (1000000000, 1000000000))
+        index = self.new_index()
+        self.write('c.chunk.baz', 'baz')
+        os.utime(self.artifact_dir, (1000000000, 1000000000))
+        index.rescan()
+        self.assertFalse('c.chunk.baz' in index)
+
+    def test_add_and_remove(self):
+        index = self.new_index()
+        self.write('c.chunk.baz', 'baz')
+        index.add('c.chunk.baz')
+        self.assertTrue('c.chunk.baz' in index)
+        index.remove('c.chunk.baz')
+        self.assertFalse('c.chunk.baz' in index)
+
+    def test_remove_unknown_artifact(self):
+        index = self.new_index()
+        index.remove('c.chunk.baz')
+        self.assertEqual(len(index.list()), 2)
+
+    def test_find_adds_artifact_from_other_program(self):
+        index = self.new_index()
+        self.write('c.chunk.baz', 'baz')
+        self.assertTrue(index.find('c.chunk.baz'))
+        self.assertTrue('c.chunk.baz' in index)
+
+    def test_find_missing_artifact(self):
+        index = self.new_index()
+        self.assertFalse(index.find('c.chunk.baz'))
+        self.assertFalse(index.find('.dl.c.chunk.baz'))
+
+    def test_touch_updates_atime(self):
+        index = self.new_index()
+        index.touch('a.chunk.foo')
+        atime = index.list()['a.chunk.foo']['atime']
+        self.assertTrue(atime > os.stat(
+            os.path.join(self.artifact_dir, 'a.chunk.foo')).st_atime - 1)
+        index.touch('c.chunk.baz')
+        self.assertFalse('c.chunk.baz' in index)
+
+    def test_keeps_checksum_when_added_again(self):
+        index = self.new_index()
+        index.add('a.chunk.foo', sha1='abc')
+        index.add('a.chunk.foo')
+        self.assertEqual(index.checksum('a.chunk.foo'), 'abc')
+        self.assertEqual(index.checksum('b.chunk.bar'), None)
+
+    def test_forgets_checksum_of_removed_artifact(self):
+        index = self.new_index()
+        index.add('a.chunk.foo', sha1='abc')
+        index.remove('a.chunk.foo')
+        self.assertEqual(index.checksum('a.chunk.foo'), None)
+
+    def test_saves_and_loads_index(self):
+        index = self.new_index()
+        index.add('a.chunk.foo', sha1='abc')
+        index.touch('b.chunk.bar')
+        index.save()
+        saved = index.list()
+
+        index = self.new_index()
+        self.assertEqual(index.list(), saved)
+        self.assertEqual(index.checksum('a.chunk.foo'), 'abc')
+
+    def test_scan_updates_saved_index(self):
+        self.new_index().save()
+        self.delete('a.chunk.foo')
+        self.write('c.chunk.baz', 'baz')
+        index = self.new_index()
+        self.assertEqual(sorted(index.list()),
+                         ['b.chunk.bar', 'c.chunk.baz'])
+
+    def test_only_saves_when_changed(self):
+        index = self.new_index()
+        index.save()
+        os.remove(self.index_file)
+        index.save()
+        self.assertFalse(os.path.exists(self.index_file))
+        index.touch('a.chunk.foo')
+        index.save()
+        self.assertTrue(os.path.exists(self.index_file))
+
+    def test_ignores_unreadable_saved_index(self):
+        with open(self.index_file, 'w') as f:
+            f.write('not json')
+        index = self.new_index()
+        self.assertEqual(len(index.list()), 2)
+
+    def test_does_not_save_without_filename(self):
+        index = ArtifactIndex(self.artifact_dir)
+        index.add('a.chunk.foo')
+        index.save()
+        self.assertEqual(os.listdir(self.tempdir), ['artifacts'])
+
+    def test_saved_index_is_json(self):
+        index = self.new_index()
+        index.save()
+        with open(self.index_file) as f:
+            self.assertEqual(sorted(json.load(f)),
+                             ['a.chunk.foo', 'b.chunk.bar'])
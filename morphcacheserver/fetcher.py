@@ -0,0 +1,227 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import cliapp
+import hashlib
+import httplib
+import logging
+import os
+import threading
+import urllib
+import urllib2
+
+
+# Artifacts served by morph-cache-server carry their SHA1 in this header.
+CHECKSUM_HEADER = 'X-Artifact-SHA1'
+
+
+class FetchError(cliapp.AppException):
+
+    def __init__(self, url, reason):
+        cliapp.AppException.__init__(
+                self, 'Failed to fetch %s: %s' % (url, reason))
+
+
+class ArtifactFetcher(object):
+
+    '''Download artifacts from another cache server into the artifact dir.
+
+    All the artifacts for one fetch request are downloaded at the same
+    time, each in its own thread. The total number of transfers running
+    at once, across every request being handled by the server, is limited
+    to `max_transfers`.
+
+    Each artifact is downloaded to a '.dl.' file next to its final name.
+    If a transfer is interrupted, the partial file is kept and the next
+    attempt asks the server for the remaining bytes only. A completed file
+    is checked against the Content-Length and, if the server sends one,
+    the checksum header. Only when every artifact of a request has been
+    downloaded and checked are they all renamed into place, so clients
+    never see partial artifacts, and never see some of the artifacts of a
+    source without the others. The checksum of each artifact is returned
+    with its size, for the server to send when the artifact is served.
+
+    '''
+
+    def __init__(self, artifact_dir, max_transfers=8, chunk_size=1024**2):
+        self.artifact_dir = artifact_dir
+        self.chunk_size = chunk_size
+        self._transfers = threading.BoundedSemaphore(max_transfers)
+        # Maps artifact names to a lock, and how many requests are using it.
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _tmpname(self, artifact_name):
+        return os.path.join(self.artifact_dir, '.dl.%s' % artifact_name)
+
+    def _get_lock(self, artifact_name):
+        with self._locks_lock:
+            if artifact_name not in self._locks:
+                self._locks[artifact_name] = [threading.Lock(), 0]
+            self._locks[artifact_name][1] += 1
+            return self._locks[artifact_name][0]
+
+    def _put_lock(self, artifact_name):
+        with self._locks_lock:
+            self._locks[artifact_name][1] -= 1
+            if self._locks[artifact_name][1] == 0:
+                del self._locks[artifact_name]
+
+    def fetch(self, server, cacheid, artifacts):
+        '''Fetch artifacts of source `cacheid` from the server at `server`.
+
+        Returns a dict mapping artifact file names to their size, disk
+        usage and SHA1, if it is known. Raises an exception if any of the
+        artifacts can't be fetched, in which case none of them are put
+        into the cache.
+
+        '''
+
+        names = sorted(set('%s.%s' % (cacheid, artifact)
+                           for artifact in artifacts))
+
+        # Two requests may fetch the same artifact at the same time, and
+        # they must not both write to the same partial file. Locks are
+        # always taken in the same order, so requests can't deadlock.
+        locks = [self._get_lock(name) for name in names]
+        try:
+            for lock in locks:
+                lock.acquire()
+            try:
+                return self._fetch_locked(server, names)
+            finally:
+                for lock in locks:
+                    lock.release()
+        finally:
+            for name in names:
+                self._put_lock(name)
+
+    def _fetch_locked(self, server, names):
+        results = {}
+        checksums = {}
+        errors = {}
+
+        def fetch_one(artifact_name):
+            url = 'http://%s/1.0/artifacts?filename=%s' % (
+                server, urllib.quote(artifact_name))
+            try:
+                filename = os.path.join(self.artifact_dir, artifact_name)
+                if os.path.exists(filename):
+                    # Another request has fetched it already.
+                    stinfo = os.stat(filename)
+                else:
+                    with self._transfers:
+                        stinfo, checksums[artifact_name] = (
+                            self._fetch_artifact(
+                                url, self._tmpname(artifact_name)))
+                results[artifact_name] = {
+                    'size': stinfo.st_size,
+                    'used': stinfo.st_blocks * 512,
+                }
+                if artifact_name in checksums:
+                    results[artifact_name]['sha1'] = checksums[artifact_name]
+            except (EnvironmentError, httplib.HTTPException,
+                    FetchError) as e:
+                logging.error('Fetching %s: %s', url, e)
+                errors[artifact_name] = e
+
+        threads = [threading.Thread(target=fetch_one, args=(name,))
+                   for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            # Partial downloads are left in place, so that trying again
+            # resumes them.
+            raise errors.values()[0]
+        missing = [name for name in names if name not in results]
+        if missing:  # pragma: no cover
+            # The thread died of something unexpected, which it reported.
+            raise FetchError(server, 'could not fetch %s' %
+                             ', '.join(missing))
+
+        for artifact_name in names:
+            tmpname = self._tmpname(artifact_name)
+            if os.path.exists(tmpname):
+                os.rename(tmpname,
+                          os.path.join(self.artifact_dir, artifact_name))
+
+        return results
+
+    def _fetch_artifact(self, url, filename):
+        offset = 0
+        if os.path.exists(filename):
+            offset = os.path.getsize(filename)
+
+        request = urllib2.Request(url)
+        if offset:
+            request.add_header('Range', 'bytes=%d-' % offset)
+        try:
+            in_fh = urllib2.urlopen(request)
+        except urllib2.HTTPError as e:
+            if e.code == 416 and offset:
+                # The partial file is no use: start again.
+                logging.debug('Server refused to resume %s at %d',
+                              url, offset)
+                os.unlink(filename)
+                return self._fetch_artifact(url, filename)
+            raise
+
+        try:
+            if in_fh.getcode() != 206:
+                # The server ignored the Range header and is sending the
+                # whole file.
+                offset = 0
+            expected_size = self._expected_size(in_fh, offset)
+            expected_checksum = in_fh.info().getheader(CHECKSUM_HEADER)
+
+            sha1 = hashlib.sha1()
+            if offset:
+                logging.debug('Resuming %s at byte %d', url, offset)
+                with open(filename, 'rb') as f:
+                    while True:
+                        data = f.read(self.chunk_size)
+                        if not data:
+                            break
+                        sha1.update(data)
+
+            with open(filename, 'ab' if offset else 'wb') as localtmp:
+                while True:
+                    data = in_fh.read(self.chunk_size)
+                    if not data:
+                        break
+                    sha1.update(data)
+                    localtmp.write(data)
+        finally:
+            in_fh.close()
+
+        stinfo = os.stat(filename)
+        if expected_size is not None and stinfo.st_size != expected_size:
+            # A short transfer: keep what we got, to resume next time.
+            raise FetchError(url, 'got %d bytes of %d' %
+                             (stinfo.st_size, expected_size))
+        if expected_checksum and sha1.hexdigest() != expected_checksum:
+            os.unlink(filename)
+            raise FetchError(url, 'checksum is %s, expected %s' %
+                             (sha1.hexdigest(), expected_checksum))
+        return stinfo, sha1.hexdigest()
+
+    def _expected_size(self, in_fh, offset):
+        length = in_fh.info().getheader('Content-Length')
+        if length is None:
+            return None
+        return offset + int(length)
@@ -0,0 +1,189 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import BaseHTTPServer
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib2
+import urlparse
+
+from morphcacheserver.fetcher import (
+    ArtifactFetcher, CHECKSUM_HEADER, FetchError)
+from morphcacheserver.server import parse_range
+
+
+class FakeCacheServer(BaseHTTPServer.HTTPServer):
+
+    '''Serve artifacts from a dict, as morph-cache-server does.
+
+    `artifacts` maps names to contents, and `checksums` to the SHA1 to
+    send for them, if it isn't the SHA1 of the contents. Names in
+    `truncate` have only half of their contents sent, and names in
+    `no_length` are sent without a Content-Length. Every Range header
+    received is recorded in `ranges`.
+
+    '''
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, ('127.0.0.1', 0), FakeCacheRequestHandler)
+        self.artifacts = {}
+        self.checksums = {}
+        self.truncate = set()
+        self.no_length = set()
+        self.ranges = []
+
+
+class FakeCacheRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+        name = query['filename'][0]
+        if name not in self.server.artifacts:
+            self.send_error(404)
+            return
+        contents = self.server.artifacts[name]
+        checksum = self.server.checksums.get(
+            name, hashlib.sha1(contents).hexdigest())
+
+        header = self.headers.getheader('Range')
+        self.server.ranges.append(header)
+        try:
+            byte_range = parse_range(header, len(contents))
+        except ValueError:
+            self.send_error(416)
+            return
+        if byte_range is None:
+            self.send_response(200)
+            body = contents
+        else:
+            self.send_response(206)
+            start, length = byte_range
+            body = contents[start:start + length]
+        if name not in self.server.no_length:
+            self.send_header('Content-Length', str(len(body)))
+        self.send_header(CHECKSUM_HEADER, checksum)
+        self.end_headers()
+        if name in self.server.truncate:
+            body = body[:len(body) // 2]
+        self.wfile.write(body)
+
+
+class ArtifactFetcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.server = FakeCacheServer()
+        self.server.artifacts = {
+            'abc.chunk.foo': 'foo' * 100,
+            'abc.chunk.foo-devel': 'devel' * 100,
+        }
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={'poll_interval': 0.01})
+        thread.daemon = True
+        thread.start()
+        self.address = '127.0.0.1:%d' % self.server.server_port
+        self.fetcher = ArtifactFetcher(self.tempdir, chunk_size=64)
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tempdir)
+
+    def fetch(self, *artifacts):
+        return self.fetcher.fetch(self.address, 'abc', artifacts)
+
+    def read(self, name):
+        with open(os.path.join(self.tempdir, name)) as f:
+            return f.read()
+
+    def write(self, name, contents):
+        with open(os.path.join(self.tempdir, name), 'w') as f:
+            f.write(contents)
+
+    def test_fetches_artifacts(self):
+        results = self.fetch('chunk.foo', 'chunk.foo-devel')
+        self.assertEqual(self.read('abc.chunk.foo'), 'foo' * 100)
+        self.assertEqual(self.read('abc.chunk.foo-devel'), 'devel' * 100)
+        self.assertEqual(sorted(os.listdir(self.tempdir)),
+                         ['abc.chunk.foo', 'abc.chunk.foo-devel'])
+        self.assertEqual(results['abc.chunk.foo']['size'], 300)
+        self.assertEqual(results['abc.chunk.foo']['sha1'],
+                         hashlib.sha1('foo' * 100).hexdigest())
+
+    def test_uses_artifact_already_present(self):
+        self.write('abc.chunk.foo', 'foo' * 100)
+        results = self.fetch('chunk.foo')
+        self.assertEqual(self.server.ranges, [])
+        self.assertEqual(results['abc.chunk.foo']['size'], 300)
+        self.assertFalse('sha1' in results['abc.chunk.foo'])
+
+    def test_resumes_partial_download(self):
+        self.write('.dl.abc.chunk.foo', 'foo' * 40)
+        results = self.fetch('chunk.foo')
+        self.assertEqual(self.server.ranges, ['bytes=120-'])
+        self.assertEqual(self.read('abc.chunk.foo'), 'foo' * 100)
+        self.assertEqual(results['abc.chunk.foo']['sha1'],
+                         hashlib.sha1('foo' * 100).hexdigest())
+
+    def test_restarts_partial_download_the_server_refuses(self):
+        self.write('.dl.abc.chunk.foo', 'foo' * 200)
+        self.fetch('chunk.foo')
+        self.assertEqual(self.server.ranges, ['bytes=600-', None])
+        self.assertEqual(self.read('abc.chunk.foo'), 'foo' * 100)
+
+    def test_short_transfer_keeps_partial_file(self):
+        self.server.truncate.add('abc.chunk.foo')
+        self.assertRaises(FetchError, self.fetch, 'chunk.foo')
+        self.assertEqual(self.read('.dl.abc.chunk.foo'), 'foo' * 50)
+        self.assertFalse(
+            os.path.exists(os.path.join(self.tempdir, 'abc.chunk.foo')))
+
+        self.server.truncate.clear()
+        self.fetch('chunk.foo')
+        self.assertEqual(self.server.ranges, [None, 'bytes=150-'])
+        self.assertEqual(self.read('abc.chunk.foo'), 'foo' * 100)
+
+    def test_fetches_artifact_without_length(self):
+        self.server.no_length.add('abc.chunk.foo')
+        self.fetch('chunk.foo')
+        self.assertEqual(self.read('abc.chunk.foo'), 'foo' * 100)
+
+    def test_checksum_mismatch_removes_download(self):
+        self.server.checksums['abc.chunk.foo'] = '0' * 40
+        self.assertRaises(FetchError, self.fetch, 'chunk.foo')
+        self.assertEqual(os.listdir(self.tempdir), [])
+
+    def test_checksum_mismatch_after_resume_removes_download(self):
+        self.write('.dl.abc.chunk.foo', 'bar' * 40)
+        self.assertRaises(FetchError, self.fetch, 'chunk.foo')
+        self.assertEqual(os.listdir(self.tempdir), [])
+
+    def test_puts_no_artifacts_in_place_if_any_fail(self):
+        # The server doesn't have chunk.bar.
+        self.assertRaises(
+            urllib2.HTTPError, self.fetch, 'chunk.foo', 'chunk.bar')
+        self.assertFalse(
+            os.path.exists(os.path.join(self.tempdir, 'abc.chunk.foo')))
@@ -0,0 +1,73 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import collections
+import threading
+
+
+def result_size(result):
+    '''Roughly how many bytes of memory a lookup result takes up.'''
+
+    if isinstance(result, basestring):
+        return len(result)
+    return len(repr(result))
+
+
+class LookupCache(object):
+
+    '''Remember the results of lookups that always give the same answer.
+
+    Results can be whole files, so the cache is limited to `max_bytes` of
+    results rather than a number of them. The results used least recently
+    are forgotten first. Results bigger than a quarter of the cache are
+    not remembered, so that one huge file doesn't push out everything
+    else. A LookupCache may be used from several threads at once.
+
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._results = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, lookup):
+        '''Return the result for `key`, calling `lookup` if it's not known.
+
+        Exceptions raised by `lookup` are passed on, and nothing is
+        remembered for `key`.
+
+        '''
+
+        with self._lock:
+            if key in self._results:
+                size, result = self._results.pop(key)
+                self._results[key] = (size, result)
+                return result
+
+        result = lookup()
+        size = result_size(result) + len(repr(key))
+        if size > self.max_bytes // 4:
+            return result
+
+        with self._lock:
+            if key not in self._results:
+                self._results[key] = (size, result)
+                self.size += size
+            while self.size > self.max_bytes:
+                old_key, (old_size, old_result) = self._results.popitem(
+                    last=False)
+                self.size -= old_size
+        return result
@@ -0,0 +1,76 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+
+from morphcacheserver.lookupcache import LookupCache, result_size
+
+
+class LookupCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.lookups = []
+
+    def lookup(self, result):
+        def do_lookup():
+            self.lookups.append(result)
+            return result
+        return do_lookup
+
+    def test_measures_strings_by_length(self):
+        self.assertEqual(result_size('x' * 10), 10)
+
+    def test_measures_other_results_by_repr(self):
+        self.assertEqual(result_size({'a': 1}), len(repr({'a': 1})))
+
+    def test_remembers_results(self):
+        cache = LookupCache(1000)
+        self.assertEqual(cache.get('k', self.lookup('v')), 'v')
+        self.assertEqual(cache.get('k', self.lookup('v')), 'v')
+        self.assertEqual(self.lookups, ['v'])
+
+    def test_forgets_least_recently_used_first(self):
+        # Each result takes 10 bytes for itself and 3 for the repr of
+        # its key, so four of them fit.
+        cache = LookupCache(60)
+        for key in ('a', 'b', 'c', 'd'):
+            cache.get(key, self.lookup(key * 10))
+        # Use 'a', so that 'b' is the least recently used.
+        cache.get('a', self.lookup('a' * 10))
+        cache.get('e', self.lookup('e' * 10))
+        self.assertEqual(cache.size, 52)
+
+        del self.lookups[:]
+        for key in ('a', 'c', 'd', 'e'):
+            cache.get(key, self.lookup(key * 10))
+        self.assertEqual(self.lookups, [])
+        cache.get('b', self.lookup('b' * 10))
+        self.assertEqual(self.lookups, ['b' * 10])
+
+    def test_does_not_remember_large_results(self):
+        cache = LookupCache(100)
+        cache.get('k', self.lookup('x' * 30))
+        cache.get('k', self.lookup('x' * 30))
+        self.assertEqual(len(self.lookups), 2)
+        self.assertEqual(cache.size, 0)
+
+    def test_does_not_remember_failed_lookups(self):
+        cache = LookupCache(1000)
+
+        def fail():
+            raise KeyError('k')
+        self.assertRaises(KeyError, cache.get, 'k', fail)
+        self.assertEqual(cache.get('k', self.lookup('v')), 'v')
+        self.assertEqual(self.lookups, ['v'])
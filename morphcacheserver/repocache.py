@@ -19,6 +19,8 @@ import re
 import string
 import urlparse
 
+import morphlib.gitbatch
+
 
 class RepositoryNotFoundError(cliapp.AppException):
 
@@ -72,10 +74,7 @@ class RepoCache(object):
             raise
 
     def _tree_from_commit(self, repo_dir, commitsha):
-        commit_info = self.app.runcmd(['git', 'log', '-1',
-                                       '--format=format:%T', commitsha],
-                                      cwd=repo_dir)
-        return commit_info.strip()
+        return self._object_info(repo_dir, '%s^{tree}' % commitsha)[0]
 
     def cat_file(self, repo_url, ref, filename):
         quoted_url = self._quote_url(repo_url)
@@ -140,17 +139,45 @@ class RepoCache(object):
             transl = lambda x: x if x in valid_chars else '_'
             return ''.join([transl(x) for x in url])
 
+    # These lookups use long-running `git cat-file` processes, as starting
+    # a new git process for each one is much slower than the lookup itself.
+
+    def _object_info(self, repo_dir, name):
+        info = morphlib.gitbatch.pool.info(repo_dir, name)
+        if info is None:
+            raise cliapp.AppException('%s does not exist in %s' %
+                                      (name, repo_dir))
+        return info
+
+    def _read_object(self, repo_dir, name, kind):
+        result = morphlib.gitbatch.pool.read(repo_dir, name)
+        if result is None or result[1] != kind:
+            raise cliapp.AppException('%s %s does not exist in %s' %
+                                      (kind, name, repo_dir))
+        return result[2]
+
     def _rev_parse(self, repo_dir, ref):
-        return self.app.runcmd(['git', 'rev-parse', '--verify', ref],
-                               cwd=repo_dir)[0:40]
+        return self._object_info(repo_dir, ref)[0]
 
     def _cat_file(self, repo_dir, sha1, filename):
-        return self.app.runcmd(
-                ['git', 'cat-file', 'blob', '%s:%s' % (sha1, filename)],
-                cwd=repo_dir)
+        return self._read_object(repo_dir, '%s:%s' % (sha1, filename), 'blob')
 
     def _ls_tree(self, repo_dir, sha1, path):
-        return self.app.runcmd(['git', 'ls-tree', sha1, path], cwd=repo_dir)
+        # This gives the same output as `git ls-tree SHA1 PATH`: the
+        # contents of the directory if PATH is empty or ends with '/',
+        # otherwise just the entry for PATH itself.
+        if path == '' or path.endswith('/'):
+            dirname, basename = path.rstrip('/'), None
+        else:
+            dirname, basename = os.path.split(path)
+        tree = self._read_object(repo_dir, '%s:%s' % (sha1, dirname), 'tree')
+        prefix = dirname + '/' if dirname else ''
+        lines = []
+        for mode, kind, entry_sha1, name in morphlib.gitbatch.parse_tree(tree):
+            if basename is None or name == basename:
+                lines.append('%s %s %s\t%s%s\n' %
+                             (mode, kind, entry_sha1, prefix, name))
+        return ''.join(lines)
 
     def _is_valid_sha1(self, ref):
         valid_chars = 'abcdefABCDEF0123456789'
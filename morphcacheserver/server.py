@@ -0,0 +1,193 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import Queue
+import re
+import threading
+import wsgiref.simple_server
+
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _libc.sendfile.argtypes = [ctypes.c_int, ctypes.c_int,
+                               ctypes.POINTER(ctypes.c_int64),
+                               ctypes.c_size_t]
+    _libc.sendfile.restype = ctypes.c_ssize_t
+except (OSError, AttributeError): # pragma: no cover
+    _libc = None
+
+
+def sendfile(out_fd, in_fd, offset, count):
+    '''Copy up to `count` bytes from `in_fd` at `offset` to `out_fd`.
+
+    The copy is done by the kernel, without passing the data through
+    Python. Returns the number of bytes copied.
+
+    '''
+
+    off = ctypes.c_int64(offset)
+    sent = _libc.sendfile(out_fd, in_fd, ctypes.byref(off), count)
+    if sent < 0:  # pragma: no cover
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return sent
+
+
+def parse_range(header, size):
+    '''Parse an HTTP Range header for a file of `size` bytes.
+
+    Returns a (start, length) pair, or None if the whole file should be
+    sent. Only a single range is supported; a header asking for several
+    is ignored. Raises ValueError if the range can't be satisfied.
+
+    '''
+
+    m = re.match(r'^bytes=(\d*)-(\d*)$', header.strip()) if header else None
+    if m is None or m.group(1) == m.group(2) == '':
+        return None
+    if m.group(1) == '':
+        # A suffix range: the last N bytes.
+        start = max(0, size - int(m.group(2)))
+        end = size - 1
+    else:
+        start = int(m.group(1))
+        end = int(m.group(2)) if m.group(2) else size - 1
+        end = min(end, size - 1)
+    if start >= size or end < start:
+        raise ValueError('Range %s not satisfiable for %d bytes' %
+                         (header, size))
+    return start, end - start + 1
+
+
+class FileRange(object):
+
+    '''A file-like object for part of a file.
+
+    Any WSGI server can send this by reading from it, and the
+    SendfileServer sends it with the sendfile system call.
+
+    '''
+
+    def __init__(self, f, offset, length):
+        self.file = f
+        self.offset = offset
+        self.length = length
+        self._remaining = length
+        f.seek(offset)
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self.file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class SendfileHandler(wsgiref.simple_server.ServerHandler):
+
+    def sendfile(self):
+        filelike = self.result.filelike
+        if _libc is None or not isinstance(filelike, FileRange):
+            return False
+
+        if not self.headers_sent:
+            self.send_headers()
+        self._flush()
+
+        out_fd = self.stdout.fileno()
+        in_fd = filelike.fileno()
+        offset = filelike.offset
+        remaining = filelike.length
+        while remaining > 0:
+            try:
+                sent = sendfile(out_fd, in_fd, offset, remaining)
+            except OSError as e:  # pragma: no cover
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if sent == 0:  # pragma: no cover
+                # The file got shorter while we were sending it.
+                break
+            offset += sent
+            remaining -= sent
+        self.bytes_sent += filelike.length - remaining
+        return True
+
+
+class SendfileRequestHandler(wsgiref.simple_server.WSGIRequestHandler):
+
+    def handle(self):
+        self.raw_requestline = self.rfile.readline(65537)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+
+        if not self.parse_request():
+            return
+
+        handler = SendfileHandler(
+            self.rfile, self.wfile, self.get_stderr(), self.get_environ())
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+    def log_message(self, format, *args):
+        logging.info('%s - %s', self.address_string(), format % args)
+
+
+class SendfileServer(wsgiref.simple_server.WSGIServer):
+
+    '''A WSGI server that handles requests with a pool of threads.
+
+    Files returned by the application as FileRange objects are sent with
+    the sendfile system call, so the data does not pass through Python.
+
+    '''
+
+    def __init__(self, server_address, threads=16,
+                 handler_class=SendfileRequestHandler):
+        wsgiref.simple_server.WSGIServer.__init__(
+            self, server_address, handler_class)
+        self._requests = Queue.Queue()
+        for i in xrange(threads):
+            thread = threading.Thread(target=self._handle_requests)
+            thread.daemon = True
+            thread.start()
+
+    def process_request(self, request, client_address):
+        self._requests.put((request, client_address))
+
+    def _handle_requests(self):
+        while True:
+            request, client_address = self._requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:  # pragma: no cover
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
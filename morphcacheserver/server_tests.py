@@ -0,0 +1,205 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import logging
+import os
+import shutil
+import socket
+import StringIO
+import tempfile
+import threading
+import unittest
+import urllib2
+
+import morphcacheserver.server
+from morphcacheserver.server import FileRange, parse_range
+
+
+class ParseRangeTests(unittest.TestCase):
+
+    def test_sends_whole_file_without_header(self):
+        self.assertEqual(parse_range(None, 100), None)
+        self.assertEqual(parse_range('', 100), None)
+
+    def test_ignores_unsupported_headers(self):
+        self.assertEqual(parse_range('bytes=0-1,5-6', 100), None)
+        self.assertEqual(parse_range('lines=0-1', 100), None)
+        self.assertEqual(parse_range('bytes=-', 100), None)
+
+    def test_parses_closed_range(self):
+        self.assertEqual(parse_range('bytes=10-19', 100), (10, 10))
+
+    def test_parses_open_range(self):
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 10))
+
+    def test_parses_suffix_range(self):
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 10))
+
+    def test_clamps_suffix_range_longer_than_file(self):
+        self.assertEqual(parse_range('bytes=-500', 100), (0, 100))
+
+    def test_clamps_end_past_end_of_file(self):
+        self.assertEqual(parse_range('bytes=50-500', 100), (50, 50))
+
+    def test_parses_single_byte(self):
+        self.assertEqual(parse_range('bytes=99-99', 100), (99, 1))
+
+    def test_rejects_start_past_end_of_file(self):
+        self.assertRaises(ValueError, parse_range, 'bytes=100-', 100)
+
+    def test_rejects_end_before_start(self):
+        self.assertRaises(ValueError, parse_range, 'bytes=20-10', 100)
+
+    def test_rejects_any_range_of_empty_file(self):
+        self.assertRaises(ValueError, parse_range, 'bytes=0-', 0)
+        self.assertRaises(ValueError, parse_range, 'bytes=-10', 0)
+
+
+class FileRangeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'file')
+        with open(self.filename, 'w') as f:
+            f.write('0123456789')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_reads_only_the_range(self):
+        r = FileRange(open(self.filename), 2, 5)
+        self.assertEqual(r.read(), '23456')
+        self.assertEqual(r.read(), '')
+        r.close()
+
+    def test_reads_in_pieces(self):
+        r = FileRange(open(self.filename), 2, 5)
+        self.assertEqual(r.read(3), '234')
+        self.assertEqual(r.read(3), '56')
+        self.assertEqual(r.read(3), '')
+        r.close()
+
+    def test_gives_fileno_of_file(self):
+        f = open(self.filename)
+        r = FileRange(f, 0, 10)
+        self.assertEqual(r.fileno(), f.fileno())
+        r.close()
+        self.assertTrue(f.closed)
+
+
+class QuietRequestHandler(morphcacheserver.server.SendfileRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class SendfileServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'file')
+        with open(self.filename, 'w') as f:
+            f.write('0123456789')
+
+        self.server = morphcacheserver.server.SendfileServer(
+            ('127.0.0.1', 0), threads=2, handler_class=QuietRequestHandler)
+        self.server.set_app(self.app)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tempdir)
+
+    def app(self, environ, start_response):
+        if environ['PATH_INFO'] == '/range':
+            start_response('200 OK', [('Content-Length', '4')])
+            # As Bottle does with file-like objects.
+            return environ['wsgi.file_wrapper'](
+                FileRange(open(self.filename), 3, 4))
+        if environ['PATH_INFO'] == '/stringio':
+            start_response('200 OK', [('Content-Length', '3')])
+            return environ['wsgi.file_wrapper'](StringIO.StringIO('abc'))
+        start_response('200 OK', [('Content-Length', '5')])
+        return ['hello']
+
+    def get(self, path):
+        f = urllib2.urlopen(self.url + path)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def test_sends_file_range(self):
+        self.assertEqual(self.get('range'), '3456')
+
+    def test_sends_other_responses(self):
+        self.assertEqual(self.get('other'), 'hello')
+
+    def test_handles_several_requests(self):
+        for i in xrange(5):
+            self.assertEqual(self.get('range'), '3456')
+
+    def test_sends_other_file_like_objects(self):
+        self.assertEqual(self.get('stringio'), 'abc')
+
+    def send_raw(self, request):
+        s = socket.create_connection(('127.0.0.1', self.server.server_port))
+        try:
+            s.sendall(request)
+            return s.makefile().read()
+        finally:
+            s.close()
+
+    def test_rejects_overlong_request_line(self):
+        response = self.send_raw('GET /%s HTTP/1.0\r\n\r\n' % ('x' * 70000))
+        self.assertTrue(response.startswith('HTTP/1.0 414 '))
+
+    def test_rejects_bad_request(self):
+        response = self.send_raw('GET / HTTP/x\r\n\r\n')
+        self.assertTrue(' 400 ' in response, response)
+
+
+class SendfileRequestHandlerTests(unittest.TestCase):
+
+    def test_logs_requests(self):
+        messages = []
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                messages.append(record.getMessage())
+
+        class FakeRequestHandler(
+                morphcacheserver.server.SendfileRequestHandler):
+            def __init__(self):
+                pass
+
+            def address_string(self):
+                return 'client'
+
+        handler = Handler()
+        logger = logging.getLogger()
+        old_handlers, old_level = logger.handlers, logger.level
+        logger.handlers = [handler]
+        logger.setLevel(logging.INFO)
+        try:
+            FakeRequestHandler().log_message('%s', 'GET /')
+        finally:
+            logger.handlers = old_handlers
+            logger.setLevel(old_level)
+        self.assertEqual(messages, ['client - GET /'])
@@ -47,7 +47,9 @@ class Error(cliapp.AppException):
 
 
 import artifact
+import artifactcacheindex
 import artifactcachereference
+import artifactpins
 import artifactresolver
 import artifactsplitrule
 import branchmanager
@@ -55,8 +57,10 @@ import bins
 import buildbranch
 import buildcommand
 import buildenvironment
+import buildhistory
 import buildsystem
 import builder
+import cacheeviction
 import cachekeycomputer
 import cmdline_parse_utils
 import defaults
@@ -66,14 +70,17 @@ import extensions
 import extractedtarball
 import fsutils
 import git
+import gitbatch
 import gitdir
 import gitindex
+import licensescan
 import localartifactcache
 import mountableimage
 import morphologyfinder
 import morphology
 import morphloader
 import morphset
+import refanchors
 import remoteartifactcache
 import repoaliasresolver
 import repocache
@@ -81,6 +88,7 @@ import savefile
 import source
 import sourcepool
 import sourceresolver
+import sourcetreecache
 import stagingarea
 import stopwatch
 import util
@@ -19,6 +19,7 @@ import logging
 import os
 import pipes
 import sys
+import threading
 import time
 import urlparse
 import warnings
@@ -101,6 +102,11 @@ class Morph(cliapp.Application):
                               'do not update the cached git repositories '
                               'automatically',
                               group=group_advanced)
+        self.settings.boolean(['shallow-git-cache'],
+                              'when a git repository is first cached for '
+                              'a single commit, fetch only that commit and '
+                              'not its history',
+                              group=group_advanced)
         self.settings.boolean(['build-log-on-stdout'],
                               'internal option for use by distbuild to'
                               'transfer logs from the worker to the'
@@ -152,6 +158,13 @@ class Morph(cliapp.Application):
                               metavar='N',
                               default=defaults['max-jobs'],
                               group=group_build)
+        self.settings.integer(['git-fetch-jobs'],
+                              'update at most N cached git repositories at '
+                              'once in the background while building; 0 '
+                              'updates each one just before it is built',
+                              metavar='N',
+                              default=4,
+                              group=group_build)
         self.settings.boolean(['no-ccache'], 'do not use ccache',
                               group=group_build)
         self.settings.boolean(['no-distcc'],
@@ -225,6 +238,16 @@ class Morph(cliapp.Application):
                                metavar='SIZE',
                                group=group_storage,
                                default='4G')
+        self.settings.bytesize(['source-tree-cache-size'],
+                               'keep up to SIZE bytes of extracted source '
+                               'trees in cachedir, so that building the same '
+                               'commit again does not need to extract it; '
+                               'best used where cachedir and tempdir are on '
+                               'a filesystem with reflinks '
+                               '(default: %default, which disables it)',
+                               metavar='SIZE',
+                               group=group_storage,
+                               default='0')
 
     def check_time(self):
         # Check that the current time is not far in the past.
@@ -233,7 +256,8 @@ class Morph(cliapp.Application):
                 'System time is far in the past, please set your system clock')
 
     def setup(self):
-        self.status_prefix = ''
+        self._status_prefix = morphlib.util.PerThreadValue('')
+        self._status_lock = threading.Lock()
 
         self.add_subcommand('help-extensions', self.help_extensions)
 
@@ -337,10 +361,27 @@ class Morph(cliapp.Application):
                    morphlib.util.sanitise_morphology_path(args[2]))
             args = args[3:]
 
+    @property
+    def status_prefix(self):
+        '''The prefix for status messages from the current thread.
+
+        Each thread can set its own prefix, for example to say which of
+        several deployments run at once a message is about. Threads that
+        have not set one use the main thread's prefix.
+
+        '''
+        return self._status_prefix.get()
+
+    @status_prefix.setter
+    def status_prefix(self, value):
+        self._status_prefix.set(value)
+
     def _write_status(self, text):
         timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
-        self.output.write('%s %s\n' % (timestamp, text))
-        self.output.flush()
+        # Builds and deployments report status from several threads.
+        with self._status_lock:
+            self.output.write('%s %s\n' % (timestamp, text))
+            self.output.flush()
 
     def status(self, **kwargs):
         '''Show user a status update.
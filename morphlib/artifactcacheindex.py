@@ -0,0 +1,392 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import atexit
+import collections
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import time
+
+
+def cache_key_of(basename):
+    '''Return the cache key that a file in the artifact cache belongs to.'''
+
+    return basename.split('.', 1)[0]
+
+
+def is_cache_file(basename):
+    '''Is this the name of an artifact or metadata file?
+
+    Anything else in the artifact cache directory, such as the temporary
+    files used while saving, is ignored.
+
+    '''
+
+    return '.' in basename and not basename.startswith('.')
+
+
+def is_source_metadata(basename):
+    '''Is this the 'meta' file of a source, which records its build?'''
+
+    return basename == '%s.meta' % cache_key_of(basename)
+
+
+def read_rebuild_cost(filename):
+    '''Return how long the build recorded in a 'meta' file took.
+
+    The 'overall-build' time from the 'build-times' section written by
+    BuilderBase.save_build_times is used. Returns None if the file can't
+    be read or has no such time.
+
+    '''
+
+    try:
+        with open(filename) as f:
+            meta = json.load(f)
+        return float(meta['build-times']['overall-build']['delta'])
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+
+
+class ArtifactCacheIndex(object):
+
+    '''Index of the files in a local artifact cache.
+
+    For each file in the cache the index records its size and when it was
+    last used, grouped by cache key. For the 'meta' file of each source it
+    also records how long the source took to build, read from the file
+    when it is added. Listing the cache, finding the files to remove for a
+    cache key, or choosing which to remove, then doesn't need to walk the
+    cache directory or read the files in it.
+
+    The index is kept in `dirname` as a snapshot plus a journal. Changes
+    are appended to the journal, one JSON list per line, which is safe
+    when several morph processes use the same cache at once. Loading the
+    index replays the journal on top of the snapshot, and once the journal
+    has more than `compact_after` entries it is folded into a new
+    snapshot.
+
+    If there is no snapshot, the index is rebuilt by scanning
+    `artifact_dir`. Running `rebuild` does the same at any time.
+
+    Checking whether the cache has a file happens far more often than
+    anything else, so the times files were used are collected in memory
+    by `use` and appended to the journal as one entry by `flush`. That
+    happens when the process exits, or once `flush_after` uses have been
+    collected.
+
+    '''
+
+    def __init__(self, dirname, artifact_dir, compact_after=10000,
+                 flush_after=1000):
+        self.dirname = dirname
+        self.artifact_dir = artifact_dir
+        self.compact_after = compact_after
+        self.flush_after = flush_after
+        self._used = {}
+        self._flush_at_exit = False
+        self._files = None
+        self._by_key = None
+        # Which snapshot was loaded, and how much of the journal after it.
+        self._snapshot_id = None
+        self._journal_offset = 0
+
+    def _path(self, name):
+        return os.path.join(self.dirname, name)
+
+    @contextlib.contextmanager
+    def _locked(self, operation):
+        if not os.path.isdir(self.dirname):
+            os.makedirs(self.dirname)
+        with open(self._path('lock'), 'a') as f:
+            fcntl.flock(f.fileno(), operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _append(self, entry):
+        with self._locked(fcntl.LOCK_SH):
+            with open(self._path('journal'), 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+        if self._files is not None:
+            self._apply(self._files, self._by_key, entry)
+
+    @staticmethod
+    def _apply(files, by_key, entry):
+        if entry[0] == 'set':
+            basename, size, last_used = entry[1:4]
+            if len(entry) > 4:
+                files[basename] = (size, last_used, entry[4])
+            else:
+                # Using a file doesn't change its recorded rebuild cost.
+                files[basename] = (size, last_used) + tuple(
+                    files.get(basename, ())[2:])
+            by_key[cache_key_of(basename)].add(basename)
+        elif entry[0] == 'used':
+            for basename, last_used in entry[1:]:
+                if basename in files:
+                    info = files[basename]
+                    files[basename] = (info[0], last_used) + info[2:]
+        elif entry[0] == 'remove':
+            for basename in entry[1:]:
+                files.pop(basename, None)
+                key = cache_key_of(basename)
+                by_key[key].discard(basename)
+                if not by_key[key]:
+                    del by_key[key]
+        elif entry[0] == 'clear':
+            files.clear()
+            by_key.clear()
+
+    def _get_snapshot_id(self):
+        try:
+            stinfo = os.stat(self._path('snapshot'))
+        except OSError:
+            return None
+        return (stinfo.st_ino, stinfo.st_mtime, stinfo.st_size)
+
+    def _read_journal(self, files, by_key, offset):
+        '''Apply the journal from `offset` on. The caller must hold the lock.
+
+        Returns the entries applied and the offset after the last of them.
+        A line still being written is left for next time.
+
+        '''
+
+        entries = []
+        if not os.path.exists(self._path('journal')):
+            return entries, offset
+        with open(self._path('journal')) as f:
+            f.seek(offset)
+            while True:
+                line = f.readline()
+                if not line.endswith('\n'):
+                    break
+                offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A process died while writing this line.
+                    continue
+                self._apply(files, by_key, entry)
+                entries.append(entry)
+        return entries, offset
+
+    def _read(self):
+        '''Read the snapshot and journal. The caller must hold the lock.'''
+
+        try:
+            with open(self._path('snapshot')) as f:
+                files = dict((name, tuple(info))
+                             for name, info in json.load(f).iteritems())
+        except (IOError, ValueError):
+            return None, 0
+
+        by_key = collections.defaultdict(set)
+        for basename in files:
+            by_key[cache_key_of(basename)].add(basename)
+
+        self._snapshot_id = self._get_snapshot_id()
+        entries, self._journal_offset = self._read_journal(files, by_key, 0)
+        return (files, by_key), len(entries)
+
+    def _write_snapshot(self, files):
+        '''Replace the snapshot and empty the journal.
+
+        The caller must hold the lock exclusively.
+
+        '''
+
+        tmpname = self._path('snapshot.tmp')
+        with open(tmpname, 'w') as f:
+            json.dump(files, f)
+        os.rename(tmpname, self._path('snapshot'))
+        with open(self._path('journal'), 'w'):
+            pass
+        self._snapshot_id = self._get_snapshot_id()
+        self._journal_offset = 0
+
+    def _scan(self):
+        files = {}
+        if os.path.isdir(self.artifact_dir):
+            for basename in os.listdir(self.artifact_dir):
+                if not is_cache_file(basename):
+                    continue
+                filename = os.path.join(self.artifact_dir, basename)
+                try:
+                    stinfo = os.stat(filename)
+                except OSError:  # pragma: no cover
+                    continue
+                files[basename] = (stinfo.st_size, stinfo.st_mtime)
+                if is_source_metadata(basename):
+                    files[basename] += (read_rebuild_cost(filename),)
+        return files
+
+    def rebuild(self):
+        '''Rebuild the index from the files in the artifact directory.'''
+
+        start = time.time()
+        with self._locked(fcntl.LOCK_EX):
+            files = self._scan()
+            self._write_snapshot(files)
+        logging.info('Indexed %d files in %s in %.1f seconds',
+                     len(files), self.artifact_dir, time.time() - start)
+        self._files = None
+        self._load()
+
+    def _load(self):
+        if self._files is not None:
+            return
+        with self._locked(fcntl.LOCK_SH):
+            index, count = self._read()
+        if index is None:
+            self.rebuild()
+            return
+        if count > self.compact_after:
+            with self._locked(fcntl.LOCK_EX):
+                index, count = self._read()
+                if index is not None:
+                    self._write_snapshot(index[0])
+        self._files, self._by_key = index
+
+    def reload(self):
+        '''Forget the loaded index, to see changes by other processes.'''
+
+        self._files = None
+        self._by_key = None
+
+    def refresh(self):
+        '''Catch up with changes made by other processes.
+
+        Only the part of the journal written since the index was loaded
+        or last refreshed is read, unless the index has been compacted or
+        rebuilt since, in which case it is loaded again.
+
+        Returns the names of the files added or used since, or None if the
+        index was loaded again or emptied.
+
+        '''
+
+        if self._files is None:
+            self._load()
+            return None
+        with self._locked(fcntl.LOCK_SH):
+            if self._get_snapshot_id() == self._snapshot_id:
+                entries, self._journal_offset = self._read_journal(
+                    self._files, self._by_key, self._journal_offset)
+                if not any(entry[0] == 'clear' for entry in entries):
+                    return [entry[1] for entry in entries
+                            if entry[0] == 'set']
+        self.reload()
+        self._load()
+        return None
+
+    def basenames(self):
+        '''Return the names of all the files in the cache.'''
+
+        self._load()
+        return self._files.keys()
+
+    def add(self, basename, saved=False):
+        '''Record that a file in the cache was just put there or used.
+
+        `saved` says that the file was just put there, so the rebuild cost
+        in a 'meta' file must be read again.
+
+        '''
+
+        filename = os.path.join(self.artifact_dir, basename)
+        entry = ['set', basename, os.path.getsize(filename), time.time()]
+        if saved and is_source_metadata(basename):
+            entry.append(read_rebuild_cost(filename))
+        self._append(entry)
+
+    def use(self, basename):
+        '''Record that a file in the cache was just used.
+
+        Nothing is written until `flush` is called. Files the index
+        doesn't know about are ignored, since every file put into the
+        cache is recorded by `add`.
+
+        '''
+
+        now = time.time()
+        self._used[basename] = now
+        if self._files is not None and basename in self._files:
+            info = self._files[basename]
+            self._files[basename] = (info[0], now) + info[2:]
+        if len(self._used) >= self.flush_after:
+            self.flush()
+        elif not self._flush_at_exit:
+            atexit.register(self._flush_before_exit)
+            self._flush_at_exit = True
+
+    def flush(self):
+        '''Write the uses recorded by `use` to the journal.'''
+
+        if self._used:
+            used = self._used
+            self._used = {}
+            self._append(['used'] + [list(item) for item in used.iteritems()])
+
+    def _flush_before_exit(self):  # pragma: no cover
+        if not os.path.isdir(self.dirname):
+            # The index was removed, so it will be rebuilt anyway.
+            return
+        try:
+            self.flush()
+        except EnvironmentError as e:
+            logging.warning('Could not record use of cached artifacts: %s',
+                            e)
+
+    def remove(self, basenames):
+        '''Record that files have been removed from the cache.'''
+
+        if basenames:
+            self._append(['remove'] + list(basenames))
+
+    def clear(self):
+        '''Record that every file has been removed from the cache.'''
+
+        self._append(['clear'])
+
+    def files(self, cachekey):
+        '''Return the names of the files that belong to a cache key.'''
+
+        self._load()
+        return set(self._by_key.get(cachekey, ()))
+
+    def contents(self):
+        '''Return the cached sources as (cachekey, {basename: info}) pairs.
+
+        The info for each file is a (size, last_used) pair.
+
+        '''
+
+        self._load()
+        for cachekey, basenames in self._by_key.iteritems():
+            yield cachekey, dict((basename, self._files[basename][:2])
+                                 for basename in basenames)
+
+    def rebuild_cost(self, cachekey):
+        '''Return how long a source took to build, or None if not known.'''
+
+        self._load()
+        info = self._files.get('%s.meta' % cachekey, ())
+        return info[2] if len(info) > 2 else None
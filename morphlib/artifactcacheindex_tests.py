@@ -0,0 +1,206 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import morphlib
+
+
+class ArtifactCacheIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.artifact_dir = os.path.join(self.tempdir, 'artifacts')
+        self.index_dir = os.path.join(self.tempdir, 'artifact-index')
+        os.mkdir(self.artifact_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def new_index(self, **kwargs):
+        return morphlib.artifactcacheindex.ArtifactCacheIndex(
+            self.index_dir, self.artifact_dir, **kwargs)
+
+    def create_file(self, basename, contents='data'):
+        with open(os.path.join(self.artifact_dir, basename), 'w') as f:
+            f.write(contents)
+
+    def add_file(self, index, basename, contents='data'):
+        self.create_file(basename, contents)
+        index.add(basename)
+
+    def test_builds_index_from_disk_when_missing(self):
+        self.create_file('abc.chunk.foo-runtime', 'runtime')
+        self.create_file('abc.build-log')
+        self.create_file('tmpXYZ')
+        index = self.new_index()
+        self.assertEqual(index.files('abc'),
+                         set(['abc.chunk.foo-runtime', 'abc.build-log']))
+        contents = dict(index.contents())
+        self.assertEqual(contents['abc']['abc.chunk.foo-runtime'][0], 7)
+
+    def test_other_instances_see_changes(self):
+        index = self.new_index()
+        index.rebuild()
+        self.add_file(index, 'abc.chunk.foo-runtime')
+        self.add_file(index, 'def.chunk.bar-runtime')
+        index.remove(['abc.chunk.foo-runtime'])
+
+        other = self.new_index()
+        self.assertEqual(other.files('abc'), set())
+        self.assertEqual(other.files('def'), set(['def.chunk.bar-runtime']))
+
+    def test_does_not_rescan_disk_once_built(self):
+        index = self.new_index()
+        index.files('abc')
+        self.create_file('abc.chunk.foo-runtime')
+        self.assertEqual(self.new_index().files('abc'), set())
+
+    def test_rebuild_finds_files_added_behind_its_back(self):
+        index = self.new_index()
+        index.files('abc')
+        self.create_file('abc.chunk.foo-runtime')
+        index.rebuild()
+        self.assertEqual(index.files('abc'), set(['abc.chunk.foo-runtime']))
+
+    def test_clear_forgets_everything(self):
+        index = self.new_index()
+        index.rebuild()
+        self.add_file(index, 'abc.chunk.foo-runtime')
+        index.clear()
+        self.assertEqual(list(self.new_index().contents()), [])
+
+    def test_compacts_long_journal(self):
+        index = self.new_index(compact_after=2)
+        for name in ('a', 'b', 'c'):
+            self.add_file(index, '%s.chunk.foo-runtime' % name)
+
+        other = self.new_index(compact_after=2)
+        self.assertEqual(len(list(other.contents())), 3)
+        journal = os.path.join(self.index_dir, 'journal')
+        self.assertEqual(os.path.getsize(journal), 0)
+        self.assertEqual(len(list(self.new_index().contents())), 3)
+
+    def test_ignores_partly_written_journal_entry(self):
+        index = self.new_index()
+        self.add_file(index, 'abc.chunk.foo-runtime')
+        with open(os.path.join(self.index_dir, 'journal'), 'a') as f:
+            f.write('["remove", "abc.chu')
+        self.assertEqual(self.new_index().files('abc'),
+                         set(['abc.chunk.foo-runtime']))
+
+    def meta(self, seconds):
+        return json.dumps(
+            {'build-times': {'overall-build': {'delta': '%.4f' % seconds}}})
+
+    def test_records_rebuild_cost_of_saved_meta_file(self):
+        index = self.new_index()
+        index.rebuild()
+        self.create_file('abc.meta', self.meta(42))
+        index.add('abc.meta', saved=True)
+        self.create_file('abc.meta', self.meta(1))
+        index.add('abc.meta')
+        self.assertEqual(self.new_index().rebuild_cost('abc'), 42.0)
+
+    def test_rebuild_reads_rebuild_costs(self):
+        self.create_file('abc.meta', self.meta(42))
+        self.create_file('def.meta', 'not json')
+        index = self.new_index()
+        self.assertEqual(index.rebuild_cost('abc'), 42.0)
+        self.assertEqual(index.rebuild_cost('def'), None)
+        self.assertEqual(index.rebuild_cost('ghi'), None)
+
+    def test_refresh_reads_only_new_changes(self):
+        index = self.new_index()
+        index.rebuild()
+        self.assertEqual(index.refresh(), [])
+        other = self.new_index()
+        self.add_file(other, 'abc.chunk.foo-runtime')
+        other.remove(['abc.chunk.foo-runtime'])
+        self.add_file(other, 'def.chunk.bar-runtime')
+        self.assertEqual(index.refresh(),
+                         ['abc.chunk.foo-runtime', 'def.chunk.bar-runtime'])
+        self.assertEqual(index.files('abc'), set())
+        self.assertEqual(index.refresh(), [])
+        self.assertEqual(sorted(index.basenames()), ['def.chunk.bar-runtime'])
+
+    def test_refresh_reloads_after_compaction_or_clear(self):
+        index = self.new_index(compact_after=1)
+        self.assertEqual(index.refresh(), None)
+        other = self.new_index(compact_after=1)
+        self.add_file(other, 'abc.chunk.foo-runtime')
+        self.add_file(other, 'def.chunk.bar-runtime')
+        self.new_index(compact_after=1).files('abc')
+        self.assertEqual(index.refresh(), None)
+        self.assertEqual(len(index.basenames()), 2)
+        other.clear()
+        self.assertEqual(index.refresh(), None)
+        self.assertEqual(index.basenames(), [])
+
+    def journal_lines(self):
+        with open(os.path.join(self.index_dir, 'journal')) as f:
+            return len(f.readlines())
+
+    def last_used(self, index, basename):
+        return dict(index.contents())[basename.split('.')[0]][basename][1]
+
+    def test_collects_uses_until_flushed(self):
+        index = self.new_index()
+        index.rebuild()
+        self.add_file(index, 'abc.chunk.foo-runtime')
+        self.add_file(index, 'def.chunk.bar-runtime')
+        added = self.last_used(self.new_index(), 'abc.chunk.foo-runtime')
+
+        for i in xrange(3):
+            index.use('abc.chunk.foo-runtime')
+            index.use('def.chunk.bar-runtime')
+        self.assertEqual(self.journal_lines(), 2)
+        self.assertTrue(
+            self.last_used(index, 'abc.chunk.foo-runtime') >= added)
+        self.assertEqual(
+            self.last_used(self.new_index(), 'abc.chunk.foo-runtime'), added)
+
+        index.flush()
+        self.assertEqual(self.journal_lines(), 3)
+        self.assertEqual(
+            self.last_used(self.new_index(), 'abc.chunk.foo-runtime'),
+            self.last_used(index, 'abc.chunk.foo-runtime'))
+        index.flush()
+        self.assertEqual(self.journal_lines(), 3)
+
+    def test_flushes_after_many_uses(self):
+        index = self.new_index(flush_after=2)
+        index.rebuild()
+        self.add_file(index, 'abc.chunk.foo-runtime')
+        index.use('abc.chunk.foo-runtime')
+        self.assertEqual(self.journal_lines(), 1)
+        index.use('abc.chunk.foo-runtime')
+        self.assertEqual(self.journal_lines(), 1)
+        index.use('def.chunk.bar-runtime')
+        self.assertEqual(self.journal_lines(), 2)
+
+    def test_ignores_use_of_unknown_or_removed_files(self):
+        index = self.new_index()
+        index.rebuild()
+        self.add_file(index, 'abc.chunk.foo-runtime')
+        index.use('abc.chunk.foo-runtime')
+        index.use('def.chunk.bar-runtime')
+        index.remove(['abc.chunk.foo-runtime'])
+        index.flush()
+        self.assertEqual(list(self.new_index().contents()), [])
@@ -0,0 +1,167 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import contextlib
+import errno
+import fcntl
+import json
+import logging
+import os
+import socket
+import tempfile
+
+
+def process_is_running(pid):
+    '''Is there a process with this ID on this machine?'''
+
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno == errno.ESRCH:
+            return False
+        if e.errno == errno.EPERM:
+            # It's there, but belongs to someone else.
+            return True
+        raise  # pragma: no cover
+    return True
+
+
+class ArtifactPins(object):
+
+    '''Cache keys that must stay in the local artifact cache for now.
+
+    A build pins the cache keys of everything it may install into its
+    staging areas, and a deployment pins the system it is unpacking, so
+    that `morph gc`, run at the same time by this or another morph
+    process, does not remove them.
+
+    Each pin is a file in `dirname` naming the host and process that holds
+    it. Pins are removed when the holder finishes, and pins held by
+    processes on this host which are no longer running are ignored and
+    cleaned up, so a killed morph leaves nothing pinned for long. Pins
+    from other hosts, which can happen when the cache directory is shared,
+    are always honoured.
+
+    A shared lock is held while pinning, and an exclusive lock while
+    removing, so nothing is removed between a process pinning a cache key
+    and it checking that the artifacts are still there.
+
+    '''
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+
+    def _ensure_dir(self):
+        if not os.path.isdir(self.dirname):
+            os.makedirs(self.dirname)
+
+    @contextlib.contextmanager
+    def _locked(self, operation):
+        self._ensure_dir()
+        with open(os.path.join(self.dirname, 'lock'), 'a') as f:
+            fcntl.flock(f.fileno(), operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def hold(self, cachekeys):
+        '''Keep the given cache keys in the cache until released.
+
+        Returns the name of the pin file, to give to release(). The pin
+        belongs to this process, so is dropped if it dies first.
+
+        '''
+
+        pin = {
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'cache-keys': sorted(set(cachekeys)),
+        }
+        with self._locked(fcntl.LOCK_SH):
+            fd, filename = tempfile.mkstemp(
+                dir=self.dirname, prefix='%(host)s-%(pid)d-' % pin,
+                suffix='.pin')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(pin, f)
+        logging.debug('Pinned %d cache keys in %s',
+                      len(pin['cache-keys']), filename)
+        return filename
+
+    def release(self, filename):
+        '''Drop a pin taken with hold().'''
+
+        os.remove(filename)
+
+    @contextlib.contextmanager
+    def pin(self, cachekeys):
+        '''Keep the given cache keys in the cache while in this context.'''
+
+        filename = self.hold(cachekeys)
+        try:
+            yield
+        finally:
+            self.release(filename)
+
+    def _is_stale(self, pin):
+        return (pin['host'] == socket.gethostname() and
+                not process_is_running(pin['pid']))
+
+    def pinned(self):
+        '''Return the set of cache keys that are pinned.
+
+        Pins left behind by processes that have died are removed.
+
+        '''
+
+        self._ensure_dir()
+        cachekeys = set()
+        for name in os.listdir(self.dirname):
+            if not name.endswith('.pin'):
+                continue
+            filename = os.path.join(self.dirname, name)
+            try:
+                with open(filename) as f:
+                    pin = json.load(f)
+            except IOError:  # pragma: no cover
+                # The holder finished while we were looking.
+                continue
+            except ValueError:  # pragma: no cover
+                logging.warning('Ignoring corrupt pin file %s', filename)
+                continue
+            if self._is_stale(pin):
+                logging.debug('Removing pin %s of dead process %d',
+                              filename, pin['pid'])
+                try:
+                    os.remove(filename)
+                except OSError as e:  # pragma: no cover
+                    # Another process cleaned it up first.
+                    if e.errno != errno.ENOENT:
+                        raise
+                continue
+            cachekeys.update(pin['cache-keys'])
+        return cachekeys
+
+    @contextlib.contextmanager
+    def removing(self):
+        '''Stop new pins being taken while removing from the cache.
+
+        Yields the set of cache keys that are pinned, which must not be
+        removed.
+
+        '''
+
+        with self._locked(fcntl.LOCK_EX):
+            yield self.pinned()
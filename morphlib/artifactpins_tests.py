@@ -0,0 +1,80 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import unittest
+
+import morphlib
+
+
+class ArtifactPinsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.pins = morphlib.artifactpins.ArtifactPins(
+            os.path.join(self.tempdir, 'pins'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write_pin(self, host, pid, cachekeys):
+        filename = os.path.join(self.pins.dirname, '%s-%d-x.pin' % (host, pid))
+        with open(filename, 'w') as f:
+            json.dump({'host': host, 'pid': pid, 'cache-keys': cachekeys}, f)
+        return filename
+
+    def dead_pid(self):
+        p = subprocess.Popen(['true'])
+        p.wait()
+        return p.pid
+
+    def test_nothing_pinned_initially(self):
+        self.assertEqual(self.pins.pinned(), set())
+
+    def test_pins_last_until_context_ends(self):
+        with self.pins.pin(['abc', 'def']):
+            with self.pins.pin(['def', 'ghi']):
+                self.assertEqual(self.pins.pinned(),
+                                 set(['abc', 'def', 'ghi']))
+            self.assertEqual(self.pins.pinned(), set(['abc', 'def']))
+        self.assertEqual(self.pins.pinned(), set())
+
+    def test_ignores_and_removes_pins_of_dead_processes(self):
+        self.pins._ensure_dir()
+        filename = self.write_pin(socket.gethostname(), self.dead_pid(),
+                                  ['abc'])
+        self.assertEqual(self.pins.pinned(), set())
+        self.assertFalse(os.path.exists(filename))
+
+    def test_honours_pins_from_other_hosts(self):
+        self.pins._ensure_dir()
+        self.write_pin('some-other-host', self.dead_pid(), ['abc'])
+        self.assertEqual(self.pins.pinned(), set(['abc']))
+
+    def test_removing_yields_pinned_keys(self):
+        with self.pins.pin(['abc']):
+            with self.pins.removing() as pinned:
+                self.assertEqual(pinned, set(['abc']))
+
+    def test_held_pins_last_until_released(self):
+        filename = self.pins.hold(['abc'])
+        self.assertEqual(self.pins.pinned(), set(['abc']))
+        self.pins.release(filename)
+        self.assertEqual(self.pins.pinned(), set())
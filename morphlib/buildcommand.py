@@ -16,10 +16,12 @@
 
 
 import itertools
+import multiprocessing.pool
 import os
 import shutil
 import logging
 import tempfile
+import threading
 import datetime
 
 import morphlib
@@ -48,6 +50,13 @@ class BuildCommand(object):
         self.app = app
         self.lac, self.rac = self.new_artifact_caches()
         self.repo_cache = morphlib.util.new_repo_cache(self.app)
+        self.build_history = morphlib.util.new_build_history(
+            self.app.settings)
+        self.source_tree_cache = morphlib.util.new_source_tree_cache(
+            self.app.settings)
+        self._prefetch_pool = None
+        self._prefetches = {}
+        self._prefetch_stopped = threading.Event()
 
     def build(self, repo_name, ref, filename, original_ref=None):
         '''Build a given system morphology.'''
@@ -282,15 +291,23 @@ class BuildCommand(object):
         build_env = root_artifact.build_env
         ordered_sources = list(self.get_ordered_sources(root_artifact.walk()))
         old_prefix = self.app.status_prefix
-        for i, s in enumerate(ordered_sources):
-            self.app.status_prefix = (
-                old_prefix + '[Build %(index)d/%(total)d] [%(name)s] ' % {
-                    'index': (i+1),
-                    'total': len(ordered_sources),
-                    'name': s.name,
-                })
-
-            self.cache_or_build_source(s, build_env, definitions_version)
+        # Stop gc removing what is built early on before it is used.
+        with self.lac.pin(s.cache_key for s in ordered_sources):
+            self.prefetch_sources(ordered_sources, definitions_version)
+            try:
+                for i, s in enumerate(ordered_sources):
+                    self.app.status_prefix = (
+                        old_prefix +
+                        '[Build %(index)d/%(total)d] [%(name)s] ' % {
+                            'index': (i+1),
+                            'total': len(ordered_sources),
+                            'name': s.name,
+                        })
+
+                    self.cache_or_build_source(s, build_env,
+                                               definitions_version)
+            finally:
+                self.stop_prefetching()
 
         self.app.status_prefix = old_prefix
 
@@ -387,12 +404,80 @@ class BuildCommand(object):
                     ordered_deps.append(dep)
         return ordered_deps
 
+    def prefetch_sources(self, sources, definitions_version):
+        '''Start updating the git repositories for a list of sources.
+
+        The repositories are updated by a pool of threads while the
+        sources before them are being built, so that the build rarely has
+        to wait for the network. Sources that are already in the local
+        artifact cache are skipped, and sources that are in the remote
+        artifact cache are skipped once the thread gets to them.
+
+        '''
+
+        jobs = self.app.settings['git-fetch-jobs']
+        if jobs < 1:
+            return
+
+        self._prefetch_stopped.clear()
+        self._prefetch_pool = multiprocessing.pool.ThreadPool(jobs)
+        for source in sources:
+            if all(self.lac.has(a) for a in source.artifacts.itervalues()):
+                continue
+            self._prefetches[source] = self._prefetch_pool.apply_async(
+                self._prefetch_source, (source, definitions_version))
+        self._prefetch_pool.close()
+
+    def _prefetch_source(self, source, definitions_version):
+        if self._prefetch_stopped.is_set():
+            return False
+        artifacts = source.artifacts.values()
+        if self.rac is not None and all(self.rac.has(a) for a in artifacts):
+            return False
+        self._update_sources(source, definitions_version,
+                             stopped=self._prefetch_stopped.is_set)
+        return True
+
+    def stop_prefetching(self):
+        '''Abandon any repository updates that have not started yet.
+
+        Updates of a repository that are already running are left to
+        finish, so that the repository is not left half updated.
+
+        '''
+
+        if self._prefetch_pool is not None:
+            self._prefetch_stopped.set()
+            self._prefetch_pool.join()
+            self._prefetch_pool = None
+        self._prefetches = {}
+
     def fetch_sources(self, source, definitions_version):
-        '''Update the local git repository cache with the sources.'''
+        '''Update the local git repository cache with the sources.
 
+        If the update was started by `prefetch_sources`, this waits for it
+        to finish.
+
+        '''
+
+        prefetch = self._prefetches.pop(source, None)
+        if prefetch is not None:
+            try:
+                if prefetch.get():
+                    return
+            except Exception as e:
+                # Try again, so that any error is reported as usual.
+                logging.warning('Updating repositories for %s in the '
+                                'background failed: %s', source.name, e)
+        self._update_sources(source, definitions_version)
+
+    def _update_sources(self, source, definitions_version,
+                        stopped=lambda: False):
         repo_name = source.repo_name
         source.repo = self.repo_cache.get_updated_repo(repo_name,
                                                        ref=source.sha1)
+        if stopped():
+            return
         if source.morphology['kind'] == 'chunk':
             if definitions_version >= 8:
                 self.repo_cache.ensure_submodules(
@@ -547,7 +632,8 @@ class BuildCommand(object):
         builder = morphlib.builder.Builder(
             self.app, staging_area, self.lac, self.rac, self.repo_cache,
             self.app.settings['max-jobs'], setup_mounts,
-            definitions_version)
+            definitions_version, build_history=self.build_history,
+            source_tree_cache=self.source_tree_cache)
         return builder.build_and_cache(source)
 
 class InitiatorBuildCommand(BuildCommand):
@@ -37,15 +37,26 @@ SYSTEM_INTEGRATION_PATH = os.path.join('baserock', 'system-integration')
 
 def extract_sources(app, definitions_version, repo_cache, repo, sha1,
                     destdir, source): #pragma: no cover
-    '''Get sources from git to a source directory, including submodules'''
+    '''Get sources from git to a source directory, including submodules
+
+    If the chunk's 'source-extraction' is 'export', only the files at the
+    commit are written out, without a .git directory. This avoids copying
+    the whole history of the repository.
+
+    '''
+
+    export = source.morphology.get('source-extraction') == 'export'
 
     def extract_repo(repo, sha1, destdir, submodules_map=None):
         app.status(msg='Extracting %(source)s into %(target)s',
                    source=repo.original_name,
                    target=destdir)
 
-        morphlib.gitdir.checkout_from_cached_repo(repo, sha1, destdir)
-        morphlib.git.reset_workdir(app.runcmd, destdir)
+        if export:
+            repo.extract_commit(sha1, destdir)
+        else:
+            morphlib.gitdir.checkout_from_cached_repo(repo, sha1, destdir)
+            morphlib.git.reset_workdir(app.runcmd, destdir)
         submodules = morphlib.git.Submodules(repo.dirname, sha1, app.runcmd)
         try:
             submodules.load()
@@ -159,7 +170,8 @@ class BuilderBase(object):
 
     def __init__(self, app, staging_area, local_artifact_cache,
                  remote_artifact_cache, source, repo_cache, max_jobs,
-                 setup_mounts, definitions_version):
+                 setup_mounts, definitions_version, build_history=None,
+                 source_tree_cache=None):
         self.app = app
         self.staging_area = staging_area
         self.local_artifact_cache = local_artifact_cache
@@ -170,6 +182,8 @@ class BuilderBase(object):
         self.build_watch = morphlib.stopwatch.Stopwatch()
         self.setup_mounts = setup_mounts
         self.definitions_version = definitions_version
+        self.build_history = build_history
+        self.source_tree_cache = source_tree_cache
 
     def save_build_times(self):
         '''Write the times captured by the stopwatch'''
@@ -191,6 +205,17 @@ class BuilderBase(object):
                       encoding='unicode-escape')
             f.write('\n')
 
+        if self.build_history is not None:
+            # The history only guides scheduling, so is not worth failing
+            # a build for.
+            try:
+                self.build_history.record_build_times(
+                    self.source.name, meta['build-times'],
+                    cache_key=self.source.cache_key)
+            except EnvironmentError as e:
+                logging.warning('Could not record build times of %s: %s',
+                                self.source.name, e)
+
     def create_metadata(self, artifact_name, contents=[]): # pragma: no cover
         '''Create metadata to artifact to allow it to be reproduced later.
 
@@ -504,8 +529,23 @@ class ChunkBuilder(BuilderBase):
 
     def get_sources(self, srcdir):  # pragma: no cover
         s = self.source
+        cache = self.source_tree_cache
+        if cache is None:
+            extract_sources(self.app, self.definitions_version,
+                            self.repo_cache, s.repo, s.sha1, srcdir, s)
+            return
+
+        submodules = s.submodules if self.definitions_version >= 8 else None
+        key = cache.key(s.repo.url, s.sha1,
+                        s.morphology.get('source-extraction', 'checkout'),
+                        submodules)
+        if cache.get(key, srcdir):
+            self.app.status(msg='Copied cached source tree for %(name)s',
+                            name=s.name, chatty=True)
+            return
         extract_sources(self.app, self.definitions_version, self.repo_cache,
                         s.repo, s.sha1, srcdir, s)
+        cache.put(key, srcdir)
 
 
 class StratumBuilder(BuilderBase):
@@ -741,7 +781,8 @@ class Builder(object):  # pragma: no cover
 
     def __init__(self, app, staging_area, local_artifact_cache,
                  remote_artifact_cache, repo_cache, max_jobs, setup_mounts,
-                 definitions_version):
+                 definitions_version, build_history=None,
+                 source_tree_cache=None):
         self.app = app
         self.staging_area = staging_area
         self.local_artifact_cache = local_artifact_cache
@@ -750,6 +791,8 @@ class Builder(object):  # pragma: no cover
         self.max_jobs = max_jobs
         self.setup_mounts = setup_mounts
         self.definitions_version = definitions_version
+        self.build_history = build_history
+        self.source_tree_cache = source_tree_cache
 
     def build_and_cache(self, source):
         kind = source.morphology['kind']
@@ -758,7 +801,9 @@ class Builder(object):  # pragma: no cover
                                self.remote_artifact_cache, source,
                                self.repo_cache, self.max_jobs,
                                self.setup_mounts,
-                               self.definitions_version)
+                               self.definitions_version,
+                               build_history=self.build_history,
+                               source_tree_cache=self.source_tree_cache)
         self.app.status(msg='Builder.build: artifact %s with %s' %
                        (source.name, repr(o)),
                        chatty=True)
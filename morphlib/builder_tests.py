@@ -14,6 +14,7 @@
 
 
 import json
+import logging
 import os
 import StringIO
 import unittest
@@ -181,6 +182,21 @@ class BuilderBaseTests(unittest.TestCase):
         self.assertEqual(sorted(events),
                          sorted(meta['build-times'].keys()))
 
+    def test_carries_on_when_build_history_cannot_be_written(self):
+        class UnwritableBuildHistory(object):
+            def record_build_times(self, *args, **kwargs):
+                raise IOError('No space left on device')
+        self.builder.build_history = UnwritableBuildHistory()
+        with self.builder.build_watch('nothing'):
+            pass
+        logging.disable(logging.WARNING)
+        try:
+            self.builder.save_build_times()
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertTrue(self.artifact_cache.has_source_metadata(
+            self.artifact.source, self.artifact.cache_key, 'meta'))
+
     def test_downloads_depends(self):
         lac = FakeArtifactCache()
         rac = FakeArtifactCache()
@@ -0,0 +1,212 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import logging
+import math
+import os
+import socket
+import time
+import urllib
+
+import morphlib
+
+
+def percentile(values, pct):
+    '''Return the pct'th percentile of a list of numbers.
+
+    Linear interpolation is used between the closest ranks, so the 50th
+    percentile of an even number of samples is the mean of the middle
+    two. Returns None for an empty list.
+
+    '''
+
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * (pct / 100.0)
+    lower = int(math.floor(rank))
+    upper = int(math.ceil(rank))
+    if lower == upper:
+        return values[lower]
+    fraction = rank - lower
+    return values[lower] + (values[upper] - values[lower]) * fraction
+
+
+class BuildHistory(object):
+
+    '''Time series of how long the stages of past builds took.
+
+    Each sample records the source name, the build stage (as named in the
+    'build-times' metadata written by BuilderBase.save_build_times), the
+    worker that ran it, the cache key that was built and the duration in
+    seconds.
+
+    Samples for a source are appended, one JSON object per line, to a
+    file named after that source in the history directory. Appending
+    whole lines with O_APPEND is safe when several morph processes on the
+    same host record builds at once. Only the most recent `max_samples`
+    are kept: once a file holds more, it is rewritten without the oldest,
+    and a sample appended by another process meanwhile may be lost.
+
+    Estimates only look at the most recent `window` samples, so that a
+    chunk whose build time regresses is noticed quickly.
+
+    '''
+
+    def __init__(self, dirname, window=20, max_samples=1000):
+        self.dirname = dirname
+        self.window = window
+        self.max_samples = max_samples
+
+    def _filename(self, name):
+        return os.path.join(self.dirname,
+                            '%s.jsonl' % urllib.quote(name, safe=''))
+
+    def _append(self, name, samples):
+        if not os.path.isdir(self.dirname):
+            os.makedirs(self.dirname)
+        lines = ''.join(json.dumps(s, sort_keys=True) + '\n'
+                        for s in samples)
+        fd = os.open(self._filename(name),
+                     os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, lines)
+        finally:
+            os.close(fd)
+        self._trim(name)
+
+    def _trim(self, name):
+        filename = self._filename(name)
+        with open(filename) as f:
+            lines = f.readlines()
+        if len(lines) <= self.max_samples:
+            return
+        with morphlib.savefile.SaveFile(filename, 'w') as f:
+            f.writelines(lines[-self.max_samples:])
+
+    def record(self, name, stage, seconds, worker=None, cache_key=None,
+               timestamp=None):
+        '''Record that one stage of building `name` took `seconds`.'''
+
+        self.record_many(name, {stage: seconds}, worker=worker,
+                         cache_key=cache_key, timestamp=timestamp)
+
+    def record_many(self, name, durations, worker=None, cache_key=None,
+                    timestamp=None):
+        '''Record the durations of several stages of one build.
+
+        `durations` maps stage names to durations in seconds.
+
+        '''
+
+        if worker is None:
+            worker = socket.gethostname()
+        if timestamp is None:
+            timestamp = time.time()
+        samples = [{
+            'name': name,
+            'stage': stage,
+            'seconds': float(seconds),
+            'worker': worker,
+            'cache-key': cache_key,
+            'time': timestamp,
+        } for stage, seconds in sorted(durations.iteritems())]
+        self._append(name, samples)
+
+    def record_build_times(self, name, build_times, worker=None,
+                           cache_key=None):
+        '''Record the 'build-times' section of a source's metadata.'''
+
+        durations = dict((stage, times['delta'])
+                         for stage, times in build_times.iteritems())
+        self.record_many(name, durations, worker=worker, cache_key=cache_key)
+
+    def names(self):
+        '''Return the names of all sources with recorded samples.'''
+
+        if not os.path.isdir(self.dirname):
+            return []
+        return sorted(urllib.unquote(f[:-len('.jsonl')])
+                      for f in os.listdir(self.dirname)
+                      if f.endswith('.jsonl'))
+
+    def samples(self, name, stage=None, worker=None):
+        '''Return recorded samples for `name`, oldest first.
+
+        Samples can be restricted to a single stage or worker.
+
+        '''
+
+        filename = self._filename(name)
+        if not os.path.exists(filename):
+            return []
+        result = []
+        with open(filename) as f:
+            for line in f:
+                try:
+                    sample = json.loads(line)
+                except ValueError:
+                    # A partial line from an interrupted write.
+                    logging.warning('Ignoring corrupt build history line in '
+                                    '%s: %r', filename, line)
+                    continue
+                if stage is not None and sample['stage'] != stage:
+                    continue
+                if worker is not None and sample['worker'] != worker:
+                    continue
+                result.append(sample)
+        return result
+
+    def stages(self, name):
+        '''Return the stage names recorded for `name`.'''
+
+        return sorted(set(s['stage'] for s in self.samples(name)))
+
+    def durations(self, name, stage='overall-build', worker=None):
+        '''Return the most recent durations for one stage of `name`.'''
+
+        samples = self.samples(name, stage=stage, worker=worker)
+        return [s['seconds'] for s in samples[-self.window:]]
+
+    def durations_by_stage(self, name, worker=None):
+        '''Return the most recent durations of every stage of `name`.
+
+        This reads the history of `name` once, rather than once for each
+        stage as durations() would.
+
+        '''
+
+        by_stage = {}
+        for sample in self.samples(name, worker=worker):
+            by_stage.setdefault(sample['stage'], []).append(sample['seconds'])
+        return dict((stage, seconds[-self.window:])
+                    for stage, seconds in by_stage.iteritems())
+
+    def percentile(self, name, pct, stage='overall-build', worker=None):
+        '''Return the pct'th percentile duration, or None if unknown.'''
+
+        return percentile(self.durations(name, stage, worker), pct)
+
+    def estimate(self, name, stage='overall-build', worker=None):
+        '''Return a (p50, p95) pair of duration estimates in seconds.
+
+        This is intended for schedulers which want to know how long a build
+        is likely to take. Both values are None if there is no history.
+
+        '''
+
+        durations = self.durations(name, stage, worker)
+        return percentile(durations, 50), percentile(durations, 95)
@@ -0,0 +1,116 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import morphlib
+
+
+class PercentileTests(unittest.TestCase):
+
+    def test_returns_none_for_no_values(self):
+        self.assertEqual(morphlib.buildhistory.percentile([], 50), None)
+
+    def test_returns_median_of_odd_number_of_values(self):
+        self.assertEqual(
+            morphlib.buildhistory.percentile([3, 1, 2], 50), 2)
+
+    def test_interpolates_between_ranks(self):
+        self.assertEqual(
+            morphlib.buildhistory.percentile([1, 2, 3, 4], 50), 2.5)
+
+    def test_returns_extremes(self):
+        values = [5, 1, 9, 3]
+        self.assertEqual(morphlib.buildhistory.percentile(values, 0), 1)
+        self.assertEqual(morphlib.buildhistory.percentile(values, 100), 9)
+
+
+class BuildHistoryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.dirname = os.path.join(self.tempdir, 'history')
+        self.history = morphlib.buildhistory.BuildHistory(self.dirname,
+                                                          window=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_has_no_names_initially(self):
+        self.assertEqual(self.history.names(), [])
+
+    def test_has_no_estimate_without_samples(self):
+        self.assertEqual(self.history.estimate('gcc'), (None, None))
+
+    def test_records_samples(self):
+        self.history.record('gcc', 'build', 10, worker='w1')
+        samples = self.history.samples('gcc')
+        self.assertEqual(len(samples), 1)
+        self.assertEqual(samples[0]['stage'], 'build')
+        self.assertEqual(samples[0]['seconds'], 10.0)
+        self.assertEqual(samples[0]['worker'], 'w1')
+        self.assertEqual(self.history.names(), ['gcc'])
+
+    def test_records_build_times_metadata(self):
+        build_times = {
+            'overall-build': {'start': 'x', 'stop': 'y', 'delta': '12.5000'},
+            'configure': {'start': 'x', 'stop': 'y', 'delta': '2.0000'},
+        }
+        self.history.record_build_times('gcc', build_times, cache_key='abc')
+        self.assertEqual(self.history.stages('gcc'),
+                         ['configure', 'overall-build'])
+        self.assertEqual(self.history.durations('gcc'), [12.5])
+
+    def test_filters_by_worker(self):
+        self.history.record('gcc', 'overall-build', 10, worker='w1')
+        self.history.record('gcc', 'overall-build', 20, worker='w2')
+        self.assertEqual(self.history.durations('gcc', worker='w2'), [20.0])
+
+    def test_estimates_use_recent_samples_only(self):
+        for seconds in (100, 1, 2, 3):
+            self.history.record('gcc', 'overall-build', seconds)
+        self.assertEqual(self.history.durations('gcc'), [1.0, 2.0, 3.0])
+        p50, p95 = self.history.estimate('gcc')
+        self.assertEqual(p50, 2.0)
+        self.assertAlmostEqual(p95, 2.9)
+
+    def test_handles_names_with_slashes(self):
+        self.history.record('a/b', 'build', 1)
+        self.assertEqual(self.history.names(), ['a/b'])
+        self.assertEqual(self.history.durations('a/b', 'build'), [1.0])
+
+    def test_ignores_corrupt_lines(self):
+        self.history.record('gcc', 'build', 1)
+        with open(os.path.join(self.dirname, 'gcc.jsonl'), 'a') as f:
+            f.write('{"truncat')
+        self.assertEqual(self.history.durations('gcc', 'build'), [1.0])
+
+    def test_keeps_only_most_recent_samples(self):
+        history = morphlib.buildhistory.BuildHistory(
+            self.dirname, window=10, max_samples=3)
+        for seconds in (1, 2, 3, 4, 5):
+            history.record('gcc', 'build', seconds)
+        self.assertEqual(history.durations('gcc', 'build'), [3.0, 4.0, 5.0])
+
+    def test_gives_durations_of_every_stage(self):
+        for seconds in (100, 1, 2, 3):
+            self.history.record_many('gcc', {'build': seconds,
+                                             'install': seconds * 10})
+        self.assertEqual(self.history.durations_by_stage('gcc'),
+                         {'build': [1.0, 2.0, 3.0],
+                          'install': [10.0, 20.0, 30.0]})
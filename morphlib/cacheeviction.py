@@ -0,0 +1,108 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import collections
+import logging
+import time
+
+
+CachedSource = collections.namedtuple(
+    'CachedSource', ('cachekey', 'size', 'last_used', 'rebuild_cost'))
+
+
+def cached_sources(lac):
+    '''Return a CachedSource for everything in an indexed artifact cache.
+
+    The rebuild cost of each source is the one the index recorded from its
+    'meta' file. Sources whose rebuild cost is unknown, for example because
+    they were fetched from a remote cache that had no build times for them,
+    get the mean cost of the sources that are known.
+
+    '''
+
+    sources = []
+    for cachekey, files in lac.index.contents():
+        size = sum(size for size, last_used in files.itervalues())
+        last_used = max(last_used for size, last_used in files.itervalues())
+        sources.append(CachedSource(cachekey, size, last_used,
+                                    lac.index.rebuild_cost(cachekey)))
+
+    known = [s.rebuild_cost for s in sources if s.rebuild_cost is not None]
+    default_cost = sum(known) / len(known) if known else 1.0
+    return [s if s.rebuild_cost is not None
+            else s._replace(rebuild_cost=default_cost)
+            for s in sources]
+
+
+class LRUPolicy(object):
+
+    '''Evict the sources that were used least recently first.'''
+
+    name = 'lru'
+
+    def score(self, source, now):
+        return source.last_used
+
+
+class CostAwarePolicy(object):
+
+    '''Evict the sources that are least worth their space first.
+
+    A source is worth how long it would take to build again, times the
+    chance that it will be needed again. That chance is taken to halve
+    every `half_life` seconds since the source was last used. Sources are
+    evicted in order of worth per byte, so a big source that is rarely
+    used goes before a small one, and something that took hours to build
+    is kept over something that took seconds.
+
+    '''
+
+    name = 'cost'
+
+    def __init__(self, half_life=60*60*24):
+        self.half_life = half_life
+
+    def score(self, source, now):
+        age = max(0, now - source.last_used)
+        worth = source.rebuild_cost * 0.5 ** (age / float(self.half_life))
+        return worth / max(source.size, 1)
+
+
+policies = dict((policy.name, policy) for policy in
+                (LRUPolicy, CostAwarePolicy))
+
+
+def plan_eviction(sources, bytes_needed, policy, now=None):
+    '''Choose which sources to remove to free `bytes_needed` bytes.
+
+    Sources are taken in order of the policy's score, lowest first, until
+    their sizes add up to `bytes_needed`. Returns the chosen sources and
+    the number of bytes they use. If there is not enough to remove, every
+    source is chosen.
+
+    '''
+
+    if now is None:
+        now = time.time()
+    chosen = []
+    freed = 0
+    for source in sorted(sources, key=lambda s: policy.score(s, now)):
+        if freed >= bytes_needed:
+            break
+        chosen.append(source)
+        freed += source.size
+    logging.debug('%s eviction chose %d sources, %d bytes, to free %d bytes',
+                  policy.name, len(chosen), freed, bytes_needed)
+    return chosen, freed
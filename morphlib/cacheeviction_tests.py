@@ -0,0 +1,121 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import fs.osfs
+
+import morphlib
+from morphlib.cacheeviction import CachedSource
+
+
+NOW = 1000000.0
+DAY = 60 * 60 * 24
+
+
+class PlanEvictionTests(unittest.TestCase):
+
+    def plan(self, sources, bytes_needed, policy):
+        chosen, freed = morphlib.cacheeviction.plan_eviction(
+            sources, bytes_needed, policy, now=NOW)
+        return [s.cachekey for s in chosen], freed
+
+    def test_chooses_nothing_when_nothing_is_needed(self):
+        sources = [CachedSource('a', 10, NOW, 1.0)]
+        self.assertEqual(
+            self.plan(sources, 0, morphlib.cacheeviction.LRUPolicy()),
+            ([], 0))
+
+    def test_lru_removes_oldest_until_enough_is_freed(self):
+        sources = [
+            CachedSource('new', 100, NOW, 1.0),
+            CachedSource('old', 100, NOW - 2 * DAY, 1.0),
+            CachedSource('middle', 100, NOW - DAY, 1.0),
+        ]
+        self.assertEqual(
+            self.plan(sources, 150, morphlib.cacheeviction.LRUPolicy()),
+            (['old', 'middle'], 200))
+
+    def test_chooses_everything_if_not_enough(self):
+        sources = [CachedSource('a', 10, NOW, 1.0),
+                   CachedSource('b', 10, NOW, 1.0)]
+        chosen, freed = self.plan(sources, 1000,
+                                  morphlib.cacheeviction.LRUPolicy())
+        self.assertEqual(sorted(chosen), ['a', 'b'])
+        self.assertEqual(freed, 20)
+
+    def test_cost_policy_prefers_big_cheap_sources(self):
+        sources = [
+            CachedSource('small', 1024, NOW - DAY, 60.0),
+            CachedSource('big', 1024**3, NOW - DAY, 60.0),
+        ]
+        self.assertEqual(
+            self.plan(sources, 1, morphlib.cacheeviction.CostAwarePolicy()),
+            (['big'], 1024**3))
+
+    def test_cost_policy_keeps_recent_expensive_source(self):
+        sources = [
+            CachedSource('toolchain', 2 * 1024**3, NOW, 3 * 60 * 60.0),
+            CachedSource('cold', 1024, NOW - 30 * DAY, 10.0),
+        ]
+        self.assertEqual(
+            self.plan(sources, 1, morphlib.cacheeviction.CostAwarePolicy()),
+            (['cold'], 1024))
+
+
+class CachedSourcesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cachedir = os.path.join(self.tempdir, 'artifacts')
+        os.mkdir(self.cachedir)
+        self.lac = morphlib.localartifactcache.LocalArtifactCache(
+            fs.osfs.OSFS(self.cachedir),
+            morphlib.artifactcacheindex.ArtifactCacheIndex(
+                os.path.join(self.tempdir, 'artifact-index'), self.cachedir))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def save(self, basename, contents):
+        with self.lac._save_file(os.path.join(self.cachedir, basename)) as f:
+            f.write(contents)
+
+    def save_build_time(self, cachekey, seconds):
+        meta = {'build-times': {'overall-build': {'delta': '%.4f' % seconds}}}
+        self.save('%s.meta' % cachekey, json.dumps(meta))
+
+    def test_finds_sizes_and_build_times(self):
+        self.save('abc.chunk.foo-runtime', 'x' * 100)
+        self.save_build_time('abc', 42)
+        sources = morphlib.cacheeviction.cached_sources(self.lac)
+        self.assertEqual(len(sources), 1)
+        self.assertEqual(sources[0].cachekey, 'abc')
+        self.assertEqual(
+            sources[0].size,
+            100 + os.path.getsize(os.path.join(self.cachedir, 'abc.meta')))
+        self.assertEqual(sources[0].rebuild_cost, 42.0)
+
+    def test_unknown_build_time_is_mean_of_known_ones(self):
+        self.save_build_time('abc', 10)
+        self.save_build_time('def', 30)
+        self.save('ghi.chunk.foo-runtime', 'x')
+        sources = dict((s.cachekey, s) for s in
+                       morphlib.cacheeviction.cached_sources(self.lac))
+        self.assertEqual(sources['ghi'].rebuild_cost, 20.0)
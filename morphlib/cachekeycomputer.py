@@ -100,6 +100,11 @@ class CacheKeyComputer(object):
             # from the source tree
             keys['devices'] = morphology.get('devices')
             keys['max-jobs'] = morphology.get('max-jobs')
+            # Only included when it isn't the default, so that cache keys
+            # of existing chunks stay the same.
+            extraction = morphology.get('source-extraction', 'checkout')
+            if extraction != 'checkout':
+                keys['source-extraction'] = extraction
             keys['system-integration'] = morphology.get('system-integration',
                                                         {})
             # products is omitted as they are part of the split-rules
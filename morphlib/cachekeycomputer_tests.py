@@ -158,6 +158,18 @@ class CacheKeyComputerTests(unittest.TestCase):
         self.assertTrue(self._valid_sha256(
                         self.ckc.compute_key(artifact.source)))
 
+    def test_source_extraction_changes_key_unless_default(self):
+        artifact = self._find_artifact('chunk')
+        oldsha = self.ckc.compute_key(artifact.source)
+
+        artifact.source.morphology['source-extraction'] = 'checkout'
+        ckc = morphlib.cachekeycomputer.CacheKeyComputer(self.build_env)
+        self.assertEqual(oldsha, ckc.compute_key(artifact.source))
+
+        artifact.source.morphology['source-extraction'] = 'export'
+        ckc = morphlib.cachekeycomputer.CacheKeyComputer(self.build_env)
+        self.assertNotEqual(oldsha, ckc.compute_key(artifact.source))
+
     def test_different_env_gives_different_key(self):
         artifact = self._find_artifact('system-rootfs')
         oldsha = self.ckc.compute_key(artifact.source)
@@ -14,6 +14,7 @@
 
 import asyncore
 import asynchat
+import fcntl
 import glob
 import logging
 import os
@@ -187,6 +188,25 @@ class _OutputDispatcher(asynchat.async_chat, asyncore.file_dispatcher):
         self._line_handler(''.join(self.incoming))
         self.incoming = []
 
+def _set_cloexec_except(keep_fd):
+    '''Mark every fd above 2 except keep_fd to be closed on exec.
+
+    The fds are not closed straight away, because subprocess reports a
+    failure to exec through one of them.
+
+    '''
+    for name in os.listdir('/proc/self/fd'):
+        fd = int(name)
+        if fd <= 2 or fd == keep_fd:
+            continue
+        try:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+        except IOError:
+            # The fd listdir() used, which is closed by now.
+            pass
+
+
 class ExtensionSubprocess(object):
 
     def __init__(self, report_stdout, report_stderr, report_logger):
@@ -212,9 +232,12 @@ class ExtensionSubprocess(object):
 
             # Because we don't have python 3.2's pass_fds, we have to
             # play games with preexec_fn to close the fds we don't
-            # need to inherit
-            def close_read_end():
+            # need to inherit. Other extensions may be being started from
+            # other threads, and if this one kept their pipes open they
+            # would not see end of file until it exited.
+            def close_other_fds():
                 os.close(log_read_fd)
+                _set_cloexec_except(log_write_fd)
 
             cmdline = [filename] + list(args)
 
@@ -225,7 +248,7 @@ class ExtensionSubprocess(object):
                 cmdline,
                 cwd=cwd, env=new_env,
                 stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                preexec_fn=close_read_end)
+                preexec_fn=close_other_fds)
             os.close(log_write_fd)
             log_write_fd = None
 
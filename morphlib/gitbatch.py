@@ -0,0 +1,182 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import logging
+import subprocess
+import threading
+
+import pylru
+
+
+class CatFileProcess(object):
+
+    '''A long-running `git cat-file --batch` or `--batch-check` process.
+
+    Looking up many objects in a repository with one git process per
+    lookup spends most of its time in fork() and exec(). A single batch
+    process can answer any number of lookups.
+
+    Objects can be named with anything `git rev-parse` accepts, for
+    example 'master^{tree}' or 'SHA1:path/to/file'.
+
+    '''
+
+    def __init__(self, dirname, contents):
+        self.dirname = dirname
+        self.contents = contents
+        self._lock = threading.Lock()
+        self._process = None
+        self._closed = False
+
+    def _start(self):
+        option = '--batch' if self.contents else '--batch-check'
+        logging.debug('Starting git cat-file %s in %s', option, self.dirname)
+        self._process = subprocess.Popen(
+            ['git', 'cat-file', option], cwd=self.dirname,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+
+    def _query(self, name):
+        if self._process is None:
+            self._start()
+        self._process.stdin.write(name + '\n')
+        self._process.stdin.flush()
+        header = self._process.stdout.readline()
+        if not header:
+            raise IOError('git cat-file exited in %s' % self.dirname)
+        if header.rstrip('\n').endswith((' missing', ' ambiguous')):
+            return None
+        sha1, kind, size = header.split()
+        size = int(size)
+        if not self.contents:
+            return sha1, kind, size
+        data = self._process.stdout.read(size)
+        self._process.stdout.read(1)  # the newline after the contents
+        return sha1, kind, data
+
+    def lookup(self, name):
+        '''Look up an object.
+
+        Returns a (sha1, type, size) tuple for a --batch-check process, or
+        a (sha1, type, contents) tuple for a --batch process. Returns None
+        if the object does not exist.
+
+        '''
+
+        if '\n' in name:
+            raise ValueError('Object name %r contains a newline' % name)
+        with self._lock:
+            try:
+                try:
+                    return self._query(name)
+                except (IOError, OSError) as e:
+                    # Perhaps the process was killed; try a new one.
+                    logging.debug('Restarting git cat-file in %s: %s',
+                                  self.dirname, e)
+                    self._close()
+                    return self._query(name)
+            finally:
+                if self._closed:
+                    # We were removed from the pool while the caller was
+                    # waiting for us, so nobody else will stop the process.
+                    self._close()
+
+    def _close(self):
+        if self._process is not None:
+            try:
+                self._process.stdin.close()
+            except IOError:  # pragma: no cover
+                pass
+            self._process.wait()
+            self._process = None
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._close()
+
+
+class CatFilePool(object):
+
+    '''A bounded set of CatFileProcess objects, one per repository.
+
+    When more than `size` processes would be running, the least recently
+    used one is stopped.
+
+    '''
+
+    def __init__(self, size=16):
+        self._lock = threading.Lock()
+        self._processes = pylru.lrucache(
+            size, callback=lambda key, process: process.close())
+
+    def _get(self, dirname, contents):
+        key = (dirname, contents)
+        with self._lock:
+            if key not in self._processes:
+                self._processes[key] = CatFileProcess(dirname, contents)
+            return self._processes[key]
+
+    def info(self, dirname, name):
+        '''Return (sha1, type, size) for an object, or None if missing.'''
+        return self._get(dirname, False).lookup(name)
+
+    def read(self, dirname, name):
+        '''Return (sha1, type, contents) for an object, or None if missing.'''
+        return self._get(dirname, True).lookup(name)
+
+    def forget(self, dirname):
+        '''Stop any processes for a repository, for example if it moved.'''
+        with self._lock:
+            for contents in (False, True):
+                key = (dirname, contents)
+                if key in self._processes:
+                    self._processes[key].close()
+                    del self._processes[key]
+
+    def close(self):
+        with self._lock:
+            for process in list(self._processes.values()):
+                process.close()
+            self._processes.clear()
+
+
+def parse_tree(data):
+    '''Parse the contents of a raw git tree object.
+
+    Returns a list of (mode, type, sha1, name) tuples, in the same form as
+    the output of `git ls-tree`.
+
+    '''
+
+    entries = []
+    i = 0
+    while i < len(data):
+        space = data.index(' ', i)
+        nul = data.index('\0', space)
+        mode = data[i:space].rjust(6, '0')
+        name = data[space + 1:nul]
+        sha1 = data[nul + 1:nul + 21].encode('hex')
+        if mode == '040000':
+            kind = 'tree'
+        elif mode == '160000':
+            kind = 'commit'
+        else:
+            kind = 'blob'
+        entries.append((mode, kind, sha1, name))
+        i = nul + 21
+    return entries
+
+
+pool = CatFilePool()
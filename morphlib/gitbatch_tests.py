@@ -0,0 +1,88 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cliapp
+
+import morphlib
+
+
+class CatFilePoolTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.dirname = os.path.join(self.tempdir, 'repo')
+        os.mkdir(self.dirname)
+        os.mkdir(os.path.join(self.dirname, 'dir'))
+        with open(os.path.join(self.dirname, 'foo'), 'w') as f:
+            f.write('hello\n')
+        with open(os.path.join(self.dirname, 'dir', 'bar'), 'w') as f:
+            f.write('world\n')
+        self.git('init')
+        self.git('add', '.')
+        self.git('commit', '-m', 'Initial commit')
+        self.commit = self.git('rev-parse', 'HEAD').strip()
+        self.pool = morphlib.gitbatch.CatFilePool(size=1)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.tempdir)
+
+    def git(self, *args):
+        return cliapp.runcmd(['git'] + list(args), cwd=self.dirname)
+
+    def test_resolves_ref(self):
+        sha1, kind, size = self.pool.info(self.dirname, 'master^{commit}')
+        self.assertEqual(sha1, self.commit)
+        self.assertEqual(kind, 'commit')
+
+    def test_reads_file(self):
+        sha1, kind, data = self.pool.read(self.dirname, 'master:dir/bar')
+        self.assertEqual(kind, 'blob')
+        self.assertEqual(data, 'world\n')
+
+    def test_returns_none_for_missing_objects(self):
+        self.assertEqual(self.pool.info(self.dirname, 'master:nope'), None)
+        self.assertEqual(self.pool.read(self.dirname, 'no such ref'), None)
+
+    def test_sees_new_commits(self):
+        self.pool.info(self.dirname, 'master')
+        self.git('commit', '--allow-empty', '-m', 'Second commit')
+        new_commit = self.git('rev-parse', 'HEAD').strip()
+        self.assertEqual(self.pool.info(self.dirname, 'master')[0],
+                         new_commit)
+
+    def test_restarts_evicted_processes(self):
+        self.pool.info(self.dirname, 'master')
+        self.pool.read(self.dirname, 'master:foo')
+        self.assertEqual(self.pool.info(self.dirname, 'master')[0],
+                         self.commit)
+
+    def test_rejects_names_with_newlines(self):
+        self.assertRaises(ValueError, self.pool.info, self.dirname,
+                          'master\nHEAD')
+
+    def test_parses_tree(self):
+        sha1, kind, data = self.pool.read(self.dirname, 'master^{tree}')
+        entries = morphlib.gitbatch.parse_tree(data)
+        self.assertEqual([(e[0], e[1], e[3]) for e in entries],
+                         [('040000', 'tree', 'dir'),
+                          ('100644', 'blob', 'foo')])
+        self.assertEqual(entries[1][2],
+                         self.git('rev-parse', 'master:foo').strip())
@@ -17,6 +17,7 @@
 
 import cliapp
 import itertools
+import logging
 import os
 import re
 import tempfile
@@ -529,9 +530,13 @@ class GitDirectory(object):
         blob_id = '%s:%s' % (ref, filename)
         return self.get_blob_contents(blob_id)
 
-    def get_blob_contents(self, blob_id): # pragma: no cover
+    def get_blob_contents(self, blob_id):
         '''Get file contents from git by ID'''
-        return morphlib.git.gitcmd(self._runcmd, 'cat-file', 'blob', blob_id)
+        result = morphlib.gitbatch.pool.read(self.dirname, blob_id)
+        if result is None or result[1] != 'blob':
+            raise cliapp.AppException(
+                'Blob %s does not exist in %s' % (blob_id, self))
+        return result[2]
 
     def get_commit_contents(self, commit_id): # pragma: no cover
         '''Get commit contents from git by ID'''
@@ -621,15 +626,26 @@ class GitDirectory(object):
                 return None
             raise
 
+    def _resolve_object(self, name):
+        # This is the same as _rev_parse(), but it uses a long-running
+        # `git cat-file --batch-check` rather than starting a new process.
+        try:
+            result = morphlib.gitbatch.pool.info(self.dirname, name)
+        except ValueError:
+            result = None
+        if result is None:
+            raise InvalidRefError(self, name)
+        return result[0]
+
     def resolve_ref_to_commit(self, ref):
-        return self._rev_parse('%s^{commit}' % ref)
+        return self._resolve_object('%s^{commit}' % ref)
 
     def resolve_ref_to_tree(self, ref):
-        return self._rev_parse('%s^{tree}' % ref)
+        return self._resolve_object('%s^{tree}' % ref)
 
     def ref_exists(self, ref):
         try:
-            self._rev_parse('%s^{commit}' % ref)
+            self.resolve_ref_to_commit(ref)
             return True
         except InvalidRefError:
             return False
@@ -766,6 +782,52 @@ class GitDirectory(object):
         args = ['branch', '--contains', ref]
         return self._gitcmd_output_list(*args)
 
+    def refs_containing_sha1(self, ref):
+        '''Return the names of the branches and tags containing a commit.
+
+        This asks about both at once, so is quicker than using
+        branches_containing_sha1() and tags_containing_sha1(). Versions
+        of git older than 2.7 have no `for-each-ref --contains`, so with
+        them those two are asked instead.
+
+        '''
+        self._check_is_sha1(ref)
+        self._check_ref_exists(ref)
+
+        exit, out, err = morphlib.git.gitcmd(
+            self._runcmd_unchecked, 'for-each-ref', '--contains', ref,
+            '--format=%(refname)', 'refs/heads', 'refs/tags')
+        if exit == 0:
+            return out.split()
+
+        logging.debug('git for-each-ref --contains failed, so asking git '
+                      'branch and git tag instead: %s', err.strip())
+        refs = ['refs/heads/%s' % branch
+                for branch in self._gitcmd_output_list(
+                    'branch', '--no-color', '--contains', ref)
+                # Skip the '(HEAD detached at ...)' line.
+                if not branch.startswith('(')]
+        refs.extend('refs/tags/%s' % tag
+                    for tag in self._gitcmd_output_list(
+                        'tag', '--contains', ref))
+        return sorted(refs)
+
+    def ref_tips(self):
+        '''Return a dict of the commit each branch and tag points to.
+
+        Annotated tags are given as the commit they tag.
+
+        '''
+        output = morphlib.git.gitcmd(
+            self._runcmd, 'for-each-ref',
+            '--format=%(refname) %(objectname) %(*objectname)',
+            'refs/heads', 'refs/tags')
+        tips = {}
+        for line in output.splitlines():
+            fields = line.split()
+            tips[fields[0]] = fields[-1]
+        return tips
+
     def version_guess(self, ref): # pragma: no cover
         self._check_ref_exists(ref)
 
@@ -143,6 +143,45 @@ class GitDirectoryAnchoredRefTests(unittest.TestCase):
                             'New commit message')
         self.assertEqual(len(gd.branches_containing_sha1(ref)), 0)
 
+    def test_lists_branches_and_tags_containing_ref(self):
+        gd = morphlib.gitdir.GitDirectory(self.dirname)
+        output = morphlib.git.gitcmd(gd._runcmd, 'rev-parse', 'HEAD')
+        ref = output.strip()
+        morphlib.git.gitcmd(gd._runcmd, 'tag', '-a', '-m', 'Release',
+                            'v1', ref)
+
+        self.assertEqual(gd.refs_containing_sha1(ref),
+                         ['refs/heads/master', 'refs/tags/v1'])
+
+    def test_lists_refs_containing_ref_without_for_each_ref_contains(self):
+        gd = morphlib.gitdir.GitDirectory(self.dirname)
+        output = morphlib.git.gitcmd(gd._runcmd, 'rev-parse', 'HEAD')
+        ref = output.strip()
+        morphlib.git.gitcmd(gd._runcmd, 'tag', '-a', '-m', 'Release',
+                            'v1', ref)
+        morphlib.git.gitcmd(gd._runcmd, 'checkout', '-q', ref)
+
+        # Versions of git before 2.7 reject `for-each-ref --contains`.
+        runcmd_unchecked = gd._runcmd_unchecked
+        def old_git_runcmd_unchecked(argv, **kwargs):
+            if argv[1:3] == ['for-each-ref', '--contains']:
+                return 129, '', 'error: unknown option `contains\'\n'
+            return runcmd_unchecked(argv, **kwargs)
+        gd._runcmd_unchecked = old_git_runcmd_unchecked
+
+        self.assertEqual(gd.refs_containing_sha1(ref),
+                         ['refs/heads/master', 'refs/tags/v1'])
+
+    def test_ref_tips_gives_commits_of_annotated_tags(self):
+        gd = morphlib.gitdir.GitDirectory(self.dirname)
+        output = morphlib.git.gitcmd(gd._runcmd, 'rev-parse', 'HEAD')
+        ref = output.strip()
+        morphlib.git.gitcmd(gd._runcmd, 'tag', '-a', '-m', 'Release',
+                            'v1', ref)
+
+        self.assertEqual(gd.ref_tips(),
+                         {'refs/heads/master': ref, 'refs/tags/v1': ref})
+
 class GitDirectoryContentsTests(unittest.TestCase):
 
     def setUp(self):
@@ -0,0 +1,295 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import hashlib
+import json
+import logging
+import multiprocessing.pool
+import os
+import re
+
+import cliapp
+
+import morphlib
+
+
+LICENSECHECK = os.path.join(os.path.dirname(__file__), 'licensecheck.pl')
+
+# How many lines at the start of each file licensecheck looks at.
+LICENSECHECK_LINES = 500
+
+# licensecheck is told to check every file it is given, and to ignore
+# none of them. Its default ignore list depends on the names of files, and
+# results are cached by contents alone; find_files_to_scan leaves out the
+# files it would ignore instead.
+LICENSECHECK_OPTIONS = ['-l', str(LICENSECHECK_LINES), '--check', '.',
+                        '--ignore', '(?!)']
+
+# Files with these extensions are images, archives, compiled code and the
+# like, which never carry a licence that licensecheck can recognise.
+SKIPPED_EXTENSIONS = frozenset([
+    '.a', '.bmp', '.bz2', '.class', '.dll', '.eot', '.exe', '.gif', '.gz',
+    '.ico', '.jar', '.jpeg', '.jpg', '.lz', '.mo', '.o', '.obj', '.ogg',
+    '.otf', '.pdf', '.png', '.pyc', '.pyo', '.so', '.svgz', '.tar', '.tgz',
+    '.tif', '.tiff', '.ttf', '.wav', '.woff', '.xz', '.zip',
+])
+
+# Names of files and directories that licensecheck ignores by default:
+# backup and editor files, and version control data.
+SKIPPED_NAMES = re.compile(r'''(?x)
+    .*~$ | \.\#.* | \..*\.swp$ | ,,.* |
+    (?:DEADJOE|\.cvsignore|\.arch-inventory|\.bzrignore|\.gitignore)$ |
+    (?:CVS|RCS|\.pc|\.deps|\{arch\}|\.arch-ids|\.svn|\.hg|_darcs|\.git|
+       \.shelf|_MTN|\.bzr(?:\.backup|tags)?)$
+''')
+
+
+def blob_sha1(filename):
+    '''Return the SHA1 git would give the contents of a file.'''
+
+    sha1 = hashlib.sha1()
+    sha1.update('blob %d\0' % os.path.getsize(filename))
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(64 * 1024), ''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def worth_scanning(filename):
+    '''Might licensecheck find a licence in this file?
+
+    Empty files, files that look binary, and files whose extension says
+    they are not text are not worth scanning, nor are dangling symlinks.
+
+    '''
+
+    if os.path.splitext(filename)[1].lower() in SKIPPED_EXTENSIONS:
+        return False
+    try:
+        if os.path.getsize(filename) == 0:
+            return False
+        with open(filename, 'rb') as f:
+            head = f.read(8192)
+    except (IOError, OSError):
+        return False
+    return '\0' not in head
+
+
+def find_files_to_scan(dirname):
+    '''Return the files in a source tree worth looking for licences in.'''
+
+    filenames = []
+    for dirpath, subdirs, basenames in os.walk(dirname):
+        subdirs[:] = sorted(d for d in subdirs if not SKIPPED_NAMES.match(d))
+        for basename in sorted(basenames):
+            # licensecheck reports one file per line.
+            if '\n' in basename or SKIPPED_NAMES.match(basename):
+                continue
+            filename = os.path.join(dirpath, basename)
+            if worth_scanning(filename):
+                filenames.append(filename)
+    return filenames
+
+
+def parse_licensecheck_output(filenames, output):
+    '''Return a dict of the licence licensecheck reported for each file.
+
+    licensecheck reports on files in the order it was given them, but says
+    nothing about files it ignores, which are reported as 'UNKNOWN'.
+
+    '''
+
+    licenses = dict((filename, 'UNKNOWN') for filename in filenames)
+    remaining = iter(filenames)
+    for line in output.splitlines():
+        for filename in remaining:
+            prefix = filename + ': '
+            if line.startswith(prefix):
+                licenses[filename] = line[len(prefix):].strip()
+                break
+        else:
+            raise cliapp.AppException(
+                'Unexpected output from licensecheck: %s' % line)
+    return licenses
+
+
+def run_licensecheck(filenames, runcmd=cliapp.runcmd):
+    '''Run licensecheck once over all the given files.
+
+    Returns a dict of the licence of each file. licensecheck only looks at
+    files it thinks are source code when given more than one, and skips
+    backup files and the like, so it is told to check everything. What it
+    finds then depends only on the contents of each file.
+
+    '''
+
+    output = runcmd(['perl', LICENSECHECK] + LICENSECHECK_OPTIONS +
+                    ['--'] + filenames)
+    return parse_licensecheck_output(filenames, output)
+
+
+class LicenseCache(object):
+
+    '''Licences found in files before, by the SHA1 of the file contents.
+
+    Releases of a project change few of its files, so most licences can
+    be looked up instead of found by licensecheck again. The SHA1s are
+    the ones git gives blobs.
+
+    Results are kept for each version of licensecheck and the options it
+    is run with, since either can change what it finds. They are
+    kept in JSON files named by the first two digits of the SHA1s in
+    them. Several processes may update the cache: each merges its own
+    results with what is already there, so at worst results are lost and
+    have to be found again.
+
+    '''
+
+    def __init__(self, dirname):
+        with open(LICENSECHECK, 'rb') as f:
+            scanner_id = hashlib.sha1(f.read())
+        scanner_id.update(' '.join(LICENSECHECK_OPTIONS))
+        self.dirname = os.path.join(dirname, scanner_id.hexdigest())
+        self._shards = {}
+        self._dirty = set()
+
+    def _shard_filename(self, prefix):
+        return os.path.join(self.dirname, '%s.json' % prefix)
+
+    def _read_shard(self, prefix):
+        try:
+            with open(self._shard_filename(prefix)) as f:
+                return json.load(f)
+        except IOError:
+            return {}
+        except ValueError:  # pragma: no cover
+            logging.warning('Ignoring corrupt licence cache file %s',
+                            self._shard_filename(prefix))
+            return {}
+
+    def _shard(self, sha1):
+        prefix = sha1[:2]
+        if prefix not in self._shards:
+            self._shards[prefix] = self._read_shard(prefix)
+        return self._shards[prefix]
+
+    def get(self, sha1):
+        '''Return the licence found in a blob, or None if not known.'''
+
+        return self._shard(sha1).get(sha1)
+
+    def add(self, sha1, license):
+        self._shard(sha1)[sha1] = license
+        self._dirty.add(sha1[:2])
+
+    def save(self):
+        '''Write out the licences added since the last save.'''
+
+        if not os.path.isdir(self.dirname):
+            os.makedirs(self.dirname)
+        for prefix in sorted(self._dirty):
+            shard = self._read_shard(prefix)
+            shard.update(self._shards[prefix])
+            self._shards[prefix] = shard
+            with morphlib.savefile.SaveFile(
+                    self._shard_filename(prefix), 'w') as f:
+                json.dump(shard, f)
+        self._dirty.clear()
+
+
+class LicenseScanner(object):
+
+    '''Find the licences of many files quickly.
+
+    Files are given to licensecheck `batch_size` at a time, since starting
+    it costs far more than scanning a file, and `jobs` licensecheck
+    processes run at once. Files whose contents are in `cache`, or are the
+    same as another file's, are not scanned again.
+
+    '''
+
+    def __init__(self, cache=None, jobs=1, batch_size=200,
+                 runcmd=cliapp.runcmd):
+        self.cache = cache
+        self.jobs = jobs
+        self.batch_size = batch_size
+        self.runcmd = runcmd
+
+    def _scan_batch(self, filenames):
+        try:
+            return run_licensecheck(filenames, runcmd=self.runcmd)
+        except cliapp.AppException as e:
+            if len(filenames) == 1:
+                logging.warning('Could not check licence of %s: %s',
+                                filenames[0], e)
+                return {}
+        # One unreadable file stops licensecheck, so find out which.
+        licenses = {}
+        for filename in filenames:
+            licenses.update(self._scan_batch([filename]))
+        return licenses
+
+    def _sha1(self, filename):
+        try:
+            return blob_sha1(filename)
+        except (IOError, OSError) as e:  # pragma: no cover
+            logging.warning('Could not read %s: %s', filename, e)
+            return None
+
+    def _map(self, function, items):
+        if self.jobs < 2 or len(items) < 2:
+            return map(function, items)
+        pool = multiprocessing.pool.ThreadPool(min(self.jobs, len(items)))
+        try:
+            return pool.map(function, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def scan(self, filenames):
+        '''Return a dict of the licence of each of the given files.
+
+        Files whose licence could not be checked, for example because
+        they could not be read, are left out.
+
+        '''
+
+        sha1s = dict(zip(filenames, self._map(self._sha1, filenames)))
+
+        by_sha1 = {None: None}
+        to_scan = []
+        for filename in filenames:
+            sha1 = sha1s[filename]
+            if sha1 in by_sha1:
+                continue
+            by_sha1[sha1] = self.cache.get(sha1) if self.cache else None
+            if by_sha1[sha1] is None:
+                to_scan.append(filename)
+        logging.debug('Checking licences of %d of %d files',
+                      len(to_scan), len(filenames))
+
+        batches = [to_scan[i:i + self.batch_size]
+                   for i in xrange(0, len(to_scan), self.batch_size)]
+        for licenses in self._map(self._scan_batch, batches):
+            for filename, license in licenses.iteritems():
+                by_sha1[sha1s[filename]] = license
+                if self.cache:
+                    self.cache.add(sha1s[filename], license)
+        if self.cache:
+            self.cache.save()
+
+        return dict((filename, by_sha1[sha1s[filename]])
+                    for filename in filenames
+                    if by_sha1[sha1s[filename]] is not None)
@@ -0,0 +1,153 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import cliapp
+
+import morphlib
+
+
+class FakeLicensecheck(object):
+
+    '''Reports the first line of each file as its licence.'''
+
+    def __init__(self):
+        self.runs = []
+        self.argvs = []
+
+    def __call__(self, argv):
+        filenames = argv[argv.index('--') + 1:]
+        self.runs.append(filenames)
+        self.argvs.append(argv)
+        output = []
+        for filename in filenames:
+            with open(filename) as f:
+                output.append('%s: %s\n' % (filename, f.readline().strip()))
+        return ''.join(output)
+
+
+class LicenseScanTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.srcdir = os.path.join(self.tempdir, 'src')
+        os.mkdir(self.srcdir)
+        self.licensecheck = FakeLicensecheck()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def create_file(self, basename, contents):
+        filename = os.path.join(self.srcdir, basename)
+        dirname = os.path.dirname(filename)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(filename, 'w') as f:
+            f.write(contents)
+        return filename
+
+    def new_scanner(self, **kwargs):
+        cache = morphlib.licensescan.LicenseCache(
+            os.path.join(self.tempdir, 'cache'))
+        return morphlib.licensescan.LicenseScanner(
+            cache, runcmd=self.licensecheck, **kwargs)
+
+    def test_blob_sha1_matches_git(self):
+        filename = self.create_file('foo.c', 'hello\n')
+        self.assertEqual(morphlib.licensescan.blob_sha1(filename),
+                         'ce013625030ba8dba906f756967f9e9ca394464a')
+
+    def test_finds_only_files_worth_scanning(self):
+        self.create_file('foo.c', 'GPL\n')
+        self.create_file('empty.c', '')
+        self.create_file('logo.png', 'PNG\n')
+        self.create_file('data.bin', 'ELF\0\0\0')
+        self.create_file('.git/config', '[core]\n')
+        self.create_file('CVS/Entries', 'GPL\n')
+        self.create_file('foo.c~', 'GPL\n')
+        self.create_file('.foo.c.swp', 'GPL\n')
+        self.create_file('.#foo.c', 'GPL\n')
+        os.symlink('missing', os.path.join(self.srcdir, 'dangling'))
+        self.assertEqual(
+            morphlib.licensescan.find_files_to_scan(self.srcdir),
+            [os.path.join(self.srcdir, 'foo.c')])
+
+    def test_licensecheck_ignores_no_files(self):
+        filename = self.create_file('foo.c~', 'GPL\n')
+        self.assertEqual(self.new_scanner().scan([filename]),
+                         {filename: 'GPL'})
+        argv = self.licensecheck.argvs[0]
+        ignore = argv[argv.index('--ignore') + 1]
+        for name in (filename, 'foo.c', '.#foo.c', 'CVS/Entries', ''):
+            self.assertEqual(re.search(ignore, name), None)
+
+    def test_parses_output_for_files_given(self):
+        output = 'a.c: *No copyright* GPL (v2)\nc.c: BSD\n'
+        self.assertEqual(
+            morphlib.licensescan.parse_licensecheck_output(
+                ['a.c', 'b.c', 'c.c'], output),
+            {'a.c': '*No copyright* GPL (v2)', 'b.c': 'UNKNOWN',
+             'c.c': 'BSD'})
+
+    def test_rejects_unexpected_output(self):
+        self.assertRaises(
+            cliapp.AppException,
+            morphlib.licensescan.parse_licensecheck_output,
+            ['a.c'], 'b.c: GPL\n')
+
+    def test_scans_files_in_batches(self):
+        filenames = [self.create_file('%d.c' % i, 'License %d\n' % i)
+                     for i in range(5)]
+        licenses = self.new_scanner(batch_size=2, jobs=2).scan(filenames)
+        self.assertEqual(
+            licenses,
+            dict((f, 'License %d' % i) for i, f in enumerate(filenames)))
+        self.assertEqual(sorted(len(run) for run in self.licensecheck.runs),
+                         [1, 2, 2])
+
+    def test_scans_identical_files_once(self):
+        filenames = [self.create_file('a.c', 'GPL\n'),
+                     self.create_file('b.c', 'GPL\n')]
+        licenses = self.new_scanner().scan(filenames)
+        self.assertEqual(licenses, dict((f, 'GPL') for f in filenames))
+        self.assertEqual(len(self.licensecheck.runs[0]), 1)
+
+    def test_remembers_licenses_between_scanners(self):
+        a = self.create_file('a.c', 'GPL\n')
+        self.new_scanner().scan([a])
+        b = self.create_file('b.c', 'GPL\n')
+        c = self.create_file('c.c', 'BSD\n')
+        self.licensecheck.runs = []
+        licenses = self.new_scanner().scan([b, c])
+        self.assertEqual(licenses, {b: 'GPL', c: 'BSD'})
+        self.assertEqual(self.licensecheck.runs, [[c]])
+
+    def test_leaves_out_files_that_cannot_be_checked(self):
+        good = self.create_file('good.c', 'GPL\n')
+        bad = self.create_file('bad.c', 'MIT\n')
+
+        def licensecheck(argv):
+            if bad in argv:
+                raise cliapp.AppException('Unable to access %s' % bad)
+            return self.licensecheck(argv)
+
+        scanner = self.new_scanner()
+        scanner.runcmd = licensecheck
+        self.assertEqual(scanner.scan([good, bad]), {good: 'GPL'})
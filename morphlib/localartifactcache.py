@@ -14,10 +14,13 @@
 
 
 import collections
+import contextlib
+import logging
 import os
 import time
 
 import morphlib
+import morphlib.savefile
 
 
 class LocalArtifactCache(object):
@@ -42,26 +45,45 @@ class LocalArtifactCache(object):
 
        Since the cleanup logic will be complicated for other reasons it makes
        sense to put the complication there.
+
+       If an ArtifactCacheIndex is given, files are recorded in it as they
+       are saved, used and removed, and `list_contents` and `remove` use it
+       instead of walking the whole cache.
+
+       If ArtifactPins are given, running builds and deployments can pin
+       the sources they need, and `remove_unpinned` leaves those alone.
        '''
 
-    def __init__(self, cachefs):
+    def __init__(self, cachefs, index=None, pins=None):
         self.cachefs = cachefs
+        self.index = index
+        self.pins = pins
+
+    def _save_file(self, filename):
+        if self.index is None:
+            return morphlib.savefile.SaveFile(filename, mode='w')
+        return IndexedSaveFile(filename, self.index, mode='w')
 
     def put(self, artifact):
         filename = self.artifact_filename(artifact)
-        return morphlib.savefile.SaveFile(filename, mode='w')
+        return self._save_file(filename)
 
     def put_artifact_metadata(self, artifact, name):
         filename = self._artifact_metadata_filename(artifact, name)
-        return morphlib.savefile.SaveFile(filename, mode='w')
+        return self._save_file(filename)
 
     def put_source_metadata(self, source, cachekey, name):
         filename = self._source_metadata_filename(source, cachekey, name)
-        return morphlib.savefile.SaveFile(filename, mode='w')
+        return self._save_file(filename)
+
+    def _touch(self, filename):
+        os.utime(filename, None)
+        if self.index is not None:
+            self.index.use(os.path.basename(filename))
 
     def _has_file(self, filename):
         if os.path.exists(filename):
-            os.utime(filename, None)
+            self._touch(filename)
             return True
         return False
 
@@ -79,12 +101,12 @@ class LocalArtifactCache(object):
 
     def get(self, artifact):
         filename = self.artifact_filename(artifact)
-        os.utime(filename, None)
+        self._touch(filename)
         return open(filename)
 
     def get_artifact_metadata(self, artifact, name):
         filename = self._artifact_metadata_filename(artifact, name)
-        os.utime(filename, None)
+        self._touch(filename)
         return open(filename)
 
     def get_source_metadata_filename(self, source, cachekey, name):
@@ -92,7 +114,7 @@ class LocalArtifactCache(object):
 
     def get_source_metadata(self, source, cachekey, name):
         filename = self._source_metadata_filename(source, cachekey, name)
-        os.utime(filename, None)
+        self._touch(filename)
         return open(filename)
 
     def _join(self, basename):
@@ -122,6 +144,8 @@ class LocalArtifactCache(object):
          '''
         for filename in self.cachefs.walkfiles():
             self.cachefs.remove(filename)
+        if self.index is not None:
+            self.index.clear()
 
     def list_contents(self):
         '''Return the set of sources cached and related information.
@@ -129,6 +153,9 @@ class LocalArtifactCache(object):
            returns a [(cache_key, set(artifacts), last_used)]
 
         '''
+        if self.index is not None:
+            return self._list_contents_from_index()
+
         def is_artifact(filename):
             # This is just enough to avoid crashes from random unpacked
             # directory trees and temporary files in the cachedir. A
@@ -154,8 +181,81 @@ class LocalArtifactCache(object):
         return ((cache_key, info.artifacts, info.mtime)
                 for cache_key, info in contents.iteritems())
 
+    def _list_contents_from_index(self):
+        for cachekey, files in self.index.contents():
+            artifacts = set(basename[len(cachekey) + 1:]
+                            for basename in files)
+            last_used = max(last_used for size, last_used
+                            in files.itervalues())
+            yield cachekey, artifacts, last_used
+
     def remove(self, cachekey):
         '''Remove all artifacts associated with the given cachekey.'''
+        if self.index is not None:
+            basenames = self.index.files(cachekey)
+            if basenames:
+                for basename in basenames:
+                    if self.cachefs.exists(basename):
+                        self.cachefs.remove(basename)
+                self.index.remove(basenames)
+                return
         for filename in (x for x in self.cachefs.walkfiles()
                          if x[1:].startswith(cachekey)):
             self.cachefs.remove(filename)
+
+    def pin(self, cachekeys):
+        '''Keep the artifacts of these cache keys while in this context.
+
+        Pinning cache keys which are not in the cache yet is fine, and
+        stops them being removed once they are added.
+
+        '''
+        if self.pins is None:
+            return _no_pin()
+        return self.pins.pin(cachekeys)
+
+    def pinned(self):
+        '''Return the set of cache keys that are pinned.'''
+        if self.pins is None:
+            return set()
+        return self.pins.pinned()
+
+    def remove_unpinned(self, cachekeys):
+        '''Remove the artifacts of every cache key which is not pinned.
+
+        Returns the list of cache keys that were removed.
+
+        '''
+        cachekeys = list(cachekeys)
+        if self.pins is None:
+            for cachekey in cachekeys:
+                self.remove(cachekey)
+            return cachekeys
+        removed = []
+        with self.pins.removing() as pinned:
+            for cachekey in cachekeys:
+                if cachekey in pinned:
+                    logging.debug('Not removing pinned source %s', cachekey)
+                    continue
+                self.remove(cachekey)
+                removed.append(cachekey)
+        return removed
+
+
+@contextlib.contextmanager
+def _no_pin():
+    yield
+
+
+class IndexedSaveFile(morphlib.savefile.SaveFile):
+
+    '''A SaveFile that adds itself to an ArtifactCacheIndex when saved.'''
+
+    def __init__(self, filename, index, *args, **kwargs):
+        morphlib.savefile.SaveFile.__init__(self, filename, *args, **kwargs)
+        self.index = index
+
+    def close(self):
+        ret = morphlib.savefile.SaveFile.close(self)
+        self.index.add(os.path.basename(self.real_filename), saved=True)
+        return ret
@@ -189,3 +189,77 @@ class LocalArtifactCacheTests(unittest.TestCase):
         cache.remove(key)
 
         self.assertEqual(len(list(cache.list_contents())), 0)
+
+    def new_indexed_cache(self):
+        self.indexfs = fs.tempfs.TempFS()
+        index = morphlib.artifactcacheindex.ArtifactCacheIndex(
+            self.indexfs.getsyspath('/'), self.tempfs.getsyspath('/'))
+        return morphlib.localartifactcache.LocalArtifactCache(
+            self.tempfs, index=index)
+
+    def test_indexed_cache_lists_artifacts(self):
+        cache = self.new_indexed_cache()
+
+        handle = cache.put(self.runtime_artifact)
+        handle.write('runtime')
+        handle.close()
+        handle = cache.put(self.devel_artifact)
+        handle.write('devel')
+        handle.close()
+
+        contents = list(cache.list_contents())
+        self.assertEqual(len(contents), 1)
+        cachekey, artifacts, last_used = contents[0]
+        self.assertEqual(cachekey, self.source.cache_key)
+        self.assertEqual(artifacts,
+                         set(['chunk.chunk-runtime', 'chunk.chunk-devel']))
+
+    def test_indexed_cache_removes_artifacts(self):
+        cache = self.new_indexed_cache()
+
+        handle = cache.put(self.runtime_artifact)
+        handle.write('runtime')
+        handle.close()
+        handle = cache.put_source_metadata(
+            self.source, self.source.cache_key, 'build-log')
+        handle.write('log')
+        handle.close()
+
+        cache.remove(self.source.cache_key)
+
+        self.assertEqual(list(cache.list_contents()), [])
+        self.assertEqual(list(self.tempfs.listdir()), [])
+
+    def test_indexed_cache_records_use_without_writing(self):
+        cache = self.new_indexed_cache()
+
+        handle = cache.put(self.runtime_artifact)
+        handle.write('runtime')
+        handle.close()
+        journal = self.indexfs.getsyspath('journal')
+        size = os.path.getsize(journal)
+
+        for i in xrange(10):
+            self.assertTrue(cache.has(self.runtime_artifact))
+            cache.get(self.runtime_artifact).close()
+        self.assertEqual(os.path.getsize(journal), size)
+        cache.index.flush()
+        self.assertTrue(os.path.getsize(journal) > size)
+
+    def test_remove_unpinned_keeps_pinned_artifacts(self):
+        self.pinsfs = fs.tempfs.TempFS()
+        cache = morphlib.localartifactcache.LocalArtifactCache(
+            self.tempfs, pins=morphlib.artifactpins.ArtifactPins(
+                self.pinsfs.getsyspath('/')))
+
+        handle = cache.put(self.runtime_artifact)
+        handle.write('runtime')
+        handle.close()
+
+        with cache.pin([self.source.cache_key]):
+            self.assertEqual(cache.remove_unpinned([self.source.cache_key]),
+                             [])
+            self.assertTrue(cache.has(self.runtime_artifact))
+        self.assertEqual(cache.remove_unpinned([self.source.cache_key]),
+                         [self.source.cache_key])
+        self.assertFalse(cache.has(self.runtime_artifact))
@@ -107,6 +107,13 @@ class UnknownBuildSystemError(MorphologyValidationError):
                     % (build_system, morph_filename))
 
 
+class UnknownSourceExtractionError(MorphologyValidationError):
+
+    def __init__(self, mode, morph_filename):
+        self.msg = ('Unknown source-extraction %s in morphology %s'
+                    % (mode, morph_filename))
+
+
 class NoStratumBuildDependenciesError(MorphologyValidationError):
 
     def __init__(self, stratum_name, morph_filename):
@@ -239,6 +246,7 @@ class MorphologyDumper(yaml.SafeDumper):
         'build-mode',
         'artifacts',
         'max-jobs',
+        'source-extraction',
         'submodules',
         'products',
         'chunks',
@@ -356,6 +364,7 @@ class MorphologyLoader(object):
             'max-jobs': None,
             'build-system': 'manual',
             'build-mode': 'staging',
+            'source-extraction': 'checkout',
             'prefix': '/usr',
             'system-integration': [],
         },
@@ -574,6 +583,10 @@ class MorphologyLoader(object):
                         "to be a dict" % (chunk_name))
                 validate_submodules(spec['submodules'], morph.filename)
 
+    # 'checkout' gives the build a clone of the whole repository, with a
+    # .git directory; 'export' gives it only the files at the commit.
+    source_extraction_modes = ('checkout', 'export')
+
     @classmethod
     def _validate_chunk(cls, morphology):
         errors = []
@@ -587,6 +600,11 @@ class MorphologyLoader(object):
                 cls._validate_commands(morphology['name'], key,
                                        morphology[key], errors)
 
+        mode = morphology.get('source-extraction', 'checkout')
+        if mode not in cls.source_extraction_modes:
+            errors.append(UnknownSourceExtractionError(
+                mode, morphology['name']))
+
         if len(errors) == 1:
             raise errors[0]
         elif errors:
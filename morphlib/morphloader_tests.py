@@ -99,6 +99,16 @@ build-system: manual
         self.assertRaises(
             morphlib.morphloader.InvalidFieldError, self.loader.validate, m)
 
+    def test_fails_to_validate_chunk_with_unknown_source_extraction(self):
+        m = morphlib.morphology.Morphology({
+            'kind': 'chunk',
+            'name': 'foo',
+            'source-extraction': 'photocopy',
+        })
+        self.assertRaises(
+            morphlib.morphloader.UnknownSourceExtractionError,
+            self.loader.validate, m)
+
     def test_validate_requires_products_list(self):
         m = morphlib.morphology.Morphology(
             kind='chunk',
@@ -652,6 +662,7 @@ build-system: manual
                 'system-integration': [],
                 'devices': [],
                 'max-jobs': None,
+                'source-extraction': 'checkout',
                 'prefix': '/usr',
             })
 
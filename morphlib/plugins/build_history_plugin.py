@@ -0,0 +1,79 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import cliapp
+
+import morphlib
+
+
+class BuildHistoryPlugin(cliapp.Plugin):
+
+    def enable(self):
+        self.app.add_subcommand('build-history', self.build_history,
+                                arg_synopsis='[NAME...]')
+        self.app.settings.string(['build-history-worker'],
+                                 'only show build times recorded on WORKER',
+                                 metavar='WORKER',
+                                 default=None)
+
+    def disable(self):
+        pass
+
+    def build_history(self, args):
+        '''Show how long past builds took.
+
+        Command line arguments:
+
+        * `NAME` is the name of a chunk, stratum or system. Every recorded
+          build stage is shown for each named source. If no names are
+          given, the overall build time of every source with a recorded
+          history is shown.
+
+        Times are recorded in the cache directory for every local build,
+        every build on a distbuild worker, and by a distbuild controller
+        for every job it hands out. Only the most recent builds are used
+        to calculate the median (p50) and 95th percentile (p95) times, so
+        that a chunk whose build time has regressed stands out because its
+        last build time is much larger than its p50.
+
+        Example:
+
+            morph build-history gcc
+
+        '''
+
+        history = morphlib.util.new_build_history(self.app.settings)
+        worker = self.app.settings['build-history-worker']
+
+        rows = []
+        for name in args or history.names():
+            by_stage = history.durations_by_stage(name, worker)
+            if args:
+                stages = sorted(by_stage)
+            else:
+                # Controllers only know how long the whole job took.
+                stages = [stage for stage in ('overall-build', 'worker-build')
+                          if stage in by_stage][:1]
+            rows.extend((name, stage, by_stage[stage]) for stage in stages)
+
+        self.app.output.write('%-30s %-20s %7s %10s %10s %10s\n' %
+                              ('NAME', 'STAGE', 'SAMPLES', 'P50', 'P95',
+                               'LAST'))
+        for name, stage, durations in rows:
+            p50 = morphlib.buildhistory.percentile(durations, 50)
+            p95 = morphlib.buildhistory.percentile(durations, 95)
+            self.app.output.write('%-30s %-20s %7d %10.1f %10.1f %10.1f\n' %
+                                  (name, stage, len(durations), p50, p95,
+                                   durations[-1]))
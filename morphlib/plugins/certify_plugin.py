@@ -17,6 +17,9 @@
 #
 # See: <http://wiki.baserock.org/guides/release-process> for more information.
 
+import collections
+import multiprocessing.pool
+import os
 import warnings
 
 import cliapp
@@ -28,6 +31,12 @@ class CertifyPlugin(cliapp.Plugin):
         self.app.add_subcommand(
             'certify', self.certify,
             arg_synopsis='REPO REF MORPH [MORPH]...')
+        self.app.settings.integer(['certify-jobs'],
+                                  'check up to N chunk repositories at '
+                                  'once (default: %default)',
+                                  metavar='N',
+                                  default=4,
+                                  group='certify options')
 
     def disable(self):
         pass
@@ -41,6 +50,10 @@ class CertifyPlugin(cliapp.Plugin):
         * `REF` is a branch or other commit reference in that repository.
         * `MORPH` is a system morphology name at that ref.
 
+        Whether each chunk's commit is in a branch or tag is remembered in
+        the cache directory, so certifying again after a few chunks have
+        changed only needs to look at those chunks' repositories.
+
         Example:
 
             morph certify baserock:baserock/definitions master \
@@ -95,6 +108,7 @@ class CertifyPlugin(cliapp.Plugin):
         resolver = morphlib.repoaliasresolver.RepoAliasResolver(aliases)
 
         certified = True
+        anchor_checks = collections.defaultdict(dict)
 
         for source in set(a.source for a in system_artifact.walk()):
             source.cache_key = ckc.compute_key(source)
@@ -113,16 +127,12 @@ class CertifyPlugin(cliapp.Plugin):
                               .format(name, ref))
                 certified = False
 
-            cached = self.repo_cache.get_updated_repo(source.repo_name, ref)
-
             # Test that sha1 ref is anchored in a tag or branch,
-            # and thus not a candidate for removal on `git gc`.
-            if (morphlib.git.is_valid_sha1(ref) and
-                    not len(cached.tags_containing_sha1(ref)) and
-                    not len(cached.branches_containing_sha1(ref))):
-                warnings.warn('Chunk "{}" has unanchored ref: "{}"\n'
-                              .format(name, ref))
-                certified = False
+            # and thus not a candidate for removal on `git gc`. This is
+            # checked for each repo at once, below.
+            if morphlib.git.is_valid_sha1(ref):
+                anchor_checks[source.repo_name].setdefault(
+                    ref, []).append(name)
 
             # Test that chunk repo is on trove-host
             pull_url = resolver.pull_url(source.repo_name)
@@ -131,9 +141,48 @@ class CertifyPlugin(cliapp.Plugin):
                               .format(name, pull_url))
                 certified = False
 
+        for name, ref in self.find_unanchored_chunks(anchor_checks):
+            warnings.warn('Chunk "{}" has unanchored ref: "{}"\n'
+                          .format(name, ref))
+            certified = False
+
         if certified:
             print('=> Reproducibility certification PASSED for\n   {}'
                   .format(system_filename))
         else:
             print('=> Reproducibility certification FAILED for\n   {}'
                   .format(system_filename))
+
+    def find_unanchored_chunks(self, anchor_checks):
+        '''Find the chunks whose commits no branch or tag contains.
+
+        `anchor_checks` maps each repo to a dict of the chunks, by name,
+        using each commit from it. Repos are updated and checked
+        `certify-jobs` at a time. Returns a sorted list of (chunk name,
+        commit) pairs.
+
+        '''
+        anchors = morphlib.refanchors.RefAnchors(
+            os.path.join(self.app.settings['cachedir'], 'ref-anchors.json'))
+
+        def check_repo(repo_name):
+            chunks_by_sha1 = anchor_checks[repo_name]
+            # Finding the branches and tags containing a commit needs
+            # the history between them.
+            cached = self.repo_cache.get_updated_repo(
+                repo_name, refs=sorted(chunks_by_sha1), full_history=True)
+            return [(name, sha1)
+                    for sha1 in anchors.find_unanchored(
+                        repo_name, cached, sorted(chunks_by_sha1))
+                    for name in chunks_by_sha1[sha1]]
+
+        repo_names = sorted(anchor_checks)
+        pool = multiprocessing.pool.ThreadPool(
+            max(1, min(self.app.settings['certify-jobs'], len(repo_names))))
+        try:
+            results = pool.map(check_repo, repo_names)
+        finally:
+            pool.close()
+            pool.join()
+            anchors.save()
+        return sorted(pair for result in results for pair in result)
@@ -14,13 +14,18 @@
 
 
 import collections
+import contextlib
+import functools
 import json
 import logging
+import multiprocessing.pool
 import os
 import shutil
+import stat
 import sys
 import tarfile
 import tempfile
+import threading
 import warnings
 
 import cliapp
@@ -29,6 +34,73 @@ import morphlib
 from morphlib.artifactcachereference import ArtifactCacheReference
 
 
+def overlay_tree(srcpath, destpath, links=None):
+    '''Copy the tree at srcpath over destpath, as extracting it would.
+
+    Files already in destpath are replaced. Directories are merged, and a
+    symlink to a directory in destpath is followed rather than replaced,
+    like a chunk unpacked on top of other chunks.
+
+    Files hardlinked together in srcpath are hardlinked together in
+    destpath too. `links` maps the device and inode of each one copied
+    so far to where it was copied; pass the same dict when overlaying
+    several parts of one tree.
+
+    '''
+
+    if links is None:
+        links = {}
+    st = os.lstat(srcpath)
+    if stat.S_ISDIR(st.st_mode):
+        if os.path.lexists(destpath) and not os.path.isdir(destpath):
+            os.remove(destpath)
+        if not os.path.lexists(destpath):
+            os.mkdir(destpath)
+        for entry in os.listdir(srcpath):
+            overlay_tree(os.path.join(srcpath, entry),
+                         os.path.join(destpath, entry), links)
+        if os.path.islink(destpath):
+            return
+    else:
+        if os.path.lexists(destpath):
+            if os.path.isdir(destpath) and not os.path.islink(destpath):
+                raise IOError('Cannot replace directory %s with %s' %
+                              (destpath, srcpath))
+            os.remove(destpath)
+        if stat.S_ISLNK(st.st_mode):
+            os.symlink(os.readlink(srcpath), destpath)
+        elif stat.S_ISREG(st.st_mode):
+            if st.st_nlink > 1:
+                key = (st.st_dev, st.st_ino)
+                if key in links:
+                    # Already copied, with its owner and permissions.
+                    os.link(links[key], destpath)
+                    return
+                links[key] = destpath
+            shutil.copyfile(srcpath, destpath)
+        elif (stat.S_ISCHR(st.st_mode) or stat.S_ISBLK(st.st_mode) or
+              stat.S_ISFIFO(st.st_mode)):
+            os.mknod(destpath, st.st_mode, st.st_rdev)
+        else:
+            raise IOError('Cannot copy %s: unsupported file type' % srcpath)
+
+    if os.geteuid() == 0:
+        os.lchown(destpath, st.st_uid, st.st_gid)
+    if not stat.S_ISLNK(st.st_mode):
+        # After chown, which may clear setuid and setgid bits.
+        shutil.copystat(srcpath, destpath)
+
+
+class _SharedSystemTree(object):
+
+    '''A system unpacked once, to be copied for each deployment.'''
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.lock = threading.Lock()
+        self.unpacked = False
+
+
 def configuration_for_system(system_id, vars_from_commandline,
                              deploy_defaults, deploy_params):
     '''Collect all configuration variables for deploying one system.
@@ -138,6 +210,27 @@ class DeployPlugin(cliapp.Plugin):
                                   'existing cluster. Deprecated: use the '
                                   '`morph upgrade` command instead',
                                   group=group_deploy)
+        self.app.settings.integer(['deploy-jobs'],
+                                  'fetch and unpack up to N artifacts at '
+                                  'once for partial deployments',
+                                  metavar='N',
+                                  default=4,
+                                  group=group_deploy)
+        self.app.settings.integer(['deploy-concurrency'],
+                                  'run up to N deployments at once '
+                                  '(default: %default)',
+                                  metavar='N',
+                                  default=1,
+                                  group=group_deploy)
+        self.app.settings.boolean(['streaming-deploy'],
+                                  'let write extensions which support it '
+                                  'read the system artifact directly, '
+                                  'rather than unpacking it first, when '
+                                  'there is nothing to configure '
+                                  '(default: true)',
+                                  default=True,
+                                  group=group_deploy)
+        self._unpacked_systems = {}
         self.app.add_subcommand(
             'deploy', self.deploy,
             arg_synopsis='CLUSTER [DEPLOYMENT...] [SYSTEM.KEY=VALUE]')
@@ -298,6 +391,14 @@ class DeployPlugin(cliapp.Plugin):
         are set as environment variables when either the configuration or the
         write extension runs.
 
+        A write extension that can read the system straight from the system
+        artifact, a tarball, can say so with a `.write.streaming` file
+        beside it. When the system has no configuration extensions, it is
+        then given a tree holding only the files Morph adds, such as
+        /baserock/deployment.meta, and the path to the system artifact in
+        `MORPH_SYSTEM_TARBALL`. This saves unpacking the system first. Set
+        `streaming-deploy` to false to always unpack the system.
+
         You can write your own .write and .configure extensions, in any
         format that Morph can execute at deploy-time. They must be committed
         to your definitions.git repository for Morph to find them.
@@ -397,10 +498,9 @@ class DeployPlugin(cliapp.Plugin):
         # Create a tempdir for this deployment to work in
         tmp_basedir = os.path.join(self.app.settings['tempdir'], 'deployments')
         with morphlib.util.temp_dir(dir=tmp_basedir) as deploy_tempdir:
-            for system in cluster_morphology['systems']:
-                self.deploy_system(deploy_tempdir, definitions_repo,
-                                   system, env_vars, deployments,
-                                   parent_location='')
+            self.deploy_systems(deploy_tempdir, definitions_repo,
+                                cluster_morphology['systems'], env_vars,
+                                deployments, parent_location='')
 
     def _sanitise_morphology_paths(self, paths, definitions_repo):
         sanitised_paths = []
@@ -443,9 +543,58 @@ class DeployPlugin(cliapp.Plugin):
 
     def deploy_system(self, deploy_tempdir, definitions_repo, system, env_vars,
                       deployment_filter, parent_location):
+        self.deploy_systems(deploy_tempdir, definitions_repo, [system],
+                            env_vars, deployment_filter, parent_location)
+
+    def deploy_systems(self, deploy_tempdir, definitions_repo, systems,
+                       env_vars, deployment_filter, parent_location):
+        """Deploy several systems, running deployments concurrently.
+
+        Every system is prepared for deployment first, one at a time. Then
+        up to --deploy-concurrency deployments are run at once, whichever
+        systems they belong to. Deploying a system with subsystems deploys
+        the subsystems too, which each need a source pool, and that may
+        mean creating a temporary branch in the definitions repo. So the
+        deployments of systems with subsystems are run one at a time.
+
+        """
+        concurrent = []
+        serial = []
+
+        def prepare(remaining):
+            if not remaining:
+                if serial:
+                    concurrent.append(
+                        lambda: morphlib.util.run_jobs(serial, 1))
+                morphlib.util.run_jobs(
+                    concurrent, self.app.settings['deploy-concurrency'])
+                return
+            system = remaining[0]
+            with self.system_deployments(deploy_tempdir, definitions_repo,
+                                         system, env_vars, deployment_filter,
+                                         parent_location) as deploys:
+                if system.get('subsystems'):
+                    serial.extend(deploys)
+                else:
+                    concurrent.extend(deploys)
+                # The system must stay ready until it has been deployed.
+                prepare(remaining[1:])
+
+        prepare(list(systems))
+
+    @contextlib.contextmanager
+    def system_deployments(self, deploy_tempdir, definitions_repo, system,
+                           env_vars, deployment_filter, parent_location):
+        """Get ready to deploy a system.
+
+        In this context, the system's artifacts are resolved, and a
+        function that runs each of the system's deployments is yielded.
+
+        """
         sys_ids = set(system['deploy'].iterkeys())
         if deployment_filter and not \
                 any(sys_id in deployment_filter for sys_id in sys_ids):
+            yield []
             return
 
         # FIXME: right now we create a new source pool and possibly a new
@@ -457,81 +606,125 @@ class DeployPlugin(cliapp.Plugin):
         source_pool_context = definitions_repo.source_pool(
             definitions_repo.HEAD, morph)
         with source_pool_context as source_pool:
-            self.deploy_system_with_source_pool(
-                deploy_tempdir, definitions_repo, source_pool, system,
-                env_vars, deployment_filter, parent_location)
-
-    def deploy_system_with_source_pool(self, deploy_tempdir, definitions_repo,
-                                       source_pool, system, env_vars,
-                                       deployment_filter, parent_location):
-        old_status_prefix = self.app.status_prefix
-        system_status_prefix = '%s[%s]' % (old_status_prefix, system['morph'])
-        self.app.status_prefix = system_status_prefix
-        try:
-            build_command = morphlib.buildcommand.BuildCommand(self.app)
-            artifact = build_command.resolve_artifacts(source_pool)
+            old_status_prefix = self.app.status_prefix
+            system_status_prefix = '%s[%s]' % (old_status_prefix,
+                                               system['morph'])
+            self.app.status_prefix = system_status_prefix
+            try:
+                build_command = morphlib.buildcommand.BuildCommand(self.app)
+                artifact = build_command.resolve_artifacts(source_pool)
+            finally:
+                self.app.status_prefix = old_status_prefix
 
             deploy_defaults = system.get('deploy-defaults') or {}
-            for system_id, deploy_params in system['deploy'].iteritems():
-                if not system_id in deployment_filter and deployment_filter:
-                    continue
-                deployment_status_prefix = '%s[%s]' % (
+            deployments = [(system_id, deploy_params) for system_id,
+                           deploy_params in system['deploy'].iteritems()
+                           if system_id in deployment_filter or
+                           not deployment_filter]
+
+            def deploy(system_id, deploy_params):
+                old_status_prefix = self.app.status_prefix
+                self.app.status_prefix = '%s[%s]' % (
                     system_status_prefix, system_id)
-                self.app.status_prefix = deployment_status_prefix
                 try:
-                    final_env = configuration_for_system(
-                        system_id, env_vars, deploy_defaults, deploy_params)
-
-                    is_upgrade = determine_if_upgrade(
-                            deploy_env=final_env,
-                            upgrade_config=self.app.settings['upgrade'],
-                            is_subsystem=(parent_location != ''))
-                    final_env['UPGRADE'] = ('yes' if is_upgrade else 'no')
-
-                    deployment_type, location = deployment_type_and_location(
-                        system_id, final_env, is_upgrade)
-
-                    extensions_dir = os.path.join(
-                        definitions_repo.dirname,
-                        os.path.dirname(deployment_type))
-                    if 'PYTHONPATH' in final_env:
-                        final_env['PYTHONPATH'] += ':%s' % extensions_dir
-                    else:
-                        final_env['PYTHONPATH'] = extensions_dir
-
-                    components = self._sanitise_morphology_paths(
-                        deploy_params.get('partial-deploy-components', []),
-                        definitions_repo)
-                    if self.app.settings['partial']:
-                        components = self._validate_partial_deployment(
-                            deployment_type, artifact, components)
-
-                    self.check_deploy(definitions_repo, deployment_type,
-                                      location, final_env)
-                    system_tree = self.setup_deploy(build_command,
-                                                    deploy_tempdir,
-                                                    definitions_repo,
-                                                    artifact,
-                                                    deployment_type,
-                                                    location, final_env,
-                                                    components=components)
-                    for subsystem in system.get('subsystems', []):
-                        self.deploy_system(deploy_tempdir, definitions_repo,
-                                           subsystem, env_vars, [],
-                                           parent_location=system_tree)
-                    if parent_location:
-                        deploy_location = os.path.join(parent_location,
-                                                       location.lstrip('/'))
-                    else:
-                        deploy_location = location
-                    self.run_deploy_commands(deploy_tempdir, final_env,
-                                             artifact, definitions_repo,
-                                             deployment_type, system_tree,
-                                             deploy_location)
+                    self.deploy_one(deploy_tempdir, definitions_repo,
+                                    build_command, artifact, system,
+                                    system_id, deploy_defaults,
+                                    deploy_params, env_vars,
+                                    parent_location)
                 finally:
-                    self.app.status_prefix = system_status_prefix
-        finally:
-            self.app.status_prefix = old_status_prefix
+                    self.app.status_prefix = old_status_prefix
+
+            with self.shared_system_tree(build_command, deploy_tempdir,
+                                         artifact, len(deployments)):
+                yield [functools.partial(deploy, system_id, deploy_params)
+                       for system_id, deploy_params in deployments]
+
+    def deploy_one(self, deploy_tempdir, definitions_repo, build_command,
+                   artifact, system, system_id, deploy_defaults,
+                   deploy_params, env_vars, parent_location):
+        final_env = configuration_for_system(
+            system_id, env_vars, deploy_defaults, deploy_params)
+
+        is_upgrade = determine_if_upgrade(
+            deploy_env=final_env,
+            upgrade_config=self.app.settings['upgrade'],
+            is_subsystem=(parent_location != ''))
+        final_env['UPGRADE'] = ('yes' if is_upgrade else 'no')
+
+        deployment_type, location = deployment_type_and_location(
+            system_id, final_env, is_upgrade)
+
+        extensions_dir = os.path.join(definitions_repo.dirname,
+                                      os.path.dirname(deployment_type))
+        if 'PYTHONPATH' in final_env:
+            final_env['PYTHONPATH'] += ':%s' % extensions_dir
+        else:
+            final_env['PYTHONPATH'] = extensions_dir
+
+        components = self._sanitise_morphology_paths(
+            deploy_params.get('partial-deploy-components', []),
+            definitions_repo)
+        if self.app.settings['partial']:
+            components = self._validate_partial_deployment(
+                deployment_type, artifact, components)
+
+        self.check_deploy(definitions_repo, deployment_type, location,
+                          final_env)
+        streaming = self.can_stream(definitions_repo, artifact, system,
+                                    deployment_type, is_upgrade,
+                                    parent_location)
+        system_tree = self.setup_deploy(build_command, deploy_tempdir,
+                                        definitions_repo, artifact,
+                                        deployment_type, location, final_env,
+                                        components=components,
+                                        streaming=streaming)
+        for subsystem in system.get('subsystems', []):
+            self.deploy_system(deploy_tempdir, definitions_repo,
+                               subsystem, env_vars, [],
+                               parent_location=system_tree)
+        if parent_location:
+            deploy_location = os.path.join(parent_location,
+                                           location.lstrip('/'))
+        else:
+            deploy_location = location
+        # A streaming write extension reads the system from the cache.
+        pinned = [artifact.source.cache_key] if streaming else []
+        with build_command.lac.pin(pinned):
+            self.run_deploy_commands(deploy_tempdir, final_env, artifact,
+                                     definitions_repo, deployment_type,
+                                     system_tree, deploy_location)
+
+    def can_stream(self, definitions_repo, artifact, system, deployment_type,
+                   is_upgrade, parent_location):
+        """Can the write extension read the system artifact directly?
+
+        This needs the extension to say it can, with a `.write.streaming`
+        file beside it. Nothing may need to change the unpacked system
+        first, so there must be no configuration extensions or subsystems,
+        and this can't be a partial deployment or a subsystem itself.
+        Upgrades are not streamed, since they compare the unpacked system
+        with the one already deployed.
+
+        """
+        if not self.app.settings['streaming-deploy']:
+            return False
+        if (self.app.settings['partial'] or is_upgrade or parent_location or
+                system.get('subsystems') or
+                artifact.source.morphology['configuration-extensions']):
+            return False
+        # A write extension in the definitions repository replaces Morph's
+        # own, so the marker only counts if it comes from the same place.
+        write_ext = morphlib.extensions.get_extension_filename(
+            definitions_repo, deployment_type, '.write')
+        marker = morphlib.extensions.get_extension_filename(
+            definitions_repo, deployment_type, '.write.streaming',
+            executable=False)
+        try:
+            with write_ext, marker:
+                return write_ext.delete == marker.delete
+        except morphlib.extensions.ExtensionNotFoundError:
+            return False
 
     def upgrade(self, args):
         '''Upgrade an existing set of instances using built images.
@@ -584,37 +777,50 @@ class DeployPlugin(cliapp.Plugin):
         except morphlib.extensions.ExtensionNotFoundError:
             pass
 
-    def unpack_stratum(self, path, artifact, lac, rac, unpacked):
-        """Fetch the chunks in a stratum, then unpack them into `path`.
-
-        This reads a stratum artifact and fetches the chunks it contains from
-        the remote into the local artifact cache if they are not already
-        cached locally. Each of these chunks is then unpacked into `path`.
+    def copy_stratum_metadata(self, path, artifact, lac):
+        """Place the metadata of a stratum in the baserock directory."""
+        metadata = os.path.join(path, 'baserock', '%s.meta' % artifact.name)
+        with lac.get_artifact_metadata(artifact, 'meta') as meta_src:
+            with morphlib.savefile.SaveFile(metadata, 'w') as meta_dst:
+                shutil.copyfileobj(meta_src, meta_dst)
 
-        Also download the stratum metadata into the local cache, then place
-        it in the baserock subdirectory directory of `path`.
+    @contextlib.contextmanager
+    def shared_system_tree(self, build_command, deploy_tempdir, artifact,
+                           deployment_count):
+        """Unpack a system at most once for all of its deployments.
 
-        If any of the chunks have not been cached either locally or remotely,
-        a morphlib.remoteartifactcache.GetError is raised.
+        While in this context, unpack_system unpacks the system artifact
+        once, the first time it is needed, and then copies that tree for
+        every deployment. Nothing is shared for a single deployment, or
+        for partial deployments, which unpack chunks instead. A system
+        listed more than once in a cluster shares one tree.
 
         """
-        with lac.get(artifact) as stratum:
-            chunks = [ArtifactCacheReference(c) for c in json.load(stratum)]
-        morphlib.builder.download_depends(chunks, lac, rac)
-        for chunk in chunks:
-            if chunk.basename() in unpacked:
-                continue
-            self.app.status(msg='Unpacking chunk %(name)s.',
-                            name=chunk.basename(), chatty=True)
-            handle = lac.get(chunk)
-            tf = tarfile.open(fileobj=handle)
-            tf.extractall(path=path)
-            unpacked.add(chunk.basename())
+        if (deployment_count < 2 or self.app.settings['partial'] or
+                artifact.basename() in self._unpacked_systems):
+            yield
+            return
 
-        metadata = os.path.join(path, 'baserock', '%s.meta' % artifact.name)
-        with lac.get_artifact_metadata(artifact, 'meta') as meta_src:
-            with morphlib.savefile.SaveFile(metadata, 'w') as meta_dst:
-                shutil.copyfileobj(meta_src, meta_dst)
+        with morphlib.util.temp_dir(dir=deploy_tempdir) as unpacked:
+            self._unpacked_systems[artifact.basename()] = \
+                _SharedSystemTree(unpacked)
+            try:
+                yield
+            finally:
+                del self._unpacked_systems[artifact.basename()]
+
+    def ensure_system_cached(self, build_command, artifact):
+        """Fetch a system artifact into the local cache if it isn't there.
+
+        Raises a NotYetBuiltError if the system artifact isn't cached either
+        locally or remotely.
+
+        """
+        if build_command.lac.has(artifact):
+            return
+        if not build_command.rac.has(artifact):
+            raise NotYetBuiltError(artifact, build_command.rac)
+        build_command.cache_artifacts_locally([artifact])
 
     def unpack_system(self, build_command, artifact, path):
         """Unpack a system into `path`.
@@ -627,72 +833,151 @@ class DeployPlugin(cliapp.Plugin):
         locally or remotely.
 
         """
-        # Unpack the artifact (tarball) to a temporary directory.
-        self.app.status(msg='Unpacking system for configuration')
-
-        if build_command.lac.has(artifact):
-            f = build_command.lac.get(artifact)
-        elif build_command.rac.has(artifact):
-            build_command.cache_artifacts_locally([artifact])
-            f = build_command.lac.get(artifact)
+        shared = self._unpacked_systems.get(artifact.basename())
+        if shared is not None:
+            with shared.lock:
+                if not shared.unpacked:
+                    self.extract_system(build_command, artifact,
+                                        shared.dirname)
+                    shared.unpacked = True
+            # Configuration extensions change the tree, so it must be a
+            # real copy, but with reflinks that costs next to nothing.
+            self.app.status(msg='Copying unpacked system for configuration')
+            self.app.runcmd(['cp', '-a', '--reflink=auto',
+                             os.path.join(shared.dirname, '.'), path])
         else:
-            raise NotYetBuiltError(artifact, build_command.rac)
-
-        tf = tarfile.open(fileobj=f)
-        tf.extractall(path=path)
+            self.extract_system(build_command, artifact, path)
 
         self.app.status(
             msg='System unpacked at %(system_tree)s',
             system_tree=path)
 
-    def unpack_components(self, bc, components, path):
-        if not components:
-            raise cliapp.AppException('Deployment failed as no components '
-                                      'were specified for deployment and '
-                                      '--partial was set.')
+    def extract_system(self, build_command, artifact, path):
+        self.app.status(msg='Unpacking system for configuration')
+        self.ensure_system_cached(build_command, artifact)
+        with build_command.lac.get(artifact) as f:
+            tf = tarfile.open(fileobj=f)
+            tf.extractall(path=path)
 
-        self.app.status(msg='Unpacking components for deployment')
-        unpacked = set()
+    def find_component_contents(self, bc, components):
+        """Find the strata and chunks to unpack for a partial deployment.
+
+        Returns the strata and the chunks, each in the order they should be
+        unpacked. The chunks are those in each stratum, and any named as
+        components themselves. Strata are fetched into the local cache, so
+        that their contents can be read. Chunks are not fetched, but if any
+        of them has not been cached either locally or remotely, a
+        NotYetBuiltError is raised.
+
+        """
+        seen = set()
+        strata = []
+        chunks = []
         for name, artifacts in components.iteritems():
             for artifact in artifacts:
                 if not (bc.lac.has(artifact) or bc.rac.has(artifact)):
-                    raise NotYetBuiltError(name, bc.rac)
+                    raise NotYetBuiltError(artifact, bc.rac)
 
                 for a in artifact.walk():
-                    if a.basename() in unpacked:
+                    if a.basename() in seen:
                         continue
-                    if not bc.lac.has(a):
-                        if bc.rac.has(a):
+                    seen.add(a.basename())
+                    kind = a.source.morphology['kind']
+                    if kind == 'stratum':
+                        if not bc.lac.has(a):
+                            if not bc.rac.has(a):
+                                raise NotYetBuiltError(a, bc.rac)
                             bc.cache_artifacts_locally([a])
-                        else:
-                            raise NotYetBuiltError(a.name, bc.rac)
-                    if a.source.morphology['kind'] == 'stratum':
-                        self.unpack_stratum(path, a, bc.lac, bc.rac, unpacked)
-                    elif a.source.morphology['kind'] == 'chunk':
+                        with bc.lac.get(a) as f:
+                            contents = [ArtifactCacheReference(c)
+                                        for c in json.load(f)]
+                        for chunk in contents:
+                            if chunk.basename() not in seen:
+                                seen.add(chunk.basename())
+                                chunks.append(chunk)
+                        strata.append(a)
+                    elif kind == 'chunk':
                         if a.source.morphology['build-mode'] == 'bootstrap':
                             continue
-                        self.app.status(msg='Unpacking chunk %(name)s.',
-                                        name=a.basename(), chatty=True)
-                        handle = bc.lac.get(a)
-                        tf = tarfile.open(fileobj=handle)
-                        tf.extractall(path=path)
-                    unpacked.add(a.basename())
+                        if not (bc.lac.has(a) or bc.rac.has(a)):
+                            raise NotYetBuiltError(a, bc.rac)
+                        chunks.append(a)
+        return strata, chunks
+
+    def unpack_components(self, bc, components, path):
+        """Unpack the components of a partial deployment into `path`.
+
+        Chunks missing from the local cache are fetched concurrently, and
+        then unpacked concurrently into the unpacked chunk store that
+        staging areas also use, so chunks already unpacked for a build on
+        this machine are not unpacked again. The unpacked chunks are then
+        copied into `path` one by one, in the same order every time, so
+        that where chunks overlap the result doesn't depend on which was
+        unpacked first.
+
+        """
+        if not components:
+            raise cliapp.AppException('Deployment failed as no components '
+                                      'were specified for deployment and '
+                                      '--partial was set.')
+
+        self.app.status(msg='Unpacking components for deployment')
+        strata, chunks = self.find_component_contents(bc, components)
+
+        def fetch(chunk):
+            morphlib.builder.download_depends([chunk], bc.lac, bc.rac)
+
+        def unpack(chunk):
+            with bc.lac.get(chunk) as handle:
+                return morphlib.stagingarea.unpack_chunk(self.app, handle)
+
+        pool = multiprocessing.pool.ThreadPool(
+            max(1, self.app.settings['deploy-jobs']))
+        try:
+            missing = [c for c in chunks if not bc.lac.has(c)]
+            self.app.status(msg='Fetching %(count)d chunks',
+                            count=len(missing), chatty=True)
+            pool.map(fetch, missing)
+            unpacked_dirs = pool.map(unpack, chunks)
+        finally:
+            pool.close()
+            pool.join()
+
+        for chunk, unpacked_dir in zip(chunks, unpacked_dirs):
+            self.app.status(msg='Unpacking chunk %(name)s.',
+                            name=chunk.basename(), chatty=True)
+            links = {}
+            for entry in os.listdir(unpacked_dir):
+                overlay_tree(os.path.join(unpacked_dir, entry),
+                             os.path.join(path, entry), links)
+        for stratum in strata:
+            self.copy_stratum_metadata(path, stratum, bc.lac)
 
         self.app.status(
             msg='Components %(components)s unpacked at %(path)s',
             components=', '.join(components), path=path)
 
     def setup_deploy(self, build_command, deploy_tempdir, definitions_repo,
-                     artifact, deployment_type, location, env, components=[]):
+                     artifact, deployment_type, location, env, components=[],
+                     streaming=False):
         # Create a tempdir to extract the rootfs in
         with morphlib.util.temp_dir(dir=deploy_tempdir,
                                     cleanup_on_success=False) as system_tree:
             # FIXME: This should be fixed in morphloader.
             morphlib.util.fix_chunk_build_mode(artifact)
-            if self.app.settings['partial']:
-                self.unpack_components(build_command, components, system_tree)
-            else:
-                self.unpack_system(build_command, artifact, system_tree)
+            # Stop gc removing what we are about to unpack.
+            pinned = set(a.source.cache_key for a in artifact.walk())
+            with build_command.lac.pin(pinned):
+                if streaming:
+                    # The tree only holds the files added below, and the
+                    # write extension reads the rest from the artifact.
+                    self.ensure_system_cached(build_command, artifact)
+                    os.mkdir(os.path.join(system_tree, 'baserock'))
+                elif self.app.settings['partial']:
+                    self.unpack_components(build_command, components,
+                                           system_tree)
+                else:
+                    self.unpack_system(build_command, artifact, system_tree)
 
             self.app.status(
                 msg='Writing deployment metadata file')
@@ -703,6 +988,13 @@ class DeployPlugin(cliapp.Plugin):
             with morphlib.savefile.SaveFile(metadata_path, 'w') as f:
                 json.dump(metadata, f, indent=4,
                           sort_keys=True, encoding='unicode-escape')
+            if streaming:
+                self.app.status(msg='Write extension will read the system '
+                                    'from %(filename)s',
+                                filename=build_command.lac.artifact_filename(
+                                    artifact))
+                env['MORPH_SYSTEM_TARBALL'] = \
+                    build_command.lac.artifact_filename(artifact)
             return system_tree
 
     def run_deploy_commands(self, deploy_tempdir, env, artifact,
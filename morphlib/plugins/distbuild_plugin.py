@@ -17,6 +17,7 @@
 
 import cliapp
 import logging
+import os
 import re
 import sys
 import uuid
@@ -226,6 +227,13 @@ class WorkerBuild(cliapp.Plugin):
     def enable(self):
         self.app.add_subcommand(
             'worker-build', self.worker_build, arg_synopsis='')
+        self.app.settings.boolean(
+            ['worker-build-gc'],
+            'run `morph gc` before each worker-build; set this to false '
+            'when `morph gc --gc-daemon` keeps the cache clean instead '
+            '(default: true)',
+            default=True,
+            group=group_distbuild)
 
     def disable(self):
         pass
@@ -251,21 +259,29 @@ class WorkerBuild(cliapp.Plugin):
         definitions_version = source_pool.definitions_version
 
         root = bc.resolve_artifacts(source_pool)
+        source = self.find_source(source_pool, artifact_reference)
 
-        # Now, before we start the build, we garbage collect the caches
-        # to ensure we have room.  First we remove all system artifacts
-        # since we never need to recover those from workers post-hoc
-        for cachekey, artifacts, last_used in bc.lac.list_contents():
-            if any(self.is_system_artifact(f) for f in artifacts):
-                logging.debug("Removing all artifacts for system %s" %
+        # Pin everything this build installs, so that neither the gc
+        # below nor one run by another process removes it.
+        deps = bc.get_recursive_deps(source.artifacts.values())
+        pinned = set(a.source.cache_key for a in deps)
+        pinned.add(source.cache_key)
+        with bc.lac.pin(pinned):
+            # Now, before we start the build, we garbage collect the caches
+            # to ensure we have room.  First we remove all system artifacts
+            # since we never need to recover those from workers post-hoc
+            systems = [cachekey for cachekey, artifacts, last_used
+                       in bc.lac.list_contents()
+                       if any(self.is_system_artifact(f) for f in artifacts)]
+            for cachekey in bc.lac.remove_unpinned(systems):
+                logging.debug("Removed all artifacts for system %s" %
                         cachekey)
-                bc.lac.remove(cachekey)
 
-        self.app.subcommands['gc']([])
+            if self.app.settings['worker-build-gc']:
+                self.app.subcommands['gc']([])
 
-        source = self.find_source(source_pool, artifact_reference)
-        build_env = bc.new_build_env(artifact_reference.arch)
-        bc.build_source(source, build_env, definitions_version)
+            build_env = bc.new_build_env(artifact_reference.arch)
+            bc.build_source(source, build_env, definitions_version)
 
     def find_source(self, source_pool, artifact_reference):
         for s in source_pool.lookup(artifact_reference.source_repo,
@@ -300,10 +316,22 @@ class WorkerDaemon(cliapp.Plugin):
             'write port used by worker-daemon to FILE',
             default='',
             group=group_distbuild)
+        self.app.settings.integer(
+            ['worker-daemon-slots'],
+            'run up to N builds at once on this worker; there must be '
+                'enough distbuild-helper slots to run them (default: '
+                '%default)',
+            metavar='N',
+            default=1,
+            group=group_distbuild)
         self.app.add_subcommand(
             'worker-daemon',
             self.worker_daemon,
             arg_synopsis='')
+        self._cache_index = None
+        self._cache_summary = None
+        self._cache_summary_size = 0
+        self._cache_summary_capacity = 0
     
     def disable(self):
         pass
@@ -317,11 +345,68 @@ class WorkerDaemon(cliapp.Plugin):
         port = self.app.settings['worker-daemon-port']
         port_file = self.app.settings['worker-daemon-port-file']
         router = distbuild.ListenServer(address, port, distbuild.JsonRouter,
+                                        extra_args=[self.get_capacity,
+                                                    self.get_cache_summary,
+                                                    self.pin_artifacts],
                                         port_file=port_file)
         loop = distbuild.MainLoop()
         loop.add_state_machine(router)
         loop.run()
 
+    def get_capacity(self):
+        '''Describe the resources this worker has for running builds.'''
+
+        settings = self.app.settings
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        disk = min(morphlib.util.get_bytes_free_in_path(settings['tempdir']),
+                   morphlib.util.get_bytes_free_in_path(settings['cachedir']))
+        return {
+            'slots': settings['worker-daemon-slots'],
+            'cpus': settings['max-jobs'],
+            'memory': memory,
+            'disk': disk,
+        }
+
+    def pin_artifacts(self, cache_keys):
+        '''Keep artifacts in the local cache until the result is called.'''
+
+        pins = morphlib.artifactpins.ArtifactPins(
+            os.path.join(self.app.settings['cachedir'], 'artifact-pins'))
+        filename = pins.hold(cache_keys)
+        return lambda: pins.release(filename)
+
+    def get_cache_summary(self):
+        '''Summarise the contents of the local artifact cache.
+
+        The summary is a Bloom filter of the files in the artifact cache
+        index. Files added since the last summary are added to the same
+        filter, and it is only made again from the whole index when it is
+        full or the index has been rewritten. Removed files stay in the
+        filter until then, which at worst means the controller sends a
+        job to a worker that has fewer of its dependencies than it
+        thought.
+
+        '''
+
+        cachedir = self.app.settings['cachedir']
+        if self._cache_index is None:
+            self._cache_index = morphlib.artifactcacheindex.ArtifactCacheIndex(
+                os.path.join(cachedir, 'artifact-index'),
+                os.path.join(cachedir, 'artifacts'))
+        added = self._cache_index.refresh()
+        if (added is None or self._cache_summary is None or
+                self._cache_summary_size + len(added) >
+                self._cache_summary_capacity):
+            added = self._cache_index.basenames()
+            self._cache_summary_capacity = max(1024, 2 * len(added))
+            self._cache_summary = distbuild.BloomFilter(
+                self._cache_summary_capacity)
+            self._cache_summary_size = 0
+        for basename in added:
+            self._cache_summary.add(basename)
+        self._cache_summary_size += len(added)
+        return self._cache_summary
+
 
 class ControllerDaemon(cliapp.Plugin):
 
@@ -376,6 +461,20 @@ class ControllerDaemon(cliapp.Plugin):
             metavar='PORT',
             default=8080,
             group=group_distbuild)
+        self.app.settings.bytesize(
+            ['worker-job-memory'],
+            'only run as many jobs at once on a worker as it has SIZE bytes '
+                'of memory for (default: %default)',
+            metavar='SIZE',
+            default='1G',
+            group=group_distbuild)
+        self.app.settings.bytesize(
+            ['worker-job-disk'],
+            'only run as many jobs at once on a worker as it has SIZE bytes '
+                'of free disk space for (default: %default)',
+            metavar='SIZE',
+            default='4G',
+            group=group_distbuild)
         self.app.settings.string(
             ['writeable-cache-server'],
             'specify the shared cache server writeable instance '
@@ -414,6 +513,11 @@ class ControllerDaemon(cliapp.Plugin):
         worker_cache_server_port = \
             self.app.settings['worker-cache-server-port']
         morph_instance = self.app.settings['morph-instance']
+        build_history = morphlib.util.new_build_history(self.app.settings)
+        job_requirements = {
+            'memory': self.app.settings['worker-job-memory'],
+            'disk': self.app.settings['worker-job-disk'],
+        }
 
         listener_specs = [
             # address, port, class to initiate on connection, class init args
@@ -449,7 +553,7 @@ class ControllerDaemon(cliapp.Plugin):
             cm = distbuild.ConnectionMachine(
                 addr, port, distbuild.WorkerConnection, 
                 [writeable_cache_server, worker_cache_server_port,
-                 morph_instance])
+                 morph_instance, build_history, job_requirements])
             loop.add_state_machine(cm)
 
         loop.run()
@@ -13,13 +13,13 @@
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import json
 import logging
 import os
 import shutil
 import time
 import fcntl
 
-import fs.osfs
 import cliapp
 
 import morphlib
@@ -42,6 +42,43 @@ class GCPlugin(cliapp.Plugin):
                                   metavar='PERIOD',
                                   group="Storage Options",
                                   default=(60*60*24))
+        self.app.settings.choice(['cachedir-eviction-policy'],
+                                 ['cost', 'lru'],
+                                 'how to choose which artifacts to remove '
+                                 'when more space is needed: "cost" keeps '
+                                 'the artifacts that would take longest to '
+                                 'build again for the space they use and '
+                                 'were used most recently, "lru" removes '
+                                 'the least recently used first '
+                                 '(default: cost)',
+                                 group="Storage Options")
+        self.app.settings.boolean(['gc-daemon'],
+                                  'keep running, checking for free space '
+                                  'every --gc-interval seconds, instead of '
+                                  'cleaning up once',
+                                  group="Storage Options")
+        self.app.settings.integer(['gc-interval'],
+                                  'with --gc-daemon, check for free space '
+                                  'every PERIOD seconds (default: %default)',
+                                  metavar='PERIOD',
+                                  group="Storage Options",
+                                  default=60)
+        self.app.settings.bytesize(['gc-io-rate'],
+                                   'with --gc-daemon, remove at most SIZE '
+                                   'bytes of artifacts per second, so as not '
+                                   'to slow down builds using the same disk '
+                                   '(default: %default, meaning no limit)',
+                                   metavar='SIZE',
+                                   group="Storage Options",
+                                   default='0')
+        self.app.settings.bytesize(['remote-lookups-max-size'],
+                                   'keep at most SIZE of the answers saved '
+                                   'from the git resolve cache server, '
+                                   'removing the least recently used first '
+                                   '(default: %default)',
+                                   metavar='SIZE',
+                                   group="Storage Options",
+                                   default='256M')
 
     def disable(self):
         pass
@@ -56,16 +93,37 @@ class GCPlugin(cliapp.Plugin):
 
            It may delete artifacts older than
            --cachedir-artifact-keep-younger-than if it still needs to make
-           space.
+           space. Which of those are deleted is decided by
+           --cachedir-eviction-policy, using the size of each source's
+           artifacts, when they were last used and how long they took to
+           build. Enough are chosen to free --cachedir-min-space at once.
 
            It also removes any left over temporary chunks and staging areas
-           from failed builds.
+           from failed builds, and the least recently used answers saved
+           from the git resolve cache server beyond
+           --remote-lookups-max-size.
+
+           Artifacts that running builds and deployments have pinned are
+           never deleted, so it is safe to run this while they run.
 
            In addition we remove failed deployments, generally these are
            cleared up by morph during deployment but in some cases they
            won't be e.g. if morph gets a SIGKILL or the machine running
            morph loses power.
 
+           Artifacts are found using the index in cachedir/artifact-index.
+           If files are added to or removed from the artifact cache by
+           other means, delete that directory and it will be rebuilt.
+
+           With --gc-daemon, this keeps running and checks the free space
+           every --gc-interval seconds, removing artifacts at no more than
+           --gc-io-rate bytes per second. In this mode left over chunks and
+           deployments in tempdir are not removed, since they may belong
+           to builds running at the time. After each check it writes what
+           it has done to cachedir/gc-metrics.json. A distbuild worker
+           running this can set worker-build-gc to false, so that builds
+           do not run gc themselves.
+
         '''
 
         tempdir = self.app.settings['tempdir']
@@ -75,10 +133,61 @@ class GCPlugin(cliapp.Plugin):
                 tempdir, self.app.settings['tempdir-min-space'],
                 cachedir, self.app.settings['cachedir-min-space'])
 
+        if self.app.settings['gc-daemon']:
+            self.run_daemon(tempdir, tempdir_min_space,
+                            cachedir, cachedir_min_space)
+            return
+
         self.cleanup_tempdir(tempdir, tempdir_min_space)
         self.cleanup_cachedir(cachedir, cachedir_min_space)
-        
-    def cleanup_tempdir(self, temp_path, min_space):
+        self.cleanup_remote_lookups(cachedir)
+
+    def run_daemon(self, tempdir, tempdir_min_space,
+                   cachedir, cachedir_min_space):  # pragma: no cover
+        interval = self.app.settings['gc-interval']
+        io_rate = self.app.settings['gc-io-rate']
+        metrics_path = os.path.join(cachedir, 'gc-metrics.json')
+        metrics = {
+            'started': time.time(),
+            'runs': 0,
+            'sources-removed': 0,
+            'bytes-removed': 0,
+        }
+        self.app.status(msg='Checking for free space every %(interval)d '
+                            'seconds', interval=interval)
+        last_lookups_cleanup = 0
+        while True:
+            # Saved lookups are many small files, so are not checked for
+            # on every run.
+            if time.time() - last_lookups_cleanup >= 60 * 60:
+                self.cleanup_remote_lookups(cachedir)
+                last_lookups_cleanup = time.time()
+            self.cleanup_tempdir(tempdir, tempdir_min_space,
+                                 remove_subdirs=False)
+            removed = self.cleanup_cachedir(cachedir, cachedir_min_space,
+                                            io_rate=io_rate)
+            metrics['runs'] += 1
+            metrics['sources-removed'] += len(removed)
+            metrics['bytes-removed'] += sum(s.size for s in removed)
+            metrics['last-run'] = time.time()
+            metrics['tempdir-free'] = \
+                morphlib.util.get_bytes_free_in_path(tempdir)
+            metrics['cachedir-free'] = \
+                morphlib.util.get_bytes_free_in_path(cachedir)
+            with morphlib.savefile.SaveFile(metrics_path, 'w') as f:
+                json.dump(metrics, f, indent=4, sort_keys=True)
+                f.write('\n')
+            time.sleep(interval)
+
+    def cleanup_remote_lookups(self, cache_path):
+        lookups_dir = os.path.join(cache_path, 'gits', 'remote-lookups')
+        removed = morphlib.repocache.prune_saved_responses(
+            lookups_dir, self.app.settings['remote-lookups-max-size'])
+        if removed:
+            self.app.status(msg='Removed %(count)d saved remote lookups',
+                            count=removed, chatty=True)
+
+    def cleanup_tempdir(self, temp_path, min_space, remove_subdirs=True):
         # The subdirectories in tempdir are created at Morph startup time. Code
         # assumes that they exist in various places.
         self.app.status(msg='Cleaning up temp dir %(temp_path)s',
@@ -108,6 +217,8 @@ class GCPlugin(cliapp.Plugin):
                 if fd is not None:
                     os.close(fd)
 
+        if not remove_subdirs:
+            return
         for subdir in ('deployments', 'chunks'):
             if morphlib.util.get_bytes_free_in_path(temp_path) >= min_space:
                 self.app.status(msg='Not Removing subdirectory '
@@ -130,68 +241,96 @@ class GCPlugin(cliapp.Plugin):
             now - self.app.settings['cachedir-artifact-keep-younger-than']
         return always_delete_age, may_delete_age
 
-    def find_deletable_artifacts(self, lac, max_age, min_age):
-        '''Get a list of cache keys in order of how old they are.'''
-        contents = list(lac.list_contents())
-        always = set(cachekey
-                     for cachekey, artifacts, mtime in contents
-                     if mtime < max_age)
-        maybe = ((cachekey, mtime)
-                 for cachekey, artifacts, mtime in contents
-                 if max_age <= mtime < min_age)
-        return always, [cachekey for cachekey, mtime
-                        in sorted(maybe, key=lambda x: x[1])]
-
-    def cleanup_cachedir(self, cache_path, min_space):
-        def sufficient_free():
-            free = morphlib.util.get_bytes_free_in_path(cache_path)
-            return (free >= min_space)
-        if sufficient_free():
+    def find_deletable_sources(self, sources, max_age, min_age):
+        '''Split cached sources by how old they are.
+
+        Returns the sources that must be removed, because they were last
+        used before max_age, and those that may be removed because they
+        were last used before min_age.
+
+        '''
+        always = [s for s in sources if s.last_used < max_age]
+        maybe = [s for s in sources if max_age <= s.last_used < min_age]
+        return always, maybe
+
+    def remove_sources(self, lac, sources, io_rate=0):
+        '''Remove sources from the cache, unless they have been pinned.
+
+        If io_rate is set, sleep between sources so that no more than
+        io_rate bytes are removed per second. Returns the sources that
+        were removed.
+
+        '''
+        if not io_rate:
+            removed = set(lac.remove_unpinned(s.cachekey for s in sources))
+            return [s for s in sources if s.cachekey in removed]
+
+        removed = []
+        start = time.time()
+        removed_bytes = 0
+        for source in sources:
+            if lac.remove_unpinned([source.cachekey]):
+                removed.append(source)
+                removed_bytes += source.size
+            delay = start + removed_bytes / float(io_rate) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        return removed
+
+    def cleanup_cachedir(self, cache_path, min_space, io_rate=0):
+        '''Remove artifacts until cache_path has min_space bytes free.
+
+        Returns the list of sources removed.
+
+        '''
+        free = morphlib.util.get_bytes_free_in_path(cache_path)
+        if free >= min_space:
             self.app.status(msg='Not cleaning up cachedir, '
                                 'sufficient space already cleared',
                             chatty=True)
-            return
-        lac = morphlib.localartifactcache.LocalArtifactCache(
-            fs.osfs.OSFS(os.path.join(cache_path, 'artifacts')))
+            return []
+        lac = morphlib.util.new_local_artifact_cache(cache_path)
+        policy = morphlib.cacheeviction.policies[
+            self.app.settings['cachedir-eviction-policy']]()
         max_age, min_age = self.calculate_delete_range()
         logging.debug('Must remove artifacts older than timestamp %d'
                       % max_age)
-        always_delete, may_delete = \
-            self.find_deletable_artifacts(lac, max_age, min_age)
-        removed = 0
-        source_count = len(always_delete) + len(may_delete)
-        logging.debug('Must remove artifacts %s' % repr(always_delete))
-        logging.debug('Can remove artifacts %s' % repr(may_delete))
-
-        # Remove all old artifacts
-        for cachekey in always_delete:
-            self.app.status(msg='Removing source %(cachekey)s',
-                            cachekey=cachekey, chatty=True)
-            lac.remove(cachekey)
-            removed += 1
-
-        # Maybe remove remaining middle-aged artifacts
-        for cachekey in may_delete:
-            if sufficient_free():
-                self.app.status(msg='Finished cleaning up cachedir with '
-                                    '%(remaining)d old sources remaining',
-                                remaining=(source_count - removed),
-                                chatty=True)
-                break
-            self.app.status(msg='Removing source %(cachekey)s',
-                            cachekey=cachekey, chatty=True)
-            lac.remove(cachekey)
-            removed += 1
+        # Sources pinned by running builds and deployments are left alone.
+        pinned = lac.pinned()
+        sources = [s for s in morphlib.cacheeviction.cached_sources(lac)
+                   if s.cachekey not in pinned]
+        always_delete, may_delete = self.find_deletable_sources(
+            sources, max_age, min_age)
+        logging.debug('Must remove artifacts %s' %
+                      repr([s.cachekey for s in always_delete]))
+        logging.debug('Can remove artifacts %s' %
+                      repr([s.cachekey for s in may_delete]))
+
+        # Work out everything to remove up front, from the sizes in the
+        # index, rather than checking the free space after each removal.
+        bytes_needed = min_space - free - sum(s.size for s in always_delete)
+        chosen, freed = morphlib.cacheeviction.plan_eviction(
+            may_delete, bytes_needed, policy)
+        to_remove = always_delete + chosen
+        self.app.status(msg='Removing %(count)d sources using '
+                            '%(size)s bytes from %(cache_path)s',
+                        count=len(to_remove), cache_path=cache_path,
+                        size=sum(s.size for s in to_remove), chatty=True)
+        # Anything pinned since is still kept.
+        removed = self.remove_sources(lac, to_remove, io_rate)
 
-        if sufficient_free():
+        if morphlib.util.get_bytes_free_in_path(cache_path) >= min_space:
             self.app.status(msg='Made sufficient space in %(cache_path)s '
-                                'after removing %(removed)d sources',
-                            removed=removed, cache_path=cache_path)
-            return
+                                'after removing %(removed)d sources, with '
+                                '%(remaining)d old sources remaining',
+                            removed=len(removed), cache_path=cache_path,
+                            remaining=len(may_delete) - len(chosen))
+            return removed
         self.app.status(msg='Unable to clear enough space in %(cache_path)s '
                             'after removing %(removed)d sources. Please '
                             'reduce cachedir-artifact-keep-younger-than, '
                             'clear space from elsewhere, enlarge the disk '
                             'or reduce cachedir-min-space.',
-                        cache_path=cache_path, removed=removed,
+                        cache_path=cache_path, removed=len(removed),
                         error=True)
+        return removed
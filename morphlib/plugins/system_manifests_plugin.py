@@ -15,7 +15,6 @@
 
 import csv
 import glob
-import inspect
 import json
 import os
 import shutil
@@ -42,6 +41,13 @@ class SystemManifestsPlugin(cliapp.Plugin):
                                  'two methods, respectively. Defaults to '
                                  'all-files, although this is much slower.',
                                  group='generate-manifest-csv options')
+        self.app.settings.integer(['license-check-jobs'],
+                                  'how many licensecheck processes to run '
+                                  'at once when checking all files '
+                                  '(default: number of CPUs)',
+                                  metavar='N',
+                                  default=morphlib.util.cpu_count(),
+                                  group='generate-manifest-csv options')
 
     def disable(self):
         pass
@@ -66,7 +72,11 @@ class SystemManifestsPlugin(cliapp.Plugin):
         Note that this command is pretty slow, even with --check-license set
         to single-file it will take about half an hour to generate a manifest
         for a build-system. With --check-license set to all-files (the default)
-        it will take a long time.
+        it will take a long time, although licences found are remembered by
+        the contents of the file, in the license-cache directory of the
+        cache directory, so files that have not changed since the last
+        manifest are not checked again. Files which can't hold a licence,
+        such as images, archives and other binary files, are skipped.
 
         You pass it a list of systems to generate manifests for.
 
@@ -136,8 +146,12 @@ class SystemManifestsPlugin(cliapp.Plugin):
             lorries = get_lorry_repos(td, self.repo_cache, self.app.status,
                                       trove_id,
                                       self.app.settings['trove-host'])
+            cache = morphlib.licensescan.LicenseCache(
+                os.path.join(self.app.settings['cachedir'], 'license-cache'))
+            scanner = morphlib.licensescan.LicenseScanner(
+                cache, jobs=self.app.settings['license-check-jobs'])
             manifest = Manifest(system_artifact.name, td, self.app.status,
-                                self.repo_cache)
+                                self.repo_cache, scanner)
 
             old_prefix = self.app.status_prefix
             sources = set(a.source for a in system_artifact.walk()
@@ -159,16 +173,6 @@ class SystemManifestsPlugin(cliapp.Plugin):
             self.app.status_prefix = old_prefix
 
 
-def run_licensecheck(filename):
-    morphlib_dirname = os.path.dirname(inspect.getfile(morphlib))
-    licensecheck_path = os.path.join(morphlib_dirname, 'licensecheck.pl')
-    output = cliapp.runcmd(['perl', licensecheck_path, '-l',
-                            '500', filename])
-    if not output:
-        return 'UNKNOWN'
-    else:
-        return output[len(filename) + 2:].strip()
-
 def checkout_repo(repo_cache, repo, dest, ref='master'):
     cached = repo_cache.get_updated_repo(repo, ref)
     if not os.path.exists(dest):
@@ -201,7 +205,7 @@ def get_lorry_for_chunk(chunk_url, lorries):
         if chunk_name in lorry:
             return lorry[chunk_name]
 
-def get_main_license(dir): # pragma: no cover
+def get_main_license(dir, scanner): # pragma: no cover
     license = 'UNKNOWN'
     if os.path.exists(os.path.join(dir, 'COPYING')):
         license_file = os.path.join(dir, 'COPYING')
@@ -209,18 +213,16 @@ def get_main_license(dir): # pragma: no cover
         license_file = os.path.join(dir, 'LICENSE')
     else:
         return license
-    return run_licensecheck(license_file)
+    return scanner.scan([license_file]).get(license_file, license)
 
-def get_all_licenses(dir): # pragma: no cover
+def get_all_licenses(dir, scanner): # pragma: no cover
+    filenames = morphlib.licensescan.find_files_to_scan(dir)
+    licenses = scanner.scan(filenames)
     license_list = []
-    for dirpath, dirname, filenames in os.walk(dir):
-        for filename in filenames:
-            try:
-                license = run_licensecheck(os.path.join(dirpath, filename))
-            except cliapp.AppException:
-                continue
-            if not license in license_list:
-                license_list.append(license)
+    for filename in filenames:
+        license = licenses.get(filename)
+        if license is not None and not license in license_list:
+            license_list.append(license)
     return license_list
 
 def get_upstream_address(chunk_url, lorries, status):
@@ -270,10 +272,12 @@ def get_lorry_repos(tempdir, repo_cache, status, trove_id, trove_host):
 class Manifest(object):
     """Writes out a manifest of what's included in a system."""
 
-    def __init__(self, system_name, tempdir, status_cb, repo_cache):
+    def __init__(self, system_name, tempdir, status_cb, repo_cache,
+                 scanner):
         self.tempdir = tempdir
         self.status = status_cb
         self.repo_cache = repo_cache
+        self.scanner = scanner
         path = os.path.join(os.getcwd(), system_name + '-manifest.csv')
         self.status(msg='Creating %(path)s', path=path)
         self.file = open(path, 'wb')
@@ -299,9 +303,9 @@ class Manifest(object):
             gd.update_submodules(app)
 
             self.status(msg='Getting license info', chatty=True)
-            license = get_main_license(dir)
+            license = get_main_license(dir, self.scanner)
             if app.settings['check-license'] == 'all-files':
-                license_list = get_all_licenses(dir)
+                license_list = get_all_licenses(dir, self.scanner)
             else:
                 self.status(msg='WARNING: Not looking at individual file '
                                 'licenses as check-license was not set to '
@@ -0,0 +1,135 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import morphlib
+
+
+def ref_state(tips):
+    '''Return a string that changes whenever any branch or tag moves.'''
+
+    state = hashlib.sha1()
+    for refname, sha1 in sorted(tips.iteritems()):
+        state.update('%s %s\n' % (refname, sha1))
+    return state.hexdigest()
+
+
+class RefAnchors(object):
+
+    '''Which commits in which repositories a branch or tag keeps alive.
+
+    A commit that no branch or tag contains may be removed by `git gc`,
+    so can't be relied on to build from again. Finding which branches and
+    tags contain a commit means walking history, which is slow for big
+    repositories, so the answers are remembered in `filename`.
+
+    A commit found in a branch or tag is remembered with the commit the
+    branch or tag pointed to, preferring tags, which seldom move. History
+    does not change, so while any branch or tag still points to that
+    commit, the commit is still anchored. A commit found in no branch or
+    tag is remembered with the state of all the repository's branches and
+    tags, and is checked again once any of them move.
+
+    One RefAnchors may be used from several threads at once.
+
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._repos = self._load()
+        self._dirty = set()
+
+    def _load(self):
+        try:
+            with open(self.filename) as f:
+                return json.load(f)
+        except IOError:
+            return {}
+        except ValueError:  # pragma: no cover
+            logging.warning('Ignoring corrupt anchor cache %s', self.filename)
+            return {}
+
+    def _remember(self, repo_name, kind, sha1, value):
+        with self._lock:
+            repo = self._repos.setdefault(
+                repo_name, {'anchored': {}, 'unanchored': {}})
+            repo[kind][sha1] = value
+            self._dirty.add(repo_name)
+
+    def _recall(self, repo_name, kind, sha1):
+        with self._lock:
+            return self._repos.get(repo_name, {}).get(kind, {}).get(sha1)
+
+    def find_unanchored(self, repo_name, gitdir, sha1s):
+        '''Return which of the given commits no branch or tag contains.
+
+        `gitdir` is a GitDirectory for the repository `repo_name`, which
+        must have all the commits in it.
+
+        '''
+
+        tips = gitdir.ref_tips()
+        tip_commits = set(tips.itervalues())
+        state = ref_state(tips)
+
+        unanchored = []
+        for sha1 in sha1s:
+            if sha1 in tip_commits:
+                continue
+            anchor = self._recall(repo_name, 'anchored', sha1)
+            if anchor in tip_commits:
+                continue
+            if self._recall(repo_name, 'unanchored', sha1) == state:
+                unanchored.append(sha1)
+                continue
+
+            logging.debug('Looking for refs containing %s in %s',
+                          sha1, repo_name)
+            refs = [ref for ref in gitdir.refs_containing_sha1(sha1)
+                    if ref in tips]
+            if refs:
+                # Tags seldom move, so are the better anchor to remember.
+                refs.sort(key=lambda ref: not ref.startswith('refs/tags/'))
+                self._remember(repo_name, 'anchored', sha1, tips[refs[0]])
+            else:
+                self._remember(repo_name, 'unanchored', sha1, state)
+                unanchored.append(sha1)
+        return unanchored
+
+    def save(self):
+        '''Write out what was found, merged with what is already saved.'''
+
+        with self._lock:
+            if not self._dirty:
+                return
+            repos = self._load()
+            for repo_name in self._dirty:
+                repo = repos.setdefault(
+                    repo_name, {'anchored': {}, 'unanchored': {}})
+                for kind in ('anchored', 'unanchored'):
+                    repo[kind].update(self._repos[repo_name][kind])
+            dirname = os.path.dirname(self.filename)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            with morphlib.savefile.SaveFile(self.filename, 'w') as f:
+                json.dump(repos, f, indent=4, sort_keys=True)
+            self._repos = repos
+            self._dirty.clear()
@@ -0,0 +1,95 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import morphlib
+
+
+class CountingGitDirectory(morphlib.gitdir.GitDirectory):
+
+    def __init__(self, dirname):
+        morphlib.gitdir.GitDirectory.__init__(self, dirname)
+        self.searched = []
+
+    def refs_containing_sha1(self, ref):
+        self.searched.append(ref)
+        return morphlib.gitdir.GitDirectory.refs_containing_sha1(self, ref)
+
+
+class RefAnchorsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.dirname = os.path.join(self.tempdir, 'repo')
+        os.mkdir(self.dirname)
+        self.gd = morphlib.gitdir.init(self.dirname)
+        self.first = self.commit('first')
+        self.second = self.commit('second')
+        self.filename = os.path.join(self.tempdir, 'cache', 'anchors.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def git(self, *args):
+        return morphlib.git.gitcmd(self.gd._runcmd, *args).strip()
+
+    def commit(self, message):
+        self.git('commit', '--allow-empty', '-m', message)
+        return self.git('rev-parse', 'HEAD')
+
+    def find_unanchored(self, sha1s):
+        anchors = morphlib.refanchors.RefAnchors(self.filename)
+        gd = CountingGitDirectory(self.dirname)
+        unanchored = anchors.find_unanchored('repo', gd, sha1s)
+        anchors.save()
+        return unanchored, gd.searched
+
+    def test_commits_in_branches_are_anchored(self):
+        self.assertEqual(self.find_unanchored([self.first, self.second]),
+                         ([], [self.first]))
+
+    def test_remembers_anchored_commits(self):
+        self.git('tag', 'v1', self.first)
+        self.find_unanchored([self.first])
+        self.commit('third')
+        self.assertEqual(self.find_unanchored([self.first]), ([], []))
+
+    def test_checks_again_when_anchoring_branch_moves(self):
+        self.find_unanchored([self.first])
+        self.commit('third')
+        self.assertEqual(self.find_unanchored([self.first]),
+                         ([], [self.first]))
+
+    def test_remembers_unanchored_commits_until_refs_move(self):
+        self.git('reset', '--hard', self.first)
+        self.assertEqual(self.find_unanchored([self.second]),
+                         ([self.second], [self.second]))
+        self.assertEqual(self.find_unanchored([self.second]),
+                         ([self.second], []))
+
+        self.git('tag', 'keep', self.second)
+        self.assertEqual(self.find_unanchored([self.second]), ([], []))
+
+    def test_checks_again_when_anchoring_ref_is_gone(self):
+        self.git('tag', 'keep', self.second)
+        self.git('reset', '--hard', self.first)
+        self.find_unanchored([self.first, self.second])
+        self.git('tag', '-d', 'keep')
+        self.assertEqual(self.find_unanchored([self.second]),
+                         ([self.second], [self.second]))
@@ -16,12 +16,19 @@
 import cliapp
 import fs.osfs
 
+import errno
+import fcntl
+import hashlib
+import httplib
 import json
 import logging
 import os
+import pylru
+import shutil
 import string
 import sys
 import tempfile
+import threading
 import urllib2
 import urlparse
 import urllib
@@ -79,6 +86,58 @@ class UpdateError(cliapp.AppException):  # pragma: no cover
             self, 'Failed to update cached version of repo %s' % repo)
 
 
+class RepoLock(object):
+    '''An exclusive lock on a cached repository, shared between processes.
+
+    The lock file also counts how many times the repository has been
+    cloned or updated. If another process held the lock when we asked for
+    it, `fetched_while_waiting` tells us whether that process fetched the
+    repository in the meantime, in which case there is no point in
+    fetching it again straight away.
+
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fetched_while_waiting = False
+        self._file = None
+
+    def _generation(self):
+        self._file.seek(0)
+        try:
+            return int(self._file.read().strip() or 0)
+        except ValueError:  # pragma: no cover
+            return 0
+
+    def __enter__(self):
+        self._file = open(self.filename, 'a+')
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise  # pragma: no cover
+            before = self._generation()
+            logging.debug('Waiting for another process to release %s',
+                          self.filename)
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            self.fetched_while_waiting = self._generation() != before
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+    def record_fetch(self):
+        '''Record that the repository was just cloned or updated.'''
+
+        generation = self._generation() + 1
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write('%d\n' % generation)
+        self._file.flush()
+
+
 class CachedRepo(morphlib.gitdir.GitDirectory):
     '''A locally cached Git repository with an origin remote set up.
 
@@ -118,8 +177,18 @@ class RepoCache(object):
     created.
 
     Instead of cloning via a normal 'git clone' directly from the
-    git server, we first try to download a tarball from a url, and
-    if that works, we unpack the tarball.
+    git server, we first try to download a git bundle from the
+    'morph-cache-server', and then a tarball from a url. If either of
+    those works, we only need to fetch whatever has changed since it was
+    made.
+
+    If 'shallow' is set, a repo that is only needed at a single SHA1 is
+    cached by fetching just that commit, without its history. Later
+    updates fetch only what they need on top of it, and the rest of its
+    history is fetched when something asks for the full history. Sources
+    checked out for a build are copied from the shallow repo, so a build
+    that looks through the history, with `git describe` for example, sees
+    only that commit.
 
     Certain questions about a repo can be resolved without cloning the whole
     thing, if an instance of 'morph-cache-server' is available on the remote
@@ -132,10 +201,15 @@ class RepoCache(object):
     to override where 'cachedir' is stored. This should probably only be used
     for testing.
 
+    Repositories may be updated from several threads, and several morph
+    processes, at once. Only one of them at a time clones or updates any
+    one repository, and the others wait for it and use its result instead
+    of fetching the repository again.
+
     '''
     def __init__(self, cachedir, resolver, tarball_base_url=None,
                  git_resolve_cache_url=None,
-                 update_gits=True,
+                 update_gits=True, shallow=False,
                  runcmd_cb=cliapp.runcmd, status_cb=lambda **kwargs: None,
                  verbose=False, debug=False,
                  custom_fs=None):
@@ -149,18 +223,27 @@ class RepoCache(object):
             tarball_base_url += '/'
         self._tarball_base_url = tarball_base_url
         self._cached_repo_objects = {}
+        self._repo_locks = {}
+        self._repo_locks_lock = threading.Lock()
 
         # Corresponds to the app 'no-git-update' setting
         self.update_gits = update_gits
+        # Corresponds to the app 'shallow-git-cache' setting
+        self.shallow = shallow
 
         self.runcmd_cb = runcmd_cb
         self.status_cb = status_cb
         self.verbose = verbose
         self.debug = debug
 
+        self._bundle_server_url = git_resolve_cache_url
+        # Set once the cache server fails to give a bundle because it is
+        # not working, so it is not asked for one for every other repo too.
+        self._bundles_failed = False
         if git_resolve_cache_url:  # pragma: no cover
-            self.remote_cache = RemoteRepoCache(git_resolve_cache_url,
-                                                resolver)
+            self.remote_cache = RemoteRepoCache(
+                git_resolve_cache_url, resolver,
+                cache_dir=os.path.join(cachedir, 'remote-lookups'))
         else:
             self.remote_cache = None
 
@@ -197,6 +280,24 @@ class RepoCache(object):
                        ['tar', '--no-same-owner', '-xf', '-'],
                        cwd=path, **kwargs)
 
+    def _fetch_bundle(self, url, filename):  # pragma: no cover
+        '''Download a git bundle into a file.
+
+        This method is meant to be overridden by unit tests.
+
+        '''
+        self.status_cb(msg="Trying to fetch %(bundle)s to seed the cache",
+                       bundle=url, chatty=True)
+
+        # Not wget, so that a server with no bundle for this repo can be
+        # told apart from one that is not working.
+        remote = urllib2.urlopen(url)
+        try:
+            with open(filename, 'wb') as f:
+                shutil.copyfileobj(remote, f, 1024 * 1024)
+        finally:
+            remote.close()
+
     def _mkdtemp(self, dirname):  # pragma: no cover
         '''Creates a temporary directory.
 
@@ -245,19 +346,108 @@ class RepoCache(object):
 
         return True, None
 
+    def _clone_with_bundle(self, repourl, path):
+        server_url = self._bundle_server_url
+        if not server_url.endswith('/'):
+            server_url += '/'
+        bundle_url = urlparse.urljoin(
+            server_url, '/1.0/bundles?repo=%s' % urllib.quote(repourl))
+
+        target = self._mkdtemp(self.cachedir)
+        bundle = target + '.bndl'
+        try:
+            try:
+                self._fetch_bundle(bundle_url, bundle)
+            except urllib2.HTTPError as e:
+                if e.code >= 500:
+                    self._stop_asking_for_bundles(e)
+                raise
+            except (IOError, httplib.HTTPException) as e:
+                self._stop_asking_for_bundles(e)
+                raise
+            self._git(['clone', '--mirror', '-n', bundle, target],
+                      echo_stderr=self.debug)
+            self._git(['config', 'remote.origin.url', repourl], cwd=target)
+            self._git(['config', 'remote.origin.mirror', 'true'], cwd=target)
+            self._git(['config', 'remote.origin.fetch', '+refs/*:refs/*'],
+                      cwd=target)
+        except BaseException as e:
+            if self.fs.exists(target):
+                self.fs.removedir(target, force=True)
+            return False, 'Unable to clone from bundle %s: %s' % (
+                bundle_url, e)
+        finally:
+            if self.fs.exists(bundle):
+                self.fs.remove(bundle)
+
+        self.fs.rename(target, path)
+        return True, None
+
+    def _stop_asking_for_bundles(self, error):
+        # The server has no bundle of some repos, which isn't a reason to
+        # stop asking it for bundles of others, but if it isn't working
+        # asking again would only slow down cloning every other repo.
+        logging.warning('Not asking %s for bundles again: %s',
+                        self._bundle_server_url, error)
+        self._bundles_failed = True
+
+    def _clone_shallow(self, repourl, path, sha1):
+        target = self._mkdtemp(self.cachedir)
+        try:
+            self._git(['init', '--bare', target])
+            self._git(['config', 'remote.origin.url', repourl], cwd=target)
+            self._git(['config', 'remote.origin.mirror', 'true'], cwd=target)
+            # Only branches and tags are mirrored, so that updating the
+            # remotes with --prune leaves alone the ref that keeps the
+            # commit we fetch, which may be on no branch or tag.
+            self._git(['config', 'remote.origin.fetch',
+                       '+refs/heads/*:refs/heads/*'], cwd=target)
+            self._git(['config', '--add', 'remote.origin.fetch',
+                       '+refs/tags/*:refs/tags/*'], cwd=target)
+            self._git(['fetch', '--depth=1', 'origin',
+                       '%s:refs/morph/shallow/%s' % (sha1, sha1)],
+                      cwd=target, echo_stderr=self.debug)
+        except BaseException as e:
+            if self.fs.exists(target):
+                self.fs.removedir(target, force=True)
+            return False, 'Unable to fetch %s from %s: %s' % (
+                sha1, repourl, e)
+
+        self.fs.rename(target, path)
+        return True, None
+
     def _new_cached_repo_instance(self, path, reponame, repourl):
         return CachedRepo(path, reponame, repourl)
 
-    def _cache_repo(self, reponame):
+    def _cache_repo(self, reponame, sha1=None):
         '''Clone the given repo into the cache.
 
-        If the repo is already cloned, do nothing.
+        If the repo is already cloned, do nothing. If 'sha1' is given and
+        shallow caching is enabled, only that commit is fetched.
 
         '''
         errors = []
 
         repourl = self._resolver.pull_url(reponame)
         path = self._cache_name(repourl)
+        if self.shallow and sha1 is not None:
+            ok, error = self._clone_shallow(repourl, path, sha1)
+            if ok:
+                repo = self._get_repo(reponame)
+                repo.already_updated = True
+                return repo
+            else:
+                errors.append(error)
+
+        if self._bundle_server_url and not self._bundles_failed:
+            ok, error = self._clone_with_bundle(repourl, path)
+            if ok:
+                repo = self._get_repo(reponame)
+                self._update_repo(repo)
+                return repo
+            else:
+                errors.append(error)
+
         if self._tarball_base_url:
             ok, error = self._clone_with_tarball(repourl, path)
             if ok:
@@ -286,7 +476,7 @@ class RepoCache(object):
         repo.already_updated = True
         return repo
 
-    def _get_repo(self, reponame):
+    def _get_repo(self, reponame, sha1=None):
         '''Return an object representing a cached repository.'''
 
         if reponame in self._cached_repo_objects:
@@ -299,7 +489,7 @@ class RepoCache(object):
                 self._cached_repo_objects[reponame] = repo
                 return repo
             elif self.update_gits:
-                return self._cache_repo(reponame)
+                return self._cache_repo(reponame, sha1=sha1)
             else:
                 raise NotCached(reponame)
 
@@ -311,16 +501,50 @@ class RepoCache(object):
         except cliapp.AppException:
             raise UpdateError(self)
 
+    def _is_shallow(self, cachedrepo):
+        return self.fs.exists(os.path.join(cachedrepo.dirname, 'shallow'))
+
+    def _unshallow(self, cachedrepo):
+        self.status_cb(msg='Fetching the history of %(repo_name)s',
+                       repo_name=cachedrepo.original_name)
+        try:
+            self._git(['fetch', '--unshallow', 'origin'],
+                      cwd=cachedrepo.dirname, echo_stderr=self.verbose)
+        except cliapp.AppException:  # pragma: no cover
+            raise UpdateError(self)
+
+    def _lock_for(self, repo_name):
+        path = self._cache_name(self._resolver.pull_url(repo_name))
+        with self._repo_locks_lock:
+            if path not in self._repo_locks:
+                self._repo_locks[path] = threading.Lock()
+            return self._repo_locks[path]
+
     def get_updated_repo(self, repo_name,
-                         ref=None, refs=None):
+                         ref=None, refs=None, full_history=False):
         '''Return object representing cached repository.
 
         If all the specified refs in 'ref' or 'refs' point to SHA1s that are
         already in the repository, or --no-git-update is set, then the
         repository won't be updated.
 
+        If 'full_history' is set, the repository is never left without the
+        history of its commits, even when shallow caching is enabled.
+
         '''
 
+        with self._lock_for(repo_name):
+            if not self.update_gits or not self.fs.hassyspath(self.cachedir):
+                return self._get_updated_repo(
+                    repo_name, ref, refs, None, full_history)
+            url = self._resolver.pull_url(repo_name)
+            filename = os.path.join(self.fs.getsyspath(self.cachedir),
+                                    '%s.lock' % self._escape(url))
+            with RepoLock(filename) as lock:
+                return self._get_updated_repo(
+                    repo_name, ref, refs, lock, full_history)
+
+    def _get_updated_repo(self, repo_name, ref, refs, lock, full_history):
         if not self.update_gits:
             self.status_cb(msg='Not updating existing git repository '
                                '%(repo_name)s '
@@ -336,6 +560,8 @@ class RepoCache(object):
 
         if self.has_repo(repo_name):
             repo = self._get_repo(repo_name)
+            if full_history and self._is_shallow(repo):
+                self._unshallow(repo)
             if refs:
                 required_refs = set(refs)
                 missing_refs = set()
@@ -356,6 +582,13 @@ class RepoCache(object):
                         sha1s=_word_join_list(tuple(required_refs)))
                     return repo
 
+            if lock is not None and lock.fetched_while_waiting:
+                self.status_cb(
+                    msg='Not updating git repository %(repo_name)s '
+                        'because another process has just updated it',
+                    chatty=True, repo_name=repo_name)
+                return repo
+
             if ref:
                 ref_str = 'ref %s' % ref
             else:
@@ -363,10 +596,17 @@ class RepoCache(object):
             self.status_cb(msg='Updating %(repo_name)s for %(ref_str)s',
                            repo_name=repo_name, ref_str=ref_str)
             self._update_repo(repo)
-            return repo
         else:
             self.status_cb(msg='Cloning %(repo_name)s', repo_name=repo_name)
-            return self._get_repo(repo_name)
+            sha1 = None
+            if (not full_history and len(refs) == 1 and
+                    morphlib.git.is_valid_sha1(refs[0])):
+                sha1 = refs[0]
+            repo = self._get_repo(repo_name, sha1=sha1)
+
+        if lock is not None:
+            lock.record_fetch()
+        return repo
 
     def ensure_submodules(self, toplevel_repo,
                           toplevel_ref, submodules={}):  # pragma: no cover
@@ -507,11 +747,59 @@ class RemoteLsTreeError(cliapp.AppException):
                   'cache' % (ref, repo_name))
 
 
+def prune_saved_responses(cache_dir, max_bytes):
+    '''Remove the least recently used responses saved by RemoteRepoCache.
+
+    Responses are removed until those left take up no more than
+    `max_bytes`. Returns the number removed.
+
+    '''
+
+    responses = []
+    for dirpath, subdirs, basenames in os.walk(cache_dir):
+        for basename in basenames:
+            filename = os.path.join(dirpath, basename)
+            try:
+                stinfo = os.stat(filename)
+            except OSError:  # pragma: no cover
+                continue
+            responses.append((stinfo.st_atime, stinfo.st_size, filename))
+
+    total = sum(size for atime, size, filename in responses)
+    removed = 0
+    for atime, size, filename in sorted(responses):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(filename)
+        except OSError:  # pragma: no cover
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
 class RemoteRepoCache(object):
 
-    def __init__(self, server_url, resolver):
+    '''Look up refs and files using a morph-cache-server.
+
+    The server marks responses that can never change, such as the contents
+    of a file at a given commit, as immutable. The most recent of those are
+    remembered in memory. If `cache_dir` is given, those no bigger than
+    `max_saved_size` are also saved there, so calculating a build graph
+    for the same commit again, even in a later run of morph, doesn't need
+    to ask the server for them. `morph gc` keeps the size of `cache_dir`
+    down with prune_saved_responses().
+
+    '''
+
+    def __init__(self, server_url, resolver, cache_dir=None,
+                 cache_size=4096, max_saved_size=64 * 1024):
         self.server_url = server_url
         self._resolver = resolver
+        self._cache_dir = cache_dir
+        self._max_saved_size = max_saved_size
+        self._responses = pylru.lrucache(cache_size)
 
     def resolve_ref(self, repo_name, ref):
         repo_url = self._resolver.pull_url(repo_name)
@@ -559,10 +847,46 @@ class RemoteRepoCache(object):
     def _quote_strings(self, *args):  # pragma: no cover
         return tuple(urllib.quote(string) for string in args)
 
-    def _make_request(self, path):  # pragma: no cover
+    def _saved_response_filename(self, path):
+        key = hashlib.sha1('%s %s' % (self.server_url, path)).hexdigest()
+        return os.path.join(self._cache_dir, key[:2], key)
+
+    def _load_response(self, path):
+        if self._cache_dir is None:
+            return None
+        try:
+            with open(self._saved_response_filename(path), 'rb') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def _save_response(self, path, data):
+        if self._cache_dir is None or len(data) > self._max_saved_size:
+            return
+        filename = self._saved_response_filename(path)
+        try:
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with morphlib.savefile.SaveFile(filename, 'wb') as f:
+                f.write(data)
+        except (IOError, OSError) as e:  # pragma: no cover
+            logging.warning('Could not save response for %s: %s', path, e)
+
+    def _make_request(self, path):
+        if path in self._responses:
+            return self._responses[path]
+        data = self._load_response(path)
+        if data is not None:
+            self._responses[path] = data
+            return data
         server_url = self.server_url
         if not server_url.endswith('/'):
             server_url += '/'
         url = urlparse.urljoin(server_url, '/1.0/%s' % path)
         handle = urllib2.urlopen(url)
-        return handle.read()
+        data = handle.read()
+        cache_control = handle.info().getheader('Cache-Control') or ''
+        if 'immutable' in cache_control:
+            self._responses[path] = data
+            self._save_response(path, data)
+        return data
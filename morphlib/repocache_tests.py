@@ -14,9 +14,16 @@
 
 
 import unittest
+import urllib
 import urllib2
 import json
+import logging
+import mimetools
 import os
+import shutil
+import StringIO
+import threading
+import time
 
 import cliapp
 import fs.memoryfs
@@ -31,14 +38,18 @@ class TestableRepoCache(morphlib.repocache.RepoCache):
 
     All Git operations are stubbed out. You can track what Git operations have
     taken place by looking at the 'remotes' dict -- any 'clone' operations will
-    set an entry in there. The 'tarballs_fetched' list tracks what tarballs
-    of Git repos would have been downloaded.
+    set an entry in there. The 'tarballs_fetched' and 'bundles_fetched'
+    lists track what tarballs and bundles of Git repos would have been
+    downloaded, 'shallow_fetches' what single commits were fetched, and
+    'unshallowed' which shallow repos had the rest of their history
+    fetched.
 
     There is a single repo alias, 'example' which expands to
     git://example.com/.
 
     '''
-    def __init__(self, update_gits=True):
+    def __init__(self, update_gits=True, shallow=False,
+                 git_resolve_cache_url=None):
         aliases = ['example=git://example.com/#example.com:%s.git']
         repo_resolver = morphlib.repoaliasresolver.RepoAliasResolver(aliases)
         tarball_base_url = 'http://lorry.example.com/tarballs'
@@ -47,10 +58,15 @@ class TestableRepoCache(morphlib.repocache.RepoCache):
 
         morphlib.repocache.RepoCache.__init__(
             self, cachedir, repo_resolver, tarball_base_url=tarball_base_url,
-            custom_fs=memoryfs, update_gits=update_gits)
+            custom_fs=memoryfs, update_gits=update_gits, shallow=shallow)
+        # Set after construction so no RemoteRepoCache is created.
+        self._bundle_server_url = git_resolve_cache_url
 
         self.remotes = {}
         self.tarballs_fetched = []
+        self.bundles_fetched = []
+        self.shallow_fetches = []
+        self.unshallowed = []
 
         self._mkdtemp_count = 0
 
@@ -63,6 +79,9 @@ class TestableRepoCache(morphlib.repocache.RepoCache):
     def _fetch(self, url, path):
         self.tarballs_fetched.append(url)
 
+    def _fetch_bundle(self, url, filename):
+        self.bundles_fetched.append(url)
+
     def _git(self, args, **kwargs):
         if args[0] == 'clone':
             assert len(args) == 5
@@ -70,6 +89,15 @@ class TestableRepoCache(morphlib.repocache.RepoCache):
             local = args[4]
             self.remotes['origin'] = {'url': remote, 'updates': 0}
             self.fs.makedir(local, recursive=True)
+        elif args[0:2] == ['init', '--bare']:
+            self.fs.makedir(args[2], recursive=True)
+        elif args[0:2] == ['fetch', '--unshallow']:
+            self.unshallowed.append(kwargs['cwd'])
+            self.fs.remove(os.path.join(kwargs['cwd'], 'shallow'))
+        elif args[0] == 'fetch':
+            sha1 = args[-1].split(':')[0]
+            self.shallow_fetches.append(sha1)
+            self.fs.setcontents(os.path.join(kwargs['cwd'], 'shallow'), sha1)
         elif args[0:2] == ['remote', 'set-url']:
             remote = args[2]
             url = args[3]
@@ -82,6 +110,8 @@ class TestableRepoCache(morphlib.repocache.RepoCache):
             remote = 'origin'
         elif args[0:2] == ['config', 'remote.origin.fetch']:
             remote = 'origin'
+        elif args[0:3] == ['config', '--add', 'remote.origin.fetch']:
+            remote = 'origin'
         else:
             raise NotImplementedError()
 
@@ -138,6 +168,126 @@ class RepoCacheTests(unittest.TestCase):
         # Check that the cache updated the repo after fetching the tarball.
         self.assertEqual(repo_cache.remotes['origin']['url'], repo_url)
 
+    def test_fetches_bundle_from_cache_server(self):
+        repo_url = 'git://example.com/reponame'
+        repo_cache = TestableRepoCache(
+            git_resolve_cache_url='http://cache.example.com:8080')
+
+        with morphlib.gitdir_tests.allow_nonexistant_git_repos():
+            repo_cache.get_updated_repo(repo_url, ref='master')
+
+        self.assertEqual(
+            repo_cache.bundles_fetched,
+            ['http://cache.example.com:8080/1.0/bundles?repo=%s' %
+             urllib.quote(repo_url)])
+        self.assertEqual(repo_cache.tarballs_fetched, [])
+        self.assertEqual(repo_cache.remotes['origin']['url'], repo_url)
+
+    def test_falls_back_to_tarball_without_bundle(self):
+        repo_cache = TestableRepoCache(
+            git_resolve_cache_url='http://cache.example.com:8080')
+
+        def no_bundle(*args, **kwargs):
+            raise cliapp.AppException('Not found')
+        repo_cache._fetch_bundle = no_bundle
+
+        with morphlib.gitdir_tests.allow_nonexistant_git_repos():
+            repo_cache.get_updated_repo('example:repo', ref='master')
+        self.assertEqual(len(repo_cache.tarballs_fetched), 1)
+
+    def get_two_repos_failing_bundles(self, error):
+        repo_cache = TestableRepoCache(
+            git_resolve_cache_url='http://cache.example.com:8080')
+
+        def no_bundle(url, filename):
+            repo_cache.bundles_fetched.append(url)
+            raise error
+        repo_cache._fetch_bundle = no_bundle
+
+        logging.disable(logging.WARNING)
+        try:
+            with morphlib.gitdir_tests.allow_nonexistant_git_repos():
+                repo_cache.get_updated_repo('example:repo', ref='master')
+                repo_cache.get_updated_repo('example:other', ref='master')
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(len(repo_cache.tarballs_fetched), 2)
+        return repo_cache
+
+    def test_keeps_asking_for_bundles_when_one_is_missing(self):
+        repo_cache = self.get_two_repos_failing_bundles(urllib2.HTTPError(
+            'http://cache.example.com:8080/', 404, 'Not Found', {}, None))
+        self.assertEqual(len(repo_cache.bundles_fetched), 2)
+
+    def test_stops_asking_for_bundles_after_server_error(self):
+        repo_cache = self.get_two_repos_failing_bundles(urllib2.HTTPError(
+            'http://cache.example.com:8080/', 503, 'Unavailable', {}, None))
+        self.assertEqual(len(repo_cache.bundles_fetched), 1)
+
+    def test_stops_asking_for_bundles_when_server_is_unreachable(self):
+        repo_cache = self.get_two_repos_failing_bundles(
+            urllib2.URLError('Connection refused'))
+        self.assertEqual(len(repo_cache.bundles_fetched), 1)
+
+    def test_fetches_single_commit_when_shallow(self):
+        sha1 = 'e28a23812eadf2fce6583b8819b9c5dbd36b9fb9'
+        repo_cache = TestableRepoCache(shallow=True)
+
+        with morphlib.gitdir_tests.allow_nonexistant_git_repos():
+            repo_cache.get_updated_repo('example:repo', ref=sha1)
+        self.assertEqual(repo_cache.shallow_fetches, [sha1])
+        self.assertEqual(repo_cache.tarballs_fetched, [])
+
+    def test_clones_whole_repo_for_named_ref_when_shallow(self):
+        repo_cache = TestableRepoCache(shallow=True)
+
+        with morphlib.gitdir_tests.allow_nonexistant_git_repos():
+            repo_cache.get_updated_repo('example:repo', ref='master')
+        self.assertEqual(repo_cache.shallow_fetches, [])
+        self.assertEqual(len(repo_cache.tarballs_fetched), 1)
+
+    def test_clones_whole_repo_for_full_history_when_shallow(self):
+        sha1 = 'e28a23812eadf2fce6583b8819b9c5dbd36b9fb9'
+        repo_cache = TestableRepoCache(shallow=True)
+
+        with morphlib.gitdir_tests.allow_nonexistant_git_repos():
+            repo_cache.get_updated_repo('example:repo', ref=sha1,
+                                        full_history=True)
+        self.assertEqual(repo_cache.shallow_fetches, [])
+        self.assertEqual(len(repo_cache.tarballs_fetched), 1)
+
+    def test_fetches_history_of_shallow_repo_when_asked(self):
+        sha1 = 'e28a23812eadf2fce6583b8819b9c5dbd36b9fb9'
+        repo_cache = TestableRepoCache(shallow=True)
+
+        with morphlib.gitdir_tests.allow_nonexistant_git_repos():
+            repo = repo_cache.get_updated_repo('example:repo', ref=sha1)
+            repo_cache.get_updated_repo('example:repo', ref='master')
+            self.assertEqual(repo_cache.unshallowed, [])
+            repo_cache.get_updated_repo('example:repo', ref='master',
+                                        full_history=True)
+            repo_cache.get_updated_repo('example:repo', ref='master',
+                                        full_history=True)
+        self.assertEqual(repo_cache.unshallowed, [repo.dirname])
+
+    def test_caches_repo_once_when_asked_from_two_threads(self):
+        repo_cache = TestableRepoCache()
+
+        def slow_fetch(url, path):
+            time.sleep(0.1)
+            repo_cache.tarballs_fetched.append(url)
+        repo_cache._fetch = slow_fetch
+
+        def get_repo():
+            repo_cache.get_updated_repo('example:repo', ref='master')
+        threads = [threading.Thread(target=get_repo) for i in range(2)]
+        with morphlib.gitdir_tests.allow_nonexistant_git_repos():
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(repo_cache.tarballs_fetched), 1)
+
     def test_escapes_repourl_as_filename(self):
         repo_cache = TestableRepoCache()
         escaped = repo_cache._escape('git://example.com/reponame')
@@ -164,6 +314,49 @@ class RepoCacheTests(unittest.TestCase):
             repo_cache.get_updated_repo('example:repo', ref='master')
 
 
+class RepoLockTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'repo.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_not_fetched_while_waiting_without_contention(self):
+        with morphlib.repocache.RepoLock(self.filename) as lock:
+            lock.record_fetch()
+        with morphlib.repocache.RepoLock(self.filename) as lock:
+            self.assertFalse(lock.fetched_while_waiting)
+
+    def test_notices_fetch_by_holder_while_waiting(self):
+        waiter = morphlib.repocache.RepoLock(self.filename)
+
+        def wait_for_lock():
+            with waiter:
+                pass
+        with morphlib.repocache.RepoLock(self.filename) as holder:
+            thread = threading.Thread(target=wait_for_lock)
+            thread.start()
+            time.sleep(0.1)
+            holder.record_fetch()
+        thread.join()
+        self.assertTrue(waiter.fetched_while_waiting)
+
+    def test_waiter_fetches_if_holder_did_not(self):
+        waiter = morphlib.repocache.RepoLock(self.filename)
+
+        def wait_for_lock():
+            with waiter:
+                pass
+        with morphlib.repocache.RepoLock(self.filename) as holder:
+            thread = threading.Thread(target=wait_for_lock)
+            thread.start()
+            time.sleep(0.1)
+        thread.join()
+        self.assertFalse(waiter.fetched_while_waiting)
+
+
 class RemoteRepoCacheTests(unittest.TestCase):
     def _resolve_ref_for_repo_url(self, repo_url, ref):
         return self.sha1s[repo_url][ref]
@@ -279,3 +472,89 @@ class RemoteRepoCacheTests(unittest.TestCase):
                           self.cache.ls_tree, 'non-existent-repo',
                           'e28a23812eadf2fce6583b8819b9c5dbd36b9fb9')
 
+
+class RemoteRepoCacheRequestTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = self.new_cache()
+        self.requests = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def new_cache(self):
+        resolver = morphlib.repoaliasresolver.RepoAliasResolver([])
+        return morphlib.repocache.RemoteRepoCache(
+            'http://foo.bar', resolver,
+            cache_dir=os.path.join(self.tempdir, 'lookups'))
+
+    def urlopen(self, url):
+        self.requests.append(url)
+        headers = mimetools.Message(StringIO.StringIO(
+            'Cache-Control: %s\n' % self.cache_control))
+        return urllib.addinfourl(StringIO.StringIO('response'), headers, url)
+
+    def make_request_twice(self):
+        with morphlib.gitdir_tests.monkeypatch(
+                urllib2, 'urlopen', self.urlopen):
+            self.assertEqual(self.cache._make_request('files?x'), 'response')
+            self.assertEqual(self.cache._make_request('files?x'), 'response')
+
+    def test_remembers_immutable_responses(self):
+        self.cache_control = 'public, max-age=31536000, immutable'
+        self.make_request_twice()
+        self.assertEqual(self.requests, ['http://foo.bar/1.0/files?x'])
+
+    def test_does_not_remember_other_responses(self):
+        self.cache_control = 'no-cache'
+        self.make_request_twice()
+        self.assertEqual(len(self.requests), 2)
+
+    def test_remembers_immutable_responses_between_runs(self):
+        self.cache_control = 'public, max-age=31536000, immutable'
+        self.make_request_twice()
+        self.cache = self.new_cache()
+        self.make_request_twice()
+        self.assertEqual(self.requests, ['http://foo.bar/1.0/files?x'])
+
+    def test_does_not_save_other_responses(self):
+        self.cache_control = 'no-cache'
+        self.make_request_twice()
+        self.cache = self.new_cache()
+        self.make_request_twice()
+        self.assertEqual(len(self.requests), 4)
+
+    def test_remembers_in_memory_without_cache_dir(self):
+        resolver = morphlib.repoaliasresolver.RepoAliasResolver([])
+        self.cache = morphlib.repocache.RemoteRepoCache(
+            'http://foo.bar', resolver)
+        self.cache_control = 'immutable'
+        self.make_request_twice()
+        self.assertEqual(len(self.requests), 1)
+
+    def test_does_not_save_large_responses(self):
+        self.cache_control = 'immutable'
+        self.cache._max_saved_size = len('response') - 1
+        self.make_request_twice()
+        self.cache = self.new_cache()
+        self.make_request_twice()
+        self.assertEqual(len(self.requests), 2)
+
+    def test_prunes_least_recently_used_saved_responses(self):
+        self.cache_control = 'immutable'
+        with morphlib.gitdir_tests.monkeypatch(
+                urllib2, 'urlopen', self.urlopen):
+            for i, path in enumerate(('files?a', 'files?b', 'files?c')):
+                self.cache._make_request(path)
+                filename = self.cache._saved_response_filename(path)
+                os.utime(filename, (1000 + i, 1000 + i))
+        lookups_dir = os.path.join(self.tempdir, 'lookups')
+
+        removed = morphlib.repocache.prune_saved_responses(
+            lookups_dir, 2 * len('response'))
+        self.assertEqual(removed, 1)
+        self.assertFalse(os.path.exists(
+            self.cache._saved_response_filename('files?a')))
+        self.assertTrue(os.path.exists(
+            self.cache._saved_response_filename('files?c')))
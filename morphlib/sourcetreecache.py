@@ -0,0 +1,161 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import cliapp
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+
+def tree_size(dirname):
+    '''Return the disk space used by the files in a directory tree.'''
+
+    total = 0
+    for dirpath, subdirs, basenames in os.walk(dirname):
+        for basename in subdirs + basenames:
+            total += os.lstat(os.path.join(dirpath, basename)).st_blocks * 512
+    return total
+
+
+class SourceTreeCache(object):
+
+    '''Source trees as extracted for chunk builds, ready to be used again.
+
+    Building the same commit of a chunk more than once, for example to
+    retry a failed build or to build for another architecture, can copy
+    the tree extracted by the first build instead of extracting it again.
+
+    Trees are copied with `cp --reflink=auto`. On filesystems that support
+    reflinks, such as btrfs and XFS, the copies share their data blocks
+    and cost next to nothing. On other filesystems each copy is a full one.
+
+    The trees take up at most `max_size` bytes. When a new tree would take
+    the cache over that limit, the trees used least recently are removed.
+
+    Several morph processes may use the same cache. Trees are renamed into
+    place once completely copied, and a lock file stops a tree from being
+    removed while it is being copied out.
+
+    '''
+
+    def __init__(self, dirname, max_size, runcmd=cliapp.runcmd):
+        self.dirname = dirname
+        self.max_size = max_size
+        self.runcmd = runcmd
+
+    @staticmethod
+    def key(repo_url, sha1, mode, submodules=None):
+        '''Return the key for a source tree.
+
+        The commits of any submodules are fixed by 'sha1', but their URLs
+        may be overridden by the 'submodules' field of the chunk spec.
+
+        '''
+
+        data = json.dumps([repo_url, sha1, mode, submodules or {}],
+                          sort_keys=True)
+        return hashlib.sha1(data).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.dirname, key)
+
+    def _size_filename(self, key):
+        return os.path.join(self.dirname, '%s.size' % key)
+
+    def _ensure_dir(self):
+        if not os.path.isdir(self.dirname):
+            os.makedirs(self.dirname)
+
+    @contextlib.contextmanager
+    def _locked(self, operation):
+        self._ensure_dir()
+        with open(os.path.join(self.dirname, '.lock'), 'a') as f:
+            fcntl.flock(f.fileno(), operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _copy(self, source_dir, target_dir):
+        if not os.path.isdir(target_dir):
+            os.makedirs(target_dir)
+        self.runcmd(['cp', '-a', '--reflink=auto',
+                     os.path.join(source_dir, '.'), target_dir])
+
+    def get(self, key, target_dir):
+        '''Copy a cached tree into target_dir.
+
+        Returns False if there is no tree for 'key'.
+
+        '''
+
+        with self._locked(fcntl.LOCK_SH):
+            if not os.path.isdir(self._path(key)):
+                return False
+            os.utime(self._size_filename(key), None)
+            self._copy(self._path(key), target_dir)
+        return True
+
+    def put(self, key, source_dir):
+        '''Copy the tree in source_dir into the cache.'''
+
+        size = tree_size(source_dir)
+        if size > self.max_size:
+            logging.debug('Not caching source tree %s of %d bytes', key, size)
+            return
+
+        self._ensure_dir()
+        tempdir = tempfile.mkdtemp(dir=self.dirname, prefix='.tmp.')
+        try:
+            self._copy(source_dir, tempdir)
+            with self._locked(fcntl.LOCK_EX):
+                if os.path.exists(self._path(key)):
+                    # Another process got there first.
+                    shutil.rmtree(tempdir)
+                    return
+                with open(self._size_filename(key), 'w') as f:
+                    f.write('%d\n' % size)
+                os.rename(tempdir, self._path(key))
+                self._prune()
+        except BaseException:
+            shutil.rmtree(tempdir, ignore_errors=True)
+            raise
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.dirname):
+            if not name.endswith('.size'):
+                continue
+            filename = os.path.join(self.dirname, name)
+            with open(filename) as f:
+                size = int(f.read().strip() or 0)
+            entries.append((os.path.getmtime(filename), name[:-5], size))
+        return entries
+
+    def _prune(self):
+        entries = sorted(self._entries())
+        total = sum(size for mtime, key, size in entries)
+        for mtime, key, size in entries:
+            if total <= self.max_size:
+                break
+            logging.debug('Removing source tree %s from cache', key)
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            os.remove(self._size_filename(key))
+            total -= size
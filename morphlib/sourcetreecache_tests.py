@@ -0,0 +1,100 @@
+# Copyright (C) 2026  Codethink Limited
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import morphlib
+
+
+class SourceTreeCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cachedir = os.path.join(self.tempdir, 'cache')
+        self.cache = morphlib.sourcetreecache.SourceTreeCache(
+            self.cachedir, 1024**2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def make_tree(self, name, contents):
+        dirname = os.path.join(self.tempdir, name)
+        os.makedirs(os.path.join(dirname, 'subdir'))
+        with open(os.path.join(dirname, 'subdir', 'file'), 'w') as f:
+            f.write(contents)
+        return dirname
+
+    def read_tree(self, dirname):
+        with open(os.path.join(dirname, 'subdir', 'file')) as f:
+            return f.read()
+
+    def test_key_depends_on_every_field(self):
+        key = morphlib.sourcetreecache.SourceTreeCache.key
+        keys = set([
+            key('git://example.com/foo', 'a' * 40, 'checkout'),
+            key('git://example.com/bar', 'a' * 40, 'checkout'),
+            key('git://example.com/foo', 'b' * 40, 'checkout'),
+            key('git://example.com/foo', 'a' * 40, 'export'),
+            key('git://example.com/foo', 'a' * 40, 'checkout',
+                {'sub': {'url': 'git://example.com/sub'}}),
+        ])
+        self.assertEqual(len(keys), 5)
+
+    def test_get_returns_false_for_unknown_tree(self):
+        target = os.path.join(self.tempdir, 'target')
+        self.assertFalse(self.cache.get('key', target))
+        self.assertFalse(os.path.exists(target))
+
+    def test_copies_cached_tree_out(self):
+        self.cache.put('key', self.make_tree('source', 'hello'))
+        target = os.path.join(self.tempdir, 'target')
+        self.assertTrue(self.cache.get('key', target))
+        self.assertEqual(self.read_tree(target), 'hello')
+
+    def test_cached_tree_is_a_copy(self):
+        source = self.make_tree('source', 'hello')
+        self.cache.put('key', source)
+        with open(os.path.join(source, 'subdir', 'file'), 'w') as f:
+            f.write('changed')
+        target = os.path.join(self.tempdir, 'target')
+        self.cache.get('key', target)
+        self.assertEqual(self.read_tree(target), 'hello')
+
+    def test_does_not_cache_tree_bigger_than_cache(self):
+        source = self.make_tree('source', 'x' * 2 * 1024**2)
+        self.cache.put('key', source)
+        target = os.path.join(self.tempdir, 'target')
+        self.assertFalse(self.cache.get('key', target))
+
+    def test_removes_least_recently_used_trees(self):
+        size = morphlib.sourcetreecache.tree_size(
+            self.make_tree('one', 'x' * 100 * 1024))
+        self.cache.max_size = size * 2
+        self.cache.put('one', os.path.join(self.tempdir, 'one'))
+        self.cache.put('two', self.make_tree('two', 'x' * 100 * 1024))
+
+        # Using 'one' makes 'two' the least recently used.
+        past = time.time() - 60
+        os.utime(os.path.join(self.cachedir, 'two.size'), (past, past))
+        self.cache.get('one', os.path.join(self.tempdir, 'target'))
+
+        self.cache.put('three', self.make_tree('three', 'x' * 100 * 1024))
+        self.assertTrue(os.path.isdir(os.path.join(self.cachedir, 'one')))
+        self.assertFalse(os.path.exists(os.path.join(self.cachedir, 'two')))
+        self.assertTrue(os.path.isdir(os.path.join(self.cachedir, 'three')))
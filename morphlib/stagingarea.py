@@ -26,6 +26,40 @@ import pipes
 import morphlib
 
 
+def unpack_chunk(app, handle):
+    '''Unpack a chunk artifact into the unpacked chunk store.
+
+    The store is the 'chunks' directory in tempdir, which staging areas
+    hardlink chunks from. If the chunk is already unpacked there, it is
+    not unpacked again. Returns the directory the chunk is unpacked in.
+
+    Several threads or processes may unpack the same chunk at once. Each
+    unpacks into its own temporary directory, and the first to finish
+    renames it into place.
+
+    '''
+
+    chunk_cache_dir = os.path.join(app.settings['tempdir'], 'chunks')
+    unpacked_artifact = os.path.join(
+        chunk_cache_dir, os.path.basename(handle.name) + '.d')
+    if not os.path.exists(unpacked_artifact):
+        app.status(
+            msg='Unpacking chunk from cache %(filename)s',
+            filename=os.path.basename(handle.name))
+        with morphlib.util.temp_dir(dir=chunk_cache_dir,
+                                    cleanup_on_success=False) as savedir:
+            morphlib.bins.unpack_binary_from_file(
+                handle, savedir + '/')
+        try:
+            os.rename(savedir, unpacked_artifact)
+        except OSError:
+            if not os.path.isdir(unpacked_artifact):
+                raise
+            # Someone else unpacked it first.
+            shutil.rmtree(savedir)
+    return unpacked_artifact
+
+
 class StagingArea(object):
 
     '''Represent the staging area for building software.
@@ -162,22 +196,7 @@ class StagingArea(object):
 
         '''
 
-        chunk_cache_dir = os.path.join(self._app.settings['tempdir'], 'chunks')
-        unpacked_artifact = os.path.join(
-            chunk_cache_dir, os.path.basename(handle.name) + '.d')
-        if not os.path.exists(unpacked_artifact):
-            self._app.status(
-                msg='Unpacking chunk from cache %(filename)s',
-                filename=os.path.basename(handle.name))
-            with morphlib.util.temp_dir(dir=chunk_cache_dir,
-                                        cleanup_on_success=False) as savedir:
-                morphlib.bins.unpack_binary_from_file(
-                    handle, savedir + '/')
-            # TODO: This rename is not concurrency safe if two builds are
-            #       extracting the same chunk, one build will fail because
-            #       the other renamed its tempdir here first.
-            os.rename(savedir, unpacked_artifact)
-
+        unpacked_artifact = unpack_chunk(self._app, handle)
         self.hardlink_all_files(unpacked_artifact, self.dirname)
 
     def remove(self):
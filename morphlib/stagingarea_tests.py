@@ -114,6 +114,17 @@ class StagingAreaTests(unittest.TestCase):
                                   self.sa.relative_destdir(),
                                   self.sa.relative_builddir()]))
 
+    def test_reuses_unpacked_chunk(self):
+        chunk_tar = self.create_chunk()
+        app = FakeApplication(self.cachedir, self.tempdir)
+        with open(chunk_tar, 'rb') as f:
+            unpacked = morphlib.stagingarea.unpack_chunk(app, f)
+        os.remove(os.path.join(unpacked, 'file.txt'))
+        with open(chunk_tar, 'rb') as f:
+            self.assertEqual(morphlib.stagingarea.unpack_chunk(app, f),
+                             unpacked)
+        self.assertEqual(os.listdir(unpacked), [])
+
     def test_removes_everything(self):
         chunk_tar = self.create_chunk()
         with open(chunk_tar, 'rb') as f:
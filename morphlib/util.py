@@ -17,6 +17,7 @@
 import contextlib
 import errno
 import itertools
+import multiprocessing.pool
 import os
 import pipes
 import re
@@ -24,6 +25,7 @@ import shutil
 import subprocess
 import textwrap
 import tempfile
+import threading
 import sys
 
 import fs.osfs
@@ -129,6 +131,24 @@ def get_git_resolve_cache_server(settings): # pragma: no cover
     return None
 
 
+def new_local_artifact_cache(cachedir):  # pragma: no cover
+    '''Create an indexed LocalArtifactCache for the artifacts in cachedir.
+
+    Artifacts in it can be pinned, so that gc leaves them alone.
+
+    '''
+
+    artifact_cachedir = os.path.join(cachedir, 'artifacts')
+    ensure_directory_exists(artifact_cachedir)
+
+    index = morphlib.artifactcacheindex.ArtifactCacheIndex(
+        os.path.join(cachedir, 'artifact-index'), artifact_cachedir)
+    pins = morphlib.artifactpins.ArtifactPins(
+        os.path.join(cachedir, 'artifact-pins'))
+    return morphlib.localartifactcache.LocalArtifactCache(
+        fs.osfs.OSFS(artifact_cachedir), index=index, pins=pins)
+
+
 def new_artifact_caches(settings):  # pragma: no cover
     '''Create new objects for local and remote artifact caches.
 
@@ -136,11 +156,7 @@ def new_artifact_caches(settings):  # pragma: no cover
 
     '''
 
-    artifact_cachedir = os.path.join(settings['cachedir'], 'artifacts')
-    ensure_directory_exists(artifact_cachedir)
-
-    lac = morphlib.localartifactcache.LocalArtifactCache(
-            fs.osfs.OSFS(artifact_cachedir))
+    lac = new_local_artifact_cache(settings['cachedir'])
 
     rac_url = get_artifact_cache_server(settings)
     rac = None
@@ -149,6 +165,23 @@ def new_artifact_caches(settings):  # pragma: no cover
     return lac, rac
 
 
+def new_build_history(settings):  # pragma: no cover
+    '''Create a BuildHistory instance for the build times in cachedir.'''
+
+    return morphlib.buildhistory.BuildHistory(
+        os.path.join(settings['cachedir'], 'build-history'))
+
+
+def new_source_tree_cache(settings):  # pragma: no cover
+    '''Create a SourceTreeCache in cachedir, or None if it is disabled.'''
+
+    if not settings['source-tree-cache-size']:
+        return None
+    return morphlib.sourcetreecache.SourceTreeCache(
+        os.path.join(settings['cachedir'], 'source-trees'),
+        settings['source-tree-cache-size'])
+
+
 def combine_aliases(app):  # pragma: no cover
     '''Create a full repo-alias set from the app's settings.
 
@@ -223,6 +256,7 @@ def new_repo_cache(app):  # pragma: no cover
         tarball_base_url=tarball_base_url,
         git_resolve_cache_url=git_resolve_cache_url,
         update_gits=(not app.settings['no-git-update']),
+        shallow=app.settings['shallow-git-cache'],
         runcmd_cb=app.runcmd,
         status_cb=app.status,
         verbose=app.settings['verbose'],
@@ -780,6 +814,60 @@ class ProgressBar(object):
             sys.stderr.flush()
 
 
+class PerThreadValue(object):
+
+    '''A value that each thread can set for itself.
+
+    Threads that have not set the value see the one set by the thread that
+    created the PerThreadValue.
+
+    '''
+
+    def __init__(self, value=None):
+        self._main_thread = threading.current_thread()
+        self._main_value = value
+        self._local = threading.local()
+
+    def get(self):
+        return getattr(self._local, 'value', self._main_value)
+
+    def set(self, value):
+        if threading.current_thread() is self._main_thread:
+            self._main_value = value
+        else:
+            self._local.value = value
+
+
+def run_jobs(jobs, max_jobs):
+    '''Call each function in `jobs`, running up to `max_jobs` at once.
+
+    If any of the jobs fail, the others are still run to the end, and then
+    the first job's error is raised.
+
+    '''
+
+    max_jobs = min(max_jobs, len(jobs))
+    if max_jobs <= 1:
+        errors = []
+        for job in jobs:
+            try:
+                job()
+            except Exception:
+                errors.append(sys.exc_info())
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return
+
+    pool = multiprocessing.pool.ThreadPool(max_jobs)
+    try:
+        results = [pool.apply_async(job) for job in jobs]
+    finally:
+        pool.close()
+        pool.join()
+    for result in results:
+        result.get()
+
+
 def schemas_directory():  # pragma: no cover
     '''Returns a path to the schemas/ subdirectory of the 'morphlib' module.'''
     code_dir = os.path.dirname(morphlib.__file__)
@@ -16,6 +16,7 @@
 import os
 import shutil
 import tempfile
+import threading
 import unittest
 
 import morphlib
@@ -128,3 +129,67 @@ class IterTrickleTests(unittest.TestCase):
     def test_truncated_final_sequence(self):
         self.assertEqual(list(morphlib.util.iter_trickle("barquux", 3)),
                          [["b", "a", "r"], ["q", "u", "u"], ["x"]])
+
+
+class PerThreadValueTests(unittest.TestCase):
+
+    def in_thread(self, function):
+        results = []
+        thread = threading.Thread(target=lambda: results.append(function()))
+        thread.start()
+        thread.join()
+        return results[0]
+
+    def test_other_threads_see_main_thread_value(self):
+        value = morphlib.util.PerThreadValue('main')
+        self.assertEqual(self.in_thread(value.get), 'main')
+        value.set('changed')
+        self.assertEqual(self.in_thread(value.get), 'changed')
+
+    def test_threads_set_their_own_value(self):
+        value = morphlib.util.PerThreadValue('main')
+
+        def set_and_get():
+            value.set('thread')
+            return value.get()
+
+        self.assertEqual(self.in_thread(set_and_get), 'thread')
+        self.assertEqual(value.get(), 'main')
+
+
+class RunJobsTests(unittest.TestCase):
+
+    def test_runs_jobs_one_at_a_time(self):
+        done = []
+        morphlib.util.run_jobs(
+            [lambda: done.append(1), lambda: done.append(2)], 1)
+        self.assertEqual(done, [1, 2])
+
+    def test_runs_jobs_at_once(self):
+        started = [threading.Event(), threading.Event()]
+        saw_other = []
+
+        def job(mine, other):
+            started[mine].set()
+            saw_other.append(started[other].wait(5))
+
+        morphlib.util.run_jobs([lambda: job(0, 1), lambda: job(1, 0)], 2)
+        self.assertEqual(saw_other, [True, True])
+
+    def check_raises_first_error_after_other_jobs(self, max_jobs):
+        done = []
+
+        def fail(message):
+            raise Exception(message)
+
+        jobs = [lambda: fail('first'), lambda: done.append(1),
+                lambda: fail('second')]
+        self.assertRaisesRegexp(Exception, '^first$',
+                                morphlib.util.run_jobs, jobs, max_jobs)
+        self.assertEqual(done, [1])
+
+    def test_raises_first_error_after_other_jobs(self):
+        self.check_raises_first_error_after_other_jobs(1)
+
+    def test_raises_first_error_after_other_jobs_run_at_once(self):
+        self.check_raises_first_error_after_other_jobs(3)
@@ -24,6 +24,7 @@ import tempfile
 import errno
 import stat
 import contextlib
+import multiprocessing.pool
 
 import morphlib
 
@@ -122,6 +123,98 @@ class WriteExtension(cliapp.Application):
     def process_args(self, args):
         raise NotImplementedError()
 
+    def get_system_tarball(self):
+        '''Return the system artifact to read the system from, if any.
+
+        Morph sets MORPH_SYSTEM_TARBALL when it is streaming the deployment,
+        in which case the temporary root only holds the files Morph added
+        to the system, and the rest must be read from this tarball.
+
+        '''
+        return os.environ.get('MORPH_SYSTEM_TARBALL')
+
+    def populate_root(self, temp_root, target):
+        '''Put the whole system being deployed into `target`.
+
+        Files in `temp_root` replace those of the same name in the system
+        tarball, if there is one.
+
+        '''
+        tarball = self.get_system_tarball()
+        if tarball is None:
+            self.copy_tree(temp_root, target)
+            return
+        cliapp.runcmd(['tar', '-C', target, '--numeric-owner', '-xf',
+                       tarball])
+        cliapp.runcmd(['tar', '-C', temp_root, '-cf', '-', '.'],
+                      ['tar', '-C', target, '--numeric-owner',
+                       '--no-overwrite-dir', '-xf', '-'])
+
+    def group_linked_entries(self, dirname):
+        '''Group the entries of `dirname` that share hardlinked files.
+
+        Each `cp` run only keeps the hardlinks between the files it copies,
+        so entries whose trees share an inode must be copied together.
+        Returns a list of lists of entry names.
+
+        '''
+        group_of = {}
+        groups = {}
+        inodes = {}
+        for name in sorted(os.listdir(dirname)):
+            group_of[name] = name
+            groups[name] = [name]
+            path = os.path.join(dirname, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                paths = (os.path.join(d, f)
+                         for d, subdirs, basenames in os.walk(path)
+                         for f in basenames)
+            else:
+                paths = [path]
+            for filename in paths:
+                st = os.lstat(filename)
+                if st.st_nlink < 2 or stat.S_ISDIR(st.st_mode):
+                    continue
+                other = inodes.setdefault((st.st_dev, st.st_ino), name)
+                mine, theirs = group_of[name], group_of[other]
+                if mine != theirs:
+                    for member in groups[mine]:
+                        group_of[member] = theirs
+                    groups[theirs].extend(groups.pop(mine))
+        return sorted(groups.values())
+
+    def copy_tree(self, src, dest, jobs=None):
+        '''Copy the contents of `src` into `dest`, in parallel.
+
+        Runs of zeros in files are left as holes in the copies, so the
+        disk image they are written to stays sparse.
+
+        '''
+        if jobs is None:
+            jobs = morphlib.util.cpu_count()
+        groups = self.group_linked_entries(src)
+        if jobs < 2 or len(groups) < 2:
+            cliapp.runcmd(['cp', '-a', '--sparse=always',
+                           src + '/.', dest + '/.'])
+            return
+
+        def copy(names):
+            cliapp.runcmd(['cp', '-a', '--sparse=always'] +
+                          [os.path.join(src, name) for name in names] +
+                          [dest + '/'])
+
+        pool = multiprocessing.pool.ThreadPool(min(jobs, len(groups)))
+        try:
+            results = [pool.apply_async(copy, (names,)) for names in groups]
+            for result in results:
+                result.get()
+        finally:
+            pool.close()
+            pool.join()
+        st = os.lstat(src)
+        os.chown(dest, st.st_uid, st.st_gid)
+        shutil.copystat(src, dest)
+
     def status(self, **kwargs):
         '''Provide status output.
 
@@ -229,10 +322,10 @@ class WriteExtension(cliapp.Application):
         '''Create a raw disk image.'''
 
         self.status(msg='Creating empty disk image')
+        # Truncating, rather than writing the last byte, leaves the whole
+        # image as a hole, so nothing is allocated until it is written to.
         with open(filename, 'wb') as f:
-            if size > 0:
-                f.seek(size-1)
-                f.write('\0')
+            f.truncate(size)
 
     def mkfs_btrfs(self, location):
         '''Create a btrfs filesystem on the disk.'''
@@ -295,7 +388,6 @@ class WriteExtension(cliapp.Application):
         '''Separate base OS versions from state using subvolumes.
 
         '''
-        initramfs = self.find_initramfs(temp_root)
         version_root = os.path.join(mountpoint, 'systems', version_label)
         state_root = os.path.join(mountpoint, 'state')
 
@@ -304,6 +396,8 @@ class WriteExtension(cliapp.Application):
 
         self.create_orig(version_root, temp_root)
         system_dir = os.path.join(version_root, 'orig')
+        # Look in the copy, since temp_root may not hold the whole system.
+        initramfs = self.find_initramfs(system_dir)
 
         state_dirs = self.complete_fstab_for_btrfs_layout(system_dir,
                                                           disk_uuid)
@@ -317,9 +411,9 @@ class WriteExtension(cliapp.Application):
                 version_label, os.path.join(mountpoint, 'systems', 'default'))
 
         if self.bootloader_config_is_wanted():
-            self.install_kernel(version_root, temp_root)
+            self.install_kernel(version_root, system_dir)
             if self.get_dtb_path() != '':
-                self.install_dtb(version_root, temp_root)
+                self.install_dtb(version_root, system_dir)
             self.install_syslinux_menu(mountpoint, version_root)
             if initramfs is not None:
                 self.install_initramfs(initramfs, version_root)
@@ -336,7 +430,7 @@ class WriteExtension(cliapp.Application):
         self.status(msg='Creating orig subvolume')
         cliapp.runcmd(['btrfs', 'subvolume', 'create', orig])
         self.status(msg='Copying files to orig subvolume')
-        cliapp.runcmd(['cp', '-a', temp_root + '/.', orig + '/.'])
+        self.populate_root(temp_root, orig)
 
     def create_run(self, version_root):
         '''Create the 'run' snapshot.'''
@@ -127,7 +127,8 @@ class Check(Command):
     def run(self):
         subprocess.check_call(['python', '-m', 'CoverageTestRunner',
                                '--ignore-missing-from=without-test-modules',
-                               'morphlib', 'distbuild'])
+                               'morphlib', 'distbuild',
+                               'morphcacheserver'])
         try:
             os.remove('.coverage')
         except OSError: